@@ -0,0 +1,131 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Import Time Check
+#
+# Checks that every *_benchmark.py module imports within a time budget, so that short-lived
+# worker processes are not slowed by work done at import, such as importing matplotlib or
+# building noise models. Each module is imported in a fresh interpreter, from the top level directory
+# as in the benchmark notebooks, after first importing its API package (qiskit, cirq or braket),
+# so only the time added by the benchmark and the _common modules is counted.
+# It also fails if matplotlib is imported.
+#
+# Run from the top level directory, e.g.
+#   python _common/check_import_time.py --budget 1.0
+# Benchmarks whose API package is not installed are skipped; other import errors fail the check.
+#
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+# Maximum time, in seconds, allowed for importing a benchmark module
+budget = 1.0
+
+# Modules imported before timing, for each API
+api_modules = {
+    "qiskit": [ "qiskit", "qiskit.providers.aer" ],
+    "cirq": [ "cirq" ],
+    "braket": [ "braket.circuits", "braket.devices" ],
+}
+
+# Modules that must not be imported by a benchmark module
+forbidden_modules = [ "matplotlib" ]
+
+# Script run in a fresh interpreter to time the import of one module
+# The module is skipped only if the API package (or one of its submodules) is missing; any other import error is an error
+timing_script = '''
+import importlib, json, sys, time
+api_modules, dirname, module, forbidden = json.loads(sys.argv[1])
+sys.path.insert(0, dirname)
+packages = set(name.split(".")[0] for name in api_modules)
+def check_missing_api(e):
+    if e.name != None and any(e.name == p or e.name.startswith(p + ".") for p in packages):
+        print(json.dumps({"status": "skipped", "error": str(e)}))
+        sys.exit(0)
+    print(json.dumps({"status": "error", "error": f"{type(e).__name__}: {e}"}))
+    sys.exit(0)
+try:
+    for name in api_modules:
+        importlib.import_module(name)
+except ImportError as e:
+    check_missing_api(e)
+t = time.perf_counter()
+try:
+    importlib.import_module(module)
+except ImportError as e:
+    check_missing_api(e)
+elapsed = time.perf_counter() - t
+imported = [name for name in forbidden if name in sys.modules]
+print(json.dumps({"status": "ok", "time": elapsed, "forbidden": imported}))
+'''
+
+# Find all benchmark modules below the given directory
+def find_benchmarks (top="."):
+    return sorted(glob.glob(os.path.join(top, "**", "*_benchmark.py"), recursive=True))
+
+# Import one benchmark module in a fresh interpreter and return the result dict
+def time_import (path, top="."):
+    dirname, filename = os.path.split(path)
+    api = os.path.basename(dirname)
+    module = filename[:-3]
+    args = json.dumps([api_modules.get(api, []), os.path.abspath(dirname), module, forbidden_modules])
+
+    proc = subprocess.run([sys.executable, "-c", timing_script, args], cwd=top,
+            capture_output=True, text=True)
+
+    # the last line of output holds the result, as the module may print when imported
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or len(lines) == 0:
+        return { "status": "error", "error": proc.stderr.strip().splitlines()[-1:] }
+    return json.loads(lines[-1])
+
+# Check the import time of all benchmark modules
+# Returns the number of modules that failed the check
+def check_all (top=".", budget=budget):
+    num_failed = 0
+    for path in find_benchmarks(top):
+        result = time_import(path, top)
+
+        if result["status"] == "ok":
+            if result["forbidden"]:
+                result["status"] = "FAILED"
+                result["error"] = f'imports {", ".join(result["forbidden"])}'
+            elif result["time"] > budget:
+                result["status"] = "FAILED"
+                result["error"] = f"over budget of {budget:.2f} secs"
+
+        if result["status"] in ("FAILED", "error"):
+            num_failed += 1
+
+        time_str = f'{result["time"]:.3f} secs' if "time" in result else ""
+        print(f'{path:<70} {result["status"]:<8} {time_str} {result.get("error", "")}')
+
+    return num_failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the import time of all benchmark modules")
+    parser.add_argument("--budget", type=float, default=budget, help="maximum import time in seconds")
+    parser.add_argument("--top", default=".", help="top level directory of the benchmarks")
+    args = parser.parse_args()
+
+    num_failed = check_all(args.top, args.budget)
+    print(f"... {num_failed} benchmark modules failed the import time check")
+    sys.exit(1 if num_failed > 0 else 0)
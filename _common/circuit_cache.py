@@ -0,0 +1,167 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Circuit Cache Module
+#
+# This module keeps the circuits generated by the Qiskit benchmarks on disk, so that later runs load them
+# rather than building and decomposing them again. Circuits are stored as QPY,
+# under a key made from the app, method, width, circuit id, the function preparing it for execution
+# (such as flatten_circuit), and a version of the code that creates them: a hash of the source files given, and of the API package version.
+# Any change to the benchmark code therefore creates new cache entries rather than using stale ones.
+# Functions that a caller may replace (e.g. the function and distribution of monte-carlo) are added to the key
+# as options, with function_key().
+#
+# The cache is disabled by default; enable it with:
+#   import circuit_cache
+#   circuit_cache.enabled = True
+#
+# As the random choices for each circuit are seeded by (app, width, circuit index) (see seeding.py),
+# the circuits of a run are the same whether created or loaded from the cache.
+#
+
+import functools
+import hashlib
+import inspect
+import json
+import marshal
+import os
+import tempfile
+import time
+
+# Enable loading and storing circuits in the cache
+enabled = False
+
+# Directory containing the cached circuits
+cache_dir = "__cache/circuits"
+
+# Version of the cache format; change to invalidate all cached circuits
+cache_version = 1
+
+# File extension for the circuits of each API (only Qiskit circuits are cached)
+file_extensions = { "qiskit": ".qpy" }
+
+# Hashes of source files, computed once per process
+_source_hashes = {}
+
+
+##### Key methods
+
+# Return a hash of the source file of a path, module, class or function (including wrapped functions, e.g. cached)
+def source_hash (source):
+    path = source if isinstance(source, str) else inspect.getsourcefile(inspect.unwrap(source))
+    path = os.path.abspath(path)
+    if path not in _source_hashes:
+        with open(path, 'rb') as f:
+            _source_hashes[path] = hashlib.sha256(f.read()).hexdigest()
+    return _source_hashes[path]
+
+# Return the version of the API package used to create circuits
+def api_version (api):
+    if api == "qiskit":
+        import qiskit
+        return qiskit.__version__
+    return None
+
+# Return a description of a function for use in a cache key: its module and qualified name, and a hash of its code
+# (so that functions defined with the same name, e.g. in notebooks, differ), with the arguments bound by functools.partial
+def function_key (f):
+    if isinstance(f, functools.partial):
+        return [ function_key(f.func), list(f.args), f.keywords ]
+
+    name = f"{getattr(f, '__module__', None)}.{getattr(f, '__qualname__', repr(f))}"
+    code = getattr(f, "__code__", None)
+    if code == None:
+        return name
+    return f"{name}:{hashlib.sha256(marshal.dumps(code)).hexdigest()[:16]}"
+
+# Return the cache key for a circuit; 'options' are any other parameters used to create it
+def circuit_key (app, method, width, circuit_id, prepare=None, sources=(), api="qiskit", options=None):
+    if prepare != None:
+        sources = tuple(sources) + (prepare,)
+    inputs = [ cache_version, api, api_version(api), app, method, width, str(circuit_id),
+            prepare.__name__ if prepare != None else None,
+            [ source_hash(source) for source in sources ], options ]
+    return hashlib.sha256(json.dumps(inputs, default=str).encode()).hexdigest()
+
+# Return the filename for a cache key
+def circuit_file (app, key, api="qiskit"):
+    return os.path.join(cache_dir, app, key + file_extensions[api])
+
+
+##### Load and store methods
+
+# Load a circuit from a file, or return None if there is no such file
+def load_circuit (filename, api="qiskit"):
+    if not os.path.exists(filename):
+        return None
+
+    try:
+        if api == "qiskit":
+            from qiskit import qpy
+            with open(filename, 'rb') as f:
+                return qpy.load(f)[0]
+
+    except Exception as e:
+        print(f"ERROR: unable to load cached circuit {filename}")
+        print(f"... exception = {e}")
+
+    return None
+
+# Store a circuit in a file, replacing it atomically
+def store_circuit (filename, qc, api="qiskit"):
+    dirname = os.path.dirname(filename)
+    os.makedirs(dirname, exist_ok=True)
+
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        if api == "qiskit":
+            from qiskit import qpy
+            with os.fdopen(fd, 'wb') as f:
+                qpy.dump(qc, f)
+
+        os.replace(tmpname, filename)
+
+    except Exception as e:
+        print(f"ERROR: unable to store circuit in cache {filename}")
+        print(f"... exception = {e}")
+        if os.path.exists(tmpname): os.remove(tmpname)
+
+# Return the circuit for the given key, loaded from the cache, or created with the 'create' function,
+# prepared for execution with the 'prepare' function (e.g. flatten_circuit), and stored in the cache.
+# 'sources' are the files, modules or functions whose code creates the circuit,
+# and 'options' any parameters used to create it other than those in the key.
+# Returns the circuit and the elapsed time to create it (or to load it, if cached), as measured by the other benchmarks.
+def get_circuit (create, app, method, width, circuit_id, prepare=None, sources=(), api="qiskit", options=None):
+
+    if enabled:
+        ts = time.time()
+        filename = circuit_file(app, circuit_key(app, method, width, circuit_id, prepare, sources, api, options), api)
+        qc = load_circuit(filename, api)
+        if qc != None:
+            return qc, time.time() - ts
+
+    ts = time.time()
+    qc = create()
+    create_time = time.time() - ts
+
+    if prepare != None:
+        qc = prepare(qc)
+
+    if enabled:
+        store_circuit(filename, qc, api)
+
+    return qc, create_time
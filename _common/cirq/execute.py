@@ -25,7 +25,9 @@
 
 import time
 import copy
+import collections
 import metrics
+import metrics_events
 
 import cirq
 backend = cirq.Simulator()      # Use Cirq Simulator by default
@@ -107,6 +109,9 @@ def submit_circuit (qc, group_id, circuit_id, shots=100):
         { "qc": qc, "group": str(group_id), "circuit": str(circuit_id),
             "submit_time": time.time(), "shots": shots }
     );
+    
+    metrics_events.publish("circuit_submitted", group=str(group_id), circuit=str(circuit_id),
+            shots=shots, active=len(active_circuits), batched=len(batched_circuits))
     #print("... submit circuit - ", str(batched_circuits[len(batched_circuits)-1]))
     
     
@@ -170,12 +175,22 @@ def job_complete (job):
     if actual_shots != active_circuit["shots"]:
         print(f"WARNING: requested shots not equal to actual shots: {actual_shots}")
         
+    # retain the measured counts for export as raw data, if enabled
+    if metrics.save_raw_data:
+        counts = collections.Counter(''.join(str(int(bit)) for bit in row) for row in measurements)
+        metrics.store_counts(active_circuit["group"], active_circuit["circuit"], counts)
+        
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'elapsed_time',
         time.time() - active_circuit["submit_time"])
         
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'exec_time',
         time.time() - active_circuit["launch_time"])
     
+    metrics_events.publish("circuit_completed", group=active_circuit["group"], circuit=active_circuit["circuit"],
+            elapsed_time=time.time() - active_circuit["submit_time"],
+            exec_time=time.time() - active_circuit["launch_time"],
+            active=len(active_circuits) - 1, batched=len(batched_circuits))
+    
     # If a handler has been established, invoke it here with result object
     if result_handler:
         result_handler(active_circuit["qc"],
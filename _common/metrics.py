@@ -31,14 +31,27 @@
 import os
 import json
 import time
+import tempfile
+import hashlib
+from contextlib import contextmanager
 from time import gmtime, strftime
 from datetime import datetime
 
+import metrics_events
+
+# file locking is platform specific
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 # Raw and aggregate circuit metrics
 circuit_metrics = {  }
+circuit_counts = {  }
 group_metrics = { "groups": [],
-    "avg_create_times": [], "avg_elapsed_times": [], "avg_exec_times": [], "avg_fidelities": [],
-    "avg_depths": [], "avg_xis": [], "avg_tr_depths": [], "avg_tr_xis": [],
+    "avg_create_times": [], "avg_elapsed_times": [], "avg_exec_times": [], "avg_fidelities": [], "avg_transpile_times": [],
+    "avg_depths": [], "avg_xis": [], "avg_tr_depths": [], "avg_tr_xis": [], "avg_tr_sizes": [],
     "avg_exec_creating_times": [], "avg_exec_validating_times": [], "avg_exec_running_times": []
 }
 
@@ -57,9 +70,29 @@ verbose = False
 # Option to save metrics to data file
 save_metrics = True 
 
+# Option to also save every run, including raw circuit metrics, to the metrics database
+save_metrics_db = False
+
+# Option to export the raw metrics and measured counts of each circuit to binary files (see metrics_raw.py)
+save_raw_data = False
+
 # Option to save plot images (all of them)
 save_plot_images = True
 
+# File formats in which plot images are saved
+plot_image_formats = [ "jpg", "pdf" ]
+
+# Option to show plots; if False, each figure is closed once saved (e.g. when rendering headless)
+show_plots = True
+
+# Option to skip drawing plots whose images were already saved from the same data and options
+# Only applies when plots are not shown (show_plots = False), as shown plots must be drawn anyway
+cache_plot_images = True
+
+# Option to defer plotting: plot_metrics() only saves the metrics, and figures are
+# rendered later from the saved data in a separate process (see metrics_render.py)
+defer_plots = False
+
 # Option to generate volumetric positioning charts
 do_volumetric_plots = True
 
@@ -102,6 +135,7 @@ def init_metrics ():
     
     # create empty dictionary for circuit metrics
     circuit_metrics.clear()
+    circuit_counts.clear()
     
     # create empty arrays for group metrics
     group_metrics["groups"] = []
@@ -110,11 +144,13 @@ def init_metrics ():
     group_metrics["avg_elapsed_times"] = []
     group_metrics["avg_exec_times"] = []
     group_metrics["avg_fidelities"] = []
+    group_metrics["avg_transpile_times"] = []
     
     group_metrics["avg_depths"] = []
     group_metrics["avg_xis"] = []
     group_metrics["avg_tr_depths"] = []
     group_metrics["avg_tr_xis"] = []
+    group_metrics["avg_tr_sizes"] = []
     
     group_metrics["avg_exec_creating_times"] = []
     group_metrics["avg_exec_validating_times"] = []
@@ -123,6 +159,8 @@ def init_metrics ():
     # store the start of execution for the current app
     start_time = time.time()
     print(f'... execution starting at {strftime("%Y-%m-%d %H:%M:%S", gmtime())}')
+    
+    metrics_events.publish("app_start", start_time=start_time)
 
 # End metrics collection for an application
 def end_metrics():
@@ -132,6 +170,8 @@ def end_metrics():
     print(f'... execution complete at {strftime("%Y-%m-%d %H:%M:%S", gmtime())}')
     print("")
     
+    metrics_events.publish("app_end", start_time=start_time, end_time=end_time)
+    
     
 ##### Metrics methods
 
@@ -145,6 +185,19 @@ def store_metric (group, circuit, metric, value):
         circuit_metrics[group][circuit] = { }
     circuit_metrics[group][circuit][metric] = value
     #print(f'{group} {circuit} {metric} -> {value}')
+    
+    if metrics_events.subscribers:
+        metrics_events.publish("metric", group=group, circuit=circuit, metric=metric, value=value)
+
+# Store the measured counts for a circuit, retained only if exporting raw data
+def store_counts (group, circuit, counts):
+    if not save_raw_data:
+        return
+    group = str(group)
+    circuit = str(circuit)
+    if group not in circuit_counts:
+        circuit_counts[group] = { }
+    circuit_counts[group][circuit] = dict(counts)
 
 
 # Aggregate metrics for a specific group, creating average across circuits in group
@@ -158,10 +211,12 @@ def aggregate_metrics_for_group (group):
         group_elapsed_time = 0
         group_exec_time = 0
         group_fidelity = 0
+        group_transpile_time = 0
         group_depth = 0
         group_xi = 0
         group_tr_depth = 0
         group_tr_xi = 0
+        group_tr_size = 0
         group_exec_creating_time = 0
         group_exec_validating_time = 0
         group_exec_running_time = 0
@@ -176,11 +231,13 @@ def aggregate_metrics_for_group (group):
                 if metric == "elapsed_time": group_elapsed_time += value
                 if metric == "exec_time": group_exec_time += value
                 if metric == "fidelity": group_fidelity += value
+                if metric == "transpile_time": group_transpile_time += value
                 
                 if metric == "depth": group_depth += value
                 if metric == "xi": group_xi += value
                 if metric == "tr_depth": group_tr_depth += value
                 if metric == "tr_xi": group_tr_xi += value
+                if metric == "tr_size": group_tr_size += value
                 
                 if metric == "exec_creating_time": group_exec_creating_time += value
                 if metric == "exec_validating_time": group_exec_validating_time += value
@@ -191,11 +248,13 @@ def aggregate_metrics_for_group (group):
         avg_elapsed_time = round(group_elapsed_time / num_circuits, 3)
         avg_exec_time = round(group_exec_time / num_circuits, 3)
         avg_fidelity = round(group_fidelity / num_circuits, 3)
+        avg_transpile_time = round(group_transpile_time / num_circuits, 3)
         
         avg_depth = round(group_depth / num_circuits, 0)
         avg_xi = round(group_xi / num_circuits, 3)
         avg_tr_depth = round(group_tr_depth / num_circuits, 0)
         avg_tr_xi = round(group_tr_xi / num_circuits, 3)
+        avg_tr_size = round(group_tr_size / num_circuits, 0)
         
         avg_exec_creating_time = round(group_exec_creating_time / num_circuits, 3)
         avg_exec_validating_time = round(group_exec_validating_time / num_circuits, 3)
@@ -208,6 +267,7 @@ def aggregate_metrics_for_group (group):
         group_metrics["avg_elapsed_times"].append(avg_elapsed_time)
         group_metrics["avg_exec_times"].append(avg_exec_time)
         group_metrics["avg_fidelities"].append(avg_fidelity)
+        group_metrics["avg_transpile_times"].append(avg_transpile_time)
         
         if avg_depth > 0:
             group_metrics["avg_depths"].append(avg_depth)
@@ -217,6 +277,8 @@ def aggregate_metrics_for_group (group):
             group_metrics["avg_tr_depths"].append(avg_tr_depth)
         if avg_tr_xi > 0:
             group_metrics["avg_tr_xis"].append(avg_tr_xi)
+        if avg_tr_size > 0:
+            group_metrics["avg_tr_sizes"].append(avg_tr_size)
         
         if avg_exec_creating_time > 0:
             group_metrics["avg_exec_creating_times"].append(avg_exec_creating_time)
@@ -317,10 +379,34 @@ def finalize_group(group):
         print("************")
         report_metrics_for_group(group)
         
+        # publish the averages just added for this group
+        if metrics_events.subscribers:
+            num_groups = len(group_metrics["groups"])
+            averages = { key: values[-1] for key, values in group_metrics.items()
+                    if key != "groups" and len(values) == num_groups and num_groups > 0 }
+            metrics_events.publish("group_complete", group=group,
+                    num_circuits=len(circuit_metrics[group]), metrics=averages)
+        
+        # export the raw data for this group, as it is now complete
+        if save_raw_data:
+            store_raw_group(group)
+        
     # sort the group metrics (sometimes they come back out of order)
     sort_group_metrics()
         
         
+# Write the circuit metrics and counts for a completed group to the raw data files
+def store_raw_group(group):
+    import metrics_raw
+    backend_id = circuit_metrics.get("subtitle") or "Device = unknown"
+    backend_id = backend_id[9:]
+    try:
+        metrics_raw.write_group(backend_id, start_time, group,
+                circuit_metrics[group], circuit_counts.get(group))
+    except Exception as e:
+        print(f"ERROR: unable to export raw data for group {group}")
+        print(f"... exception = {e}")
+        
 # sort the group array as integers, then all metrics relative to it
 def sort_group_metrics():
 
@@ -339,7 +425,9 @@ def sort_group_metrics():
 ##########################################
 # ANALYSIS AND VISUALIZATION
 
-import matplotlib.pyplot as plt
+# matplotlib is imported by init_plotting() when first needed, so that importing this module
+# does not pay its startup cost in processes that only collect metrics
+plt = None
     
 # Plot bar charts for each metric over all groups
 def plot_metrics (suptitle="Circuit Width (Number of Qubits)", transform_qubit_group = False, new_qubit_group = None, filters=None, suffix=""):
@@ -355,6 +443,10 @@ def plot_metrics (suptitle="Circuit Width (Number of Qubits)", transform_qubit_g
     
     backend_id = subtitle[9:]   
 
+    metrics_events.publish("app_metrics", app=suptitle, backend_id=backend_id,
+            groups=new_qubit_group if transform_qubit_group else group_metrics["groups"],
+            group_metrics=group_metrics)
+
     # save the metrics for current application to the DATA file, one file per device
     if save_metrics:
         #data = group_metrics
@@ -372,6 +464,9 @@ def plot_metrics (suptitle="Circuit Width (Number of Qubits)", transform_qubit_g
             store_app_metrics(backend_id, circuit_metrics, group_metrics, suptitle,
                 start_time=start_time, end_time=end_time)
 
+    # when deferring plots, the figures are rendered later from the saved data
+    if defer_plots:
+        return
         
     if len(group_metrics["groups"]) == 0:
         print(f"\n{suptitle}")
@@ -381,6 +476,15 @@ def plot_metrics (suptitle="Circuit Width (Number of Qubits)", transform_qubit_g
     # sort the group metrics (in case they weren't sorted when collected)
     sort_group_metrics()
     
+    # skip drawing if the images for the same data and options were saved already
+    cache_key = plot_cache_key("plot_metrics", suptitle, subtitle, group_metrics,
+            transform_qubit_group, new_qubit_group, filters, suffix)
+    if plot_cache_lookup(backend_id, cache_key):
+        print(f"... plot images for {appname} are unchanged, not drawn")
+        return
+    plot_cache_begin()
+    init_plotting()
+    
     # flags for charts to show
     do_creates = True
     do_executes = True
@@ -500,7 +604,7 @@ def plot_metrics (suptitle="Circuit Width (Number of Qubits)", transform_qubit_g
         save_plot_image(plt, f"{appname}-metrics" + suffix, backend_id) 
             
     # show the plot for user to see
-    plt.show()
+    show_plot()
     
     ###################### Volumetric Plot
     
@@ -557,7 +661,9 @@ def plot_metrics (suptitle="Circuit Width (Number of Qubits)", transform_qubit_g
             save_plot_image(plt, f"{appname}-vplot", backend_id) 
         
         #display plot
-        plt.show()       
+        show_plot()       
+
+    plot_cache_store(backend_id, cache_key)
 
     
 # Plot metrics over all groups (2)
@@ -566,6 +672,8 @@ def plot_metrics_all_overlaid (shared_data, backend_id, suptitle=None, imagename
     global circuit_metrics
     global group_metrics
     
+    init_plotting()
+    
     subtitle = circuit_metrics["subtitle"]
     
     print("Overlaid Results From All Applications")
@@ -633,7 +741,7 @@ def plot_metrics_all_overlaid (shared_data, backend_id, suptitle=None, imagename
         save_plot_image(plt, imagename, backend_id) 
     
     #display plot
-    plt.show()    
+    show_plot()    
 
 
 # Plot metrics over all groups (2), merging data from all apps into smaller cells
@@ -647,6 +755,15 @@ def plot_metrics_all_merged (shared_data, backend_id, suptitle=None, imagename="
     
     #print(f"... {max_depth_log}")
     
+    # skip drawing if the image for the same data and options was saved already
+    cache_key = plot_cache_key("plot_metrics_all_merged", imagename, avail_qubits,
+            { app: shared_data[app]["group_metrics"] for app in shared_data })
+    if plot_cache_lookup(backend_id, cache_key):
+        print(f"... plot image {imagename} is unchanged, not drawn")
+        return
+    plot_cache_begin()
+    init_plotting()
+    
     #if True:
     try:
         #print(f"... {d_data} {d_tr_data}")
@@ -666,13 +783,10 @@ def plot_metrics_all_merged (shared_data, backend_id, suptitle=None, imagename="
         
         ax = plot_volumetric_background(max_qubits, QV, depth_base, suptitle=suptitle, avail_qubits=avail_qubits)
         
-        # create 2D array to hold merged value arrays with gradations, one array for each qubit size
+        # create 2D arrays to hold merged values with gradations, one row for each qubit size
         num_grads = 4
-        depth_values_merged = []
-        for w in range(max_qubits):
-            depth_values_merged.append([ None ] * (num_grads * max_depth_log))
-        
-        #print(depth_values_merged)
+        merged_values = np.zeros((max_qubits, num_grads * max_depth_log))
+        merged_counts = np.zeros((max_qubits, num_grads * max_depth_log), dtype=int)
             
         # run through depth metrics for all apps, splitting cells into gradations
         for app in shared_data:
@@ -699,56 +813,36 @@ def plot_metrics_all_merged (shared_data, backend_id, suptitle=None, imagename="
             d_tr_data = group_metrics["avg_tr_depths"]
             f_data = group_metrics["avg_fidelities"]
     
-            #plot_volumetric_data(ax, w_data, d_tr_data, f_data, depth_base,
-                   #label=appname, labelpos=(0.4, 0.6), labelrot=50, type=1)  
-
             # aggregate value metrics for each depth cell over all apps
-            for i in range(len(d_data)):
-                x = depth_index(d_tr_data[i], depth_base)
-                y = float(w_data[i])
-                f = f_data[i]
-                
-                # accumulate largest width for all apps
-                w_max = max(w_max, y)
-                
-                xp = x * 4
-                
-                if x > max_depth_log - 1:
-                    print(f"... data out of chart range, skipped; w={y} d={d_tr_data[i]}")
-                    continue;
-                    
-                for grad in range(num_grads):
-                    e = depth_values_merged[int(w_data[i])][int(xp + grad)]
-                    if e == None: 
-                        e = { "value": 0.0, "count": 0 }
-                    e["count"] += 1
-                    e["value"] += f
-                    depth_values_merged[int(w_data[i])][int(xp + grad)] = e
+            n = len(d_data)
+            x = np.log(np.asarray(d_tr_data[:n], dtype=float)) / math.log(depth_base) + 1
+            w = np.asarray(w_data[:n], dtype=float)
+            f = np.asarray(f_data[:n], dtype=float)
+            
+            # accumulate largest width for all apps
+            if n > 0: w_max = max(w_max, w.max())
+            
+            in_range = x <= max_depth_log - 1
+            for i in np.flatnonzero(~in_range):
+                print(f"... data out of chart range, skipped; w={w[i]} d={d_tr_data[i]}")
+            
+            xp = x[in_range] * 4
+            wi = w[in_range].astype(int)
+            for grad in range(num_grads):
+                di = (xp + grad).astype(int)
+                np.add.at(merged_values, (wi, di), f[in_range])
+                np.add.at(merged_counts, (wi, di), 1)
                     
-        #print(depth_values_merged)
-        
         # compute and plot the average fidelity at each width / depth gradation with narrow filled rects 
-        for wi in range(len(depth_values_merged)):
-            w = depth_values_merged[wi]
-            #print(f"... w = {w}")
+        wi, di = np.nonzero(merged_counts)
+        if len(wi) > 0:
+            f = merged_values[wi, di] / merged_counts[wi, di]
             
-            for di in range(len(w)):
+            # move half cell to left, to account for num grads
+            x = di / 4 - 0.25
+            y = wi.astype(float)
             
-                e = w[di]
-                
-                if e != None:
-                    e["value"] /= e["count"]
-                    e["count"] = 1
-                
-                    x = di / 4
-                    
-                    # move half cell to left, to account for num grads
-                    x -= 0.25
-                    
-                    y = float(wi)
-                    f = e["value"]
-                    
-                    ax.add_patch(box4_at(x, y, f, type=1, fill=True))
+            ax.add_collection(data_boxes4_at(x, y, f), autolim=False)
         
         #print("**** merged...")
         #print(depth_values_merged)
@@ -807,7 +901,9 @@ def plot_metrics_all_merged (shared_data, backend_id, suptitle=None, imagename="
         save_plot_image(plt, imagename, backend_id)
 
     #display plot
-    plt.show()
+    show_plot()
+
+    plot_cache_store(backend_id, cache_key)
 
 
 ### plot metrics across all apps for a backend_id
@@ -867,6 +963,8 @@ def plot_all_app_metrics(backend_id, do_all_plots=False,
         plot_metrics_all_overlaid(shared_data, backend_id, suptitle=suptitle, imagename="_ALL-vplot-2")
         '''
         
+        init_plotting()
+        
         # draw the volumetric plots with two different colormaps, for comparison purposes
         
         #suptitle = f"Volumetric Positioning - All Applications (Merged)\nDevice={backend_id}  {timestr} UTC"
@@ -906,78 +1004,357 @@ def plot_metrics_for_app(backend_id, appname, apiname="Qiskit", filters=None, su
     plot_metrics(app, filters=filters, suffix=suffix)
 
  
-##### Data File Methods      
-     
-# Save the application metrics data to a shared file for the current device
+##### Data File Methods
+
+# Results for each device are kept in two files in the __data directory:
+#   DATA-<backend>.jsonl  - append-only run log, one json record per call to store_app_metrics
+#   DATA-<backend>.json   - compacted view of the latest results for each app (the original format)
+# The byte offset of the run log already folded into the compacted view is kept in DATA-<backend>.offset
+# When the run log is compacted, it is rotated to DATA-<backend>.jsonl.old (replacing the previous one)
+# and a new run log is started, so the run log does not grow without limit
+# All changes to these files are serialized with an exclusive lock on DATA-<backend>.lock,
+# so that multiple processes running apps on the same backend may store results safely.
+# Readers take a shared lock on the same file, and create nothing, so data directories may be read-only.
+
+# Number of run log records to accumulate before folding them into the compacted DATA file
+compact_threshold = 16
+
+# Directory containing the data files
+data_dir = "__data"
+
+# Return the base path for the data files of the given backend
+def data_file_base (backend_id):
+
+    # don't leave slashes in the filename
+    backend_id = backend_id.replace("/", "_")
+
+    return os.path.join(data_dir, f"DATA-{backend_id}")
+
+# Acquire an exclusive lock on the data files of the given backend, for use in a 'with' statement
+def data_file_lock (backend_id):
+
+    # be sure we have a __data directory
+    os.makedirs(data_dir, exist_ok=True)
+
+    return file_lock(data_file_base(backend_id) + ".lock")
+
+# Acquire a shared lock on the data files of the given backend, for reading them in a 'with' statement
+def data_file_read_lock (backend_id):
+    return file_lock(data_file_base(backend_id) + ".lock", shared=True)
+
+# Acquire an exclusive lock on the given lock file, for use in a 'with' statement
+# A shared lock does not create the lock file; if there is none, or it can't be opened, nothing is locked
+# (no data has been stored there, or the directory is read-only). On Windows, a shared lock is exclusive.
+@contextmanager
+def file_lock (filename, shared=False):
+    if shared:
+        try:
+            lockfile = open(filename, 'r')
+        except OSError:
+            yield
+            return
+    else:
+        lockfile = open(filename, 'a+')
+    try:
+        if fcntl != None:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            lockfile.seek(0)
+            msvcrt.locking(lockfile.fileno(), msvcrt.LK_LOCK, 1)
+        yield
+
+    finally:
+        if fcntl != None:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+        else:
+            lockfile.seek(0)
+            msvcrt.locking(lockfile.fileno(), msvcrt.LK_UNLCK, 1)
+        lockfile.close()
+
+# Write data to a json file atomically, by writing a temporary file and moving it into place
+def write_json_atomic (filename, data, indent=2):
+    dirname = os.path.dirname(filename) or '.'
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpname, filename)
+
+    except:
+        if os.path.exists(tmpname): os.remove(tmpname)
+        raise
+
+# Save the application metrics data to the run log for the current device
 def store_app_metrics (backend_id, circuit_metrics, group_metrics, app, start_time=None, end_time=None):
     # print(f"... storing {title} {group_metrics}")
-    
+
     # don't leave slashes in the filename
     backend_id = backend_id.replace("/", "_")
-    
-    # load the current data file of all apps
-    api = "qiskit"
-    shared_data = load_app_metrics(api, backend_id)
-    
-    # if there are no previous data for this app, init empty dict 
+
+    # create a single line record for this run of the app
+    record = { "app": app, "backend_id": backend_id,
+        "start_time": start_time, "end_time": end_time,
+        "group_metrics": group_metrics }
+
+    # if saving raw circuit data, add it too
+    #record["circuit_metrics"] = circuit_metrics
+
+    line = json.dumps(record, sort_keys=True)
+
+    with data_file_lock(backend_id):
+
+        # append the record to the run log; this is cheap and does not depend on the size of the log
+        logname = data_file_base(backend_id) + ".jsonl"
+        with open(logname, 'a') as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        # fold the run log into the compacted view once enough records have accumulated
+        offset = read_log_offset(backend_id)
+        if len(read_run_log(backend_id, offset)) >= compact_threshold:
+            compact_app_metrics_locked(backend_id)
+
+    # identify the raw data files written for this run by the app, if enabled
+    if save_raw_data and start_time != None:
+        import metrics_raw
+        metrics_raw.write_run_info(backend_id, app, start_time, end_time)
+
+    # retain the full history of runs in the metrics database, if enabled
+    if save_metrics_db:
+        import metrics_db
+        conn = metrics_db.connect()
+        try:
+            metrics_db.store_run(conn, backend_id, app, group_metrics, circuit_metrics,
+                    start_time=start_time, end_time=end_time, source="run")
+        finally:
+            conn.close()
+
+# Fold all run log records into the compacted DATA file for the given device
+def compact_app_metrics (backend_id):
+    with data_file_lock(backend_id):
+        compact_app_metrics_locked(backend_id)
+
+# Compact the data files; the caller must hold the data file lock
+def compact_app_metrics_locked (backend_id):
+    base = data_file_base(backend_id)
+
+    shared_data = load_compacted_metrics(backend_id)
+
+    # apply all records not yet contained in the compacted view
+    offset = read_log_offset(backend_id)
+    for record in read_run_log(backend_id, offset):
+        apply_run_record(shared_data, record)
+
+    # write the compacted view, then rotate the run log and reset the offset to the start of a new log
+    # if interrupted before the log is rotated, records are simply applied again (idempotent);
+    # once it is rotated, the offset is past the end of the (missing) log and is treated as 0
+    write_json_atomic(base + ".json", shared_data)
+
+    logname = base + ".jsonl"
+    if os.path.exists(logname):
+        os.replace(logname, logname + ".old")
+    write_log_offset(backend_id, 0)
+
+# Read the byte offset of the run log already contained in the compacted DATA file
+def read_log_offset (backend_id):
+    base = data_file_base(backend_id)
+    offset = 0
+
+    if os.path.exists(base + ".offset"):
+        try:
+            with open(base + ".offset", 'r') as f:
+                offset = int(f.read().strip() or 0)
+        except:
+            offset = 0
+
+    # if the log has been removed or replaced, start over from the beginning
+    logname = base + ".jsonl"
+    if not os.path.exists(logname) or offset > os.path.getsize(logname):
+        offset = 0
+
+    return offset
+
+# Save the byte offset of the run log already contained in the compacted DATA file
+def write_log_offset (backend_id, offset):
+    base = data_file_base(backend_id)
+    tmpname = base + ".offset.tmp"
+    with open(tmpname, 'w') as f:
+        f.write(str(offset))
+    os.replace(tmpname, base + ".offset")
+
+# Read the records in the run log for a device, starting at the given byte offset
+# If previous, read the run log rotated at the last compaction instead
+# Returns a list of run records, in the order they were stored
+def read_run_log (backend_id, offset=0, previous=False):
+    logname = data_file_base(backend_id) + (".jsonl.old" if previous else ".jsonl")
+    records = []
+
+    if not os.path.exists(logname):
+        return records
+
+    with open(logname, 'r') as f:
+        f.seek(offset)
+        for line in f:
+            line = line.strip()
+            if len(line) < 1: continue
+
+            # skip any record that is incomplete or corrupted
+            try:
+                records.append(json.loads(line))
+            except:
+                print(f"... skipping unreadable record in run log {logname}")
+
+    return records
+
+# Apply one run log record to a dict of app metrics, replacing any previous data for the app
+def apply_run_record (shared_data, record):
+    app = record["app"]
+
+    # if there are no previous data for this app, init empty dict
     if app not in shared_data:
         shared_data[app] = { "circuit_metrics":None, "group_metrics":None }
-    
-    shared_data[app]["backend_id"] = backend_id
-    shared_data[app]["start_time"] = start_time
-    shared_data[app]["end_time"] = end_time
-    
-    shared_data[app]["group_metrics"] = group_metrics
-    
-    # if saving raw circuit data, add it too
-    #shared_data[app]["circuit_metrics"] =circuit_metrics
-    
-    # be sure we have a __data directory
-    if not os.path.exists('__data'): os.makedirs('__data')
-    
-    # create filename based on the backend_id
-    filename = f"__data/DATA-{backend_id}.json"
-    
-    # overwrite the existing file with the merged data
-    with open(filename, 'w+') as f:
-        json.dump(shared_data, f, indent=2, sort_keys=True)
-        f.close()
- 
-# Load the application metrics from the given data file
-# Returns a dict containing circuit and group metrics
-def load_app_metrics (api, backend_id):
 
-    # don't leave slashes in the filename
-    backend_id = backend_id.replace("/", "_")
+    shared_data[app]["backend_id"] = record["backend_id"]
+    shared_data[app]["start_time"] = record["start_time"]
+    shared_data[app]["end_time"] = record["end_time"]
+
+    shared_data[app]["group_metrics"] = record["group_metrics"]
+
+    if "circuit_metrics" in record:
+        shared_data[app]["circuit_metrics"] = record["circuit_metrics"]
+
+# Load the compacted application metrics from the DATA file for the given device
+def load_compacted_metrics (backend_id):
+
+    filename = data_file_base(backend_id) + ".json"
 
-    filename = f"__data/DATA-{backend_id}.json"
-    
     shared_data = None
-    
+
     # attempt to load shared_data from file
     if os.path.exists(filename) and os.path.isfile(filename):
         with open(filename, 'r') as f:
-            
+
             # attempt to load shared_data dict as json
             try:
                 shared_data = json.load(f)
-                
+
             except:
                 pass
-            
+
     # create empty shared_data dict if not read from file
     if shared_data == None:
         shared_data = {}
-    
-    # temporary: to read older format files ...     
+
+    # temporary: to read older format files ...
     for app in shared_data:
         if "group_metrics" not in shared_data[app]:
             print(f"... upgrading version of app data {app}")
             shared_data[app] = { "circuit_metrics":None, "group_metrics":shared_data[app] }
- 
+
+    return shared_data
+
+# Load the application metrics from the given data file, including any records in the run log
+# Only reads the data files, under a shared lock, so it may be used on a read-only baseline directory
+# Returns a dict containing circuit and group metrics
+def load_app_metrics (api, backend_id):
+
+    with data_file_read_lock(backend_id):
+        shared_data = load_compacted_metrics(backend_id)
+
+        # apply any records that have not yet been compacted
+        offset = read_log_offset(backend_id)
+        for record in read_run_log(backend_id, offset):
+            apply_run_record(shared_data, record)
+
     return shared_data
+
+
+
+##### Plot Cache Methods
+
+# The images saved by each plot method are recorded in a manifest, __images/<backend>/manifest.json,
+# which maps a hash of the data and options used to draw them to the files saved.
+# When plots are not being shown, a plot method whose hash is found with all its files present is skipped.
+
+# Version of the plotting code; change this to invalidate all cached plot images
+plot_cache_version = 1
+
+# Files saved by the current plot method, or None when not recording
+plot_cache_files = None
+
+# Compute the cache key for a plot from its input data and the options affecting its appearance
+def plot_cache_key (*inputs):
+    options = { "version": plot_cache_version, "formats": plot_image_formats,
+            "do_volumetric_plots": do_volumetric_plots, "QV": QV, "depth_base": depth_base,
+            "max_depth_log": max_depth_log, "QV_transpile_factor": QV_transpile_factor,
+            "cmap": cmap.name if cmap != None else "Spectral" }
+    text = json.dumps([options, inputs], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+# Return the path of the plot cache manifest for the given backend
+def plot_cache_manifest (backend_id):
+    backend_id = backend_id.replace("/", "_")
+    return os.path.join("__images", backend_id, "manifest.json")
+
+# Load the plot cache manifest, or an empty one if not found
+def load_plot_cache_manifest (backend_id):
+    filename = plot_cache_manifest(backend_id)
+    if os.path.exists(filename):
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except:
+            pass
+    return {}
+
+# Return True if the images for this cache key have been saved and may be reused
+def plot_cache_lookup (backend_id, key):
+    if not cache_plot_images or not save_plot_images or show_plots:
+        return False
+    
+    entry = load_plot_cache_manifest(backend_id).get(key)
+    if entry == None or len(entry["files"]) == 0:
+        return False
+    
+    dirname = os.path.dirname(plot_cache_manifest(backend_id))
+    return all(os.path.exists(os.path.join(dirname, f)) for f in entry["files"])
+
+# Start recording the image files saved by a plot method
+def plot_cache_begin ():
+    global plot_cache_files
+    plot_cache_files = []
+
+# Record the image files saved since plot_cache_begin() under the given cache key
+def plot_cache_store (backend_id, key):
+    global plot_cache_files
+    files = plot_cache_files
+    plot_cache_files = None
+    if not cache_plot_images or not files:
+        return
+    
+    dirname = os.path.dirname(plot_cache_manifest(backend_id))
+    os.makedirs(dirname, exist_ok=True)
+    with file_lock(os.path.join(dirname, "manifest.lock")):
+        manifest = load_plot_cache_manifest(backend_id)
+        
+        # remove entries for older versions of the same files
+        for old_key in [k for k in manifest if set(manifest[k]["files"]) & set(files)]:
+            del manifest[old_key]
             
+        manifest[key] = { "files": files, "time": time.time() }
+        write_json_atomic(plot_cache_manifest(backend_id), manifest)
+
             
+# show the current plot, or close it if not showing plots
+def show_plot():
+    if show_plots:
+        plt.show()
+    else:
+        plt.close()
+
 # save plot as image
 def save_plot_image(plt, imagename, backend_id):
 
@@ -991,15 +1368,17 @@ def save_plot_image(plt, imagename, backend_id):
     if not os.path.exists(f'__images/{backend_id}'): os.makedirs(f'__images/{backend_id}')
     
     pngfilename = f"{backend_id}/{imagename}"
-    pngfilepath = os.path.join(os.getcwd(),"__images", pngfilename + ".jpg")
     
-    plt.savefig(pngfilepath)
+    # save a file in each of the selected formats
+    for format in plot_image_formats:
+        filepath = os.path.join(os.getcwd(),"__images", pngfilename + "." + format)
+        plt.savefig(filepath)
+        
+        # note the file for the plot cache manifest
+        if plot_cache_files != None:
+            plot_cache_files.append(f"{imagename}.{format}")
     
     #print(f"... saving (plot) image file:{pngfilename}.jpg")   
-    
-    pdffilepath = os.path.join(os.getcwd(),"__images", pngfilename + ".pdf")
-    
-    plt.savefig(pdffilepath)
 
 ## Uniform distribution function commonly used
 
@@ -1014,6 +1393,24 @@ def uniform_dist(num_state_qubits):
 import math, functools
 import numpy as np
 
+# Return the counts of the values of measured outcomes, given counts keyed by bitstring and a table of the value
+# estimated from each integer outcome (an array indexed by outcome); outcomes with equal values are counted together
+def value_counts(counts, value_table):
+    outcomes = np.array([int(key, 2) for key in counts.keys()], dtype=int)
+    return aggregate_values(value_table[outcomes], np.array(list(counts.values())))
+
+# Return the distribution of the values of uniformly distributed outcomes (the thermal distribution), from a value table
+def uniform_value_dist(value_table):
+    return aggregate_values(value_table, np.full(len(value_table), 1/len(value_table)))
+
+# Sum the weights of equal values into a dict keyed by value, in order of first occurrence
+def aggregate_values(values, weights):
+    unique_values, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    sums = np.zeros(len(unique_values), dtype=weights.dtype)
+    np.add.at(sums, inverse, weights)
+    order = np.argsort(first)
+    return dict(zip(unique_values[order].tolist(), sums[order].tolist()))
+
 # Compute the fidelity based on Hellinger distance between two discrete probability distributions
 def hellinger_fidelity_with_expected(p, q):
     """ p: result distribution, may be passed as a counts distribution
@@ -1103,22 +1500,81 @@ def polarization_fidelity(counts, correct_dist, thermal_dist=None):
 
     return fidelity
 
+def polarization_fidelity_sparse(counts, correct_dist, default_prob, num_qubits):
+    """
+    Polarization fidelity, as computed by `polarization_fidelity` with a uniform thermal distribution,
+    for a correct distribution over all 2^num_qubits states that is given sparsely, without enumerating the states
+
+    counts: the measurement outcomes after `num_shots` algorithm runs
+    correct_dist: the probabilities of some states (e.g. a marked item), as a dict keyed by bitstring
+    default_prob: the probability of each of the other states; the probabilities add up to 1
+    """
+    num_states = 2 ** num_qubits
+    num_other_states = num_states - len(correct_dist)
+
+    # Hellinger fidelity between the measured and correct distributions, summing over the measured states,
+    # and over the unmeasured states the probability of those given and the default probability of the rest
+    total_counts = sum(counts.values())
+    total = 0
+    num_unlisted_measured = 0
+    for key, val in counts.items():
+        q = correct_dist.get(key)
+        if q == None:
+            q = default_prob
+            num_unlisted_measured += 1
+        total += (np.sqrt(val/total_counts) - np.sqrt(q))**2
+    total += sum(q for key, q in correct_dist.items() if key not in counts)
+    total += default_prob * (num_other_states - num_unlisted_measured)
+    fidelity = (1 - total/2)**2
+
+    # Hellinger fidelity between the uniform and correct distributions, in closed form, as the floor fidelity
+    uniform_amp = np.sqrt(1/num_states)
+    floor_total = sum((uniform_amp - np.sqrt(q))**2 for q in correct_dist.values())
+    floor_total += num_other_states * (uniform_amp - np.sqrt(default_prob))**2
+    floor_fidelity = (1 - floor_total/2)**2
+
+    # rescale fidelity result so uniform superposition (random guessing) returns fidelity
+    # rescaled to 0 to provide a better measure of success of the algorithm (polarization)
+    return rescale_fidelity(fidelity, floor_fidelity, 0)
+
 ##############################################
 # VOLUMETRIC PLOT
   
 import math
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
 
-import matplotlib.cm as cm
+# matplotlib classes and colormaps, set by init_plotting()
+Rectangle = None
+PolyCollection = None
+cm = None
+cmap_spectral = None
+cmap_blues = None
+cmap = None
+
+# Import matplotlib and create the colormaps, on first use
+def init_plotting():
+    global plt, Rectangle, PolyCollection, cm, cmap_spectral, cmap_blues, cmap
+    if plt != None:
+        return
+    
+    import matplotlib.pyplot
+    import matplotlib.patches
+    import matplotlib.collections
+    import matplotlib.cm
+    
+    Rectangle = matplotlib.patches.Rectangle
+    PolyCollection = matplotlib.collections.PolyCollection
+    cm = matplotlib.cm
+    
+    # get a color from selected colormap
+    cmap_spectral = matplotlib.pyplot.get_cmap('Spectral')
+    cmap_blues = matplotlib.pyplot.get_cmap('Blues')
+    if cmap == None:
+        cmap = cmap_spectral
+        
+    plt = matplotlib.pyplot
 
 ############### Helper functions
 
-# get a color from selected colormap
-cmap_spectral = plt.get_cmap('Spectral')
-cmap_blues = plt.get_cmap('Blues')
-cmap = cmap_spectral
-
 def get_color(value):
 
     if cmap == cmap_spectral:
@@ -1129,6 +1585,17 @@ def get_color(value):
     return cmap(value)
     
     
+# get an array of colors from the selected colormap, for an array of values
+def get_colors(values):
+    values = np.clip(np.asarray(values, dtype=float), 0.0, 1.0)
+    
+    if cmap == cmap_spectral:
+        values = 0.05 + values*0.9
+    elif cmap == cmap_blues:
+        values = 0.05 + values*0.8
+        
+    return cmap(values)
+    
 # return the base index for a circuit depth value
 # take the log in the depth base, and add 1
 def depth_index(d, depth_base):
@@ -1183,6 +1650,29 @@ def bkg_empty_box_at(x, y, value):
              fill=True,
              lw=0.5)
 
+# Create a single collection of rectangles of the given width and height, centered at arrays of x,y
+# This draws much faster than adding a Rectangle patch for each box
+def boxes_at(x, y, width, height, facecolors, edgecolors, lw=0.5):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x0 = x - width/2
+    y0 = y - height/2
+    x1 = x + width/2
+    y1 = y + height/2
+    verts = np.stack([np.stack([x0, y0], axis=-1), np.stack([x0, y1], axis=-1),
+                      np.stack([x1, y1], axis=-1), np.stack([x1, y0], axis=-1)], axis=1)
+    return PolyCollection(verts, facecolors=facecolors, edgecolors=edgecolors, linewidths=lw)
+
+# draw boxes at arrays of x,y with colors from the array of values (as box_at)
+def data_boxes_at(x, y, values, fill=True):
+    fc = get_colors(values) if fill else 'none'
+    return boxes_at(x, y, 1.0, 1.0, fc, (0.5,0.5,0.5), lw=0.5)
+
+# draw narrow boxes at arrays of x,y with colors from the array of values (as box4_at)
+def data_boxes4_at(x, y, values):
+    fc = get_colors(values)
+    return boxes_at(x, y, 0.25, 1.0, fc, fc, lw=0.1)
+
 # Draw a Quantum Volume rectangle with specified width and depth, and grey-scale value 
 def qv_box_at(x, y, qv_width, qv_depth, value, depth_base):
     #print(f"{qv_width} {qv_depth} {depth_index(qv_depth, depth_base)}")
@@ -1215,6 +1705,8 @@ def format_number(num):
 # Plot the background for the volumetric analysis    
 def plot_volumetric_background(max_qubits=11, QV=32, depth_base=2, suptitle=None, avail_qubits=0):
     
+    init_plotting()
+    
     if suptitle == None:
         suptitle = f"Volumetric Positioning\nCircuit Dimensions and Fidelity Overlaid on Quantum Volume = {QV}"
 
@@ -1282,21 +1774,59 @@ def plot_volumetric_background(max_qubits=11, QV=32, depth_base=2, suptitle=None
     # also show a quantum volume rectangle un-transpiled
     # ax.add_patch(qv_box_at(1, 1, QV_width, QV_width, 0.80, depth_base))
 
-    # show 2D array of volumetric cells based on this QV_transpiled
+    # show 2D array of volumetric cells based on this QV_transpiled, as two collections of boxes
+    filled, empty = volumetric_background_cells(max_width, QV0, depth_base, avail_qubits,
+            max_depth_log, QV_transpile_factor)
+    
+    # show vb rectangles; if not showing QV, make all hollow
+    fc = (1.0,1.0,1.0) if QV0 == 0 else (.9,.9,.9)
+    ax.add_collection(boxes_at(filled[:, 0], filled[:, 1], 0.6, 0.6, fc, (.75,.75,.75)), autolim=False)
+    ax.add_collection(boxes_at(empty[:, 0], empty[:, 1], 0.6, 0.6, (1.0,1.0,1.0), (.75,.75,.75)), autolim=False)
+        
+    
+    # Add annotation showing quantum volume
+    if QV0 != 0:
+        t = ax.text(max_depth_log - 2.0, 1.5, f"QV{est_str}={QV}", size=12,
+                horizontalalignment='right', verticalalignment='center', color=(0.2,0.2,0.2),
+                bbox=dict(boxstyle="square,pad=0.3", fc=(.9,.9,.9), ec="grey", lw=1))
+                
+    # add colorbar to right of plot
+    plt.colorbar(cm.ScalarMappable(cmap=cmap), ax=ax, shrink=0.6, label="Avg Result Fidelity", panchor=(0.0, 0.7))
+            
+    return ax
+
+# Compute the centers of the background cells of the volumetric plot, as arrays of (x, y)
+# Returns the filled cells, within the QV limits, and the empty cell following each row
+# These depend only on the arguments, so are cached for reuse across plots
+@functools.lru_cache(maxsize=None)
+def volumetric_background_cells(max_width, QV0, depth_base, avail_qubits, max_depth_log, QV_transpile_factor):
+
+    QV = abs(QV0) if QV0 != 0 else 8192
+    
+    log2QV = math.log2(QV)
+    QV_width = log2QV
+    QV_depth = log2QV * QV_transpile_factor
+    
+    xbasis = [x for x in range(1,max_depth_log)]
+    xround = [depth_base**(x-1) for x in xbasis]
+    
     # DEVNOTE: we use +1 only to make the visuals work; s/b without
     # Also, the second arg of the min( below seems incorrect, needs correction
     maxprod = (QV_width + 1) * (QV_depth + 1)
+    
+    filled = []
+    empty = []
     for w in range(1, min(max_width, round(QV) + 1)):
         
         # don't show VB squares if width greater than known available qubits
         if avail_qubits != 0 and w > avail_qubits:
             continue
         
+        # polarization factor for low circuit widths
+        maxtest = maxprod / ( 1 - 1 / (2**w) )
+        
         i_success = 0
         for d in xround:
-        
-            # polarization factor for low circuit widths
-            maxtest = maxprod / ( 1 - 1 / (2**w) )
             
             # if circuit would fail here, don't draw box
             if d > maxtest: continue
@@ -1311,33 +1841,19 @@ def plot_volumetric_background(max_qubits=11, QV=32, depth_base=2, suptitle=None
             #     maxtest = maxtest / (1 + (over/QV_width))
 
             # draw a box at this width and depth
-            id = depth_index(d, depth_base) 
-            
-            # show vb rectangles; if not showing QV, make all hollow
-            if QV0 == 0:
-                ax.add_patch(bkg_empty_box_at(id, w, 0.5))
-            else:
-                ax.add_patch(bkg_box_at(id, w, 0.5))
+            filled.append((depth_index(d, depth_base), w))
             
             # save index of last successful depth
             i_success += 1
         
         # plot empty rectangle after others       
-        d = xround[i_success]
-        id = depth_index(d, depth_base) 
-        ax.add_patch(bkg_empty_box_at(id, w, 0.5))
-        
+        empty.append((depth_index(xround[i_success], depth_base), w))
     
-    # Add annotation showing quantum volume
-    if QV0 != 0:
-        t = ax.text(max_depth_log - 2.0, 1.5, f"QV{est_str}={QV}", size=12,
-                horizontalalignment='right', verticalalignment='center', color=(0.2,0.2,0.2),
-                bbox=dict(boxstyle="square,pad=0.3", fc=(.9,.9,.9), ec="grey", lw=1))
-                
-    # add colorbar to right of plot
-    plt.colorbar(cm.ScalarMappable(cmap=cmap), shrink=0.6, label="Avg Result Fidelity", panchor=(0.0, 0.7))
-            
-    return ax
+    filled = np.array(filled, dtype=float).reshape(-1, 2)
+    empty = np.array(empty, dtype=float).reshape(-1, 2)
+    filled.flags.writeable = False
+    empty.flags.writeable = False
+    return filled, empty
 
 x_annos = []
 y_annos = []
@@ -1361,17 +1877,21 @@ def vplot_anno_init ():
 def plot_volumetric_data(ax, w_data, d_data, f_data, depth_base=2, label='Depth',
         labelpos=(0.2, 0.7), labelrot=0, type=1, fill=True, w_max=18, do_label=False):
 
+    init_plotting()
+    
     # since data may come back out of order, save point at max y for annotation
     i_anno = 0
     x_anno = 0 
     y_anno = 0
     
-    # plot data rectangles
+    # plot data rectangles, as a single collection
+    xs = np.log(np.asarray(d_data, dtype=float)) / math.log(depth_base) + 1
+    ys = np.asarray(w_data, dtype=float)
+    ax.add_collection(data_boxes_at(xs, ys, f_data, fill=fill), autolim=False)
+    
     for i in range(len(d_data)):
-        x = depth_index(d_data[i], depth_base)
-        y = float(w_data[i])
-        f = f_data[i]
-        ax.add_patch(box_at(x, y, f, type=type, fill=fill))
+        x = xs[i]
+        y = ys[i]
 
         if y >= y_anno:
             x_anno = x
@@ -1487,3 +2007,55 @@ def test_metrics ():
     plot_metrics()
 
 #test_metrics()
+
+# Test the run log: records stored are loaded, compaction folds them into the DATA file and rotates the log
+def test_run_log ():
+    global data_dir, compact_threshold
+    saved = data_dir, compact_threshold
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data_dir, compact_threshold = tmpdir, 3
+        try:
+            base = data_file_base("test_backend")
+            for i in range(5):
+                store_app_metrics("test_backend", None, { "groups": ["2"], "avg_fidelities": [i / 10] },
+                        f"Benchmark Results - App{i % 2} - Qiskit", start_time=float(i), end_time=float(i) + 1)
+
+            # the third record triggered compaction, which rotated the log; the last two are in the new log
+            assert len(read_run_log("test_backend", previous=True)) == 3
+            assert len(read_run_log("test_backend")) == 2 and read_log_offset("test_backend") == 0
+
+            shared_data = load_app_metrics(None, "test_backend")
+            assert shared_data["Benchmark Results - App0 - Qiskit"]["group_metrics"]["avg_fidelities"] == [0.4]
+            assert shared_data["Benchmark Results - App1 - Qiskit"]["start_time"] == 3.0
+
+            # compacting again gives the same results, from the DATA file alone
+            compact_app_metrics("test_backend")
+            assert not os.path.exists(base + ".jsonl") and load_app_metrics(None, "test_backend") == shared_data
+
+            # loading creates nothing in a directory without data
+            data_dir = os.path.join(tmpdir, "none")
+            assert load_app_metrics(None, "test_backend") == {} and not os.path.exists(data_dir)
+
+        finally:
+            data_dir, compact_threshold = saved
+
+    print("... test_run_log passed")
+
+#test_run_log()
+
+# Test the sparse polarization fidelity against the fidelity computed over all states
+def test_polarization_fidelity_sparse ():
+    num_qubits = 4
+    correct_dist = { "0101": 0.7, "1111": 0.1 }
+    default_prob = 0.2 / 14
+    dense_dist = { format(i, "04b"): correct_dist.get(format(i, "04b"), default_prob) for i in range(16) }
+
+    for counts in ({ "0101": 80, "1111": 10, "0000": 6, "0011": 4 }, { "0101": 100 }, { "1000": 50, "0111": 50 }):
+        expected = polarization_fidelity(counts, dense_dist)
+        fidelity = polarization_fidelity_sparse(counts, correct_dist, default_prob, num_qubits)
+        assert abs(fidelity - expected) < 1e-9, (counts, fidelity, expected)
+
+    print("... test_polarization_fidelity_sparse passed")
+
+#test_polarization_fidelity_sparse()
@@ -0,0 +1,310 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Metrics Dashboard Module
+#
+# This module serves a small live dashboard of the events published by metrics_events.py,
+# streamed to the browser with Server-Sent Events. It shows the number of circuits submitted,
+# completed and failed, the active and batched queue lengths, the throughput over the last minute,
+# the time since the last event (to spot stalls), recent circuits and the averages of completed groups.
+#
+# Start it in the benchmark process before running apps:
+#   import metrics_dashboard
+#   metrics_dashboard.start_dashboard(port=8050)
+#
+# or in a separate process, following the event log written with metrics_events.start_event_log():
+#   python _common/metrics_dashboard.py --tail __data/events.jsonl --port 8050
+#
+# Uses only the Python standard library. The server listens on localhost unless another host is given.
+#
+
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics_events
+
+# Number of seconds between keepalive messages on idle event streams
+keepalive_interval = 15
+
+# Maximum number of events queued for a client before it is dropped as too slow
+max_client_queue = 10000
+
+# Queued for a client when it is dropped, ending its event stream; the browser then reconnects
+# and receives a fresh summary
+end_of_stream = None
+
+# Summary of the run so far, sent to each client when it connects
+state = { "submitted": 0, "completed": 0, "failed": 0, "active": 0, "batched": 0,
+        "last_event_time": None, "completion_times": [], "recent": [], "groups": [] }
+
+# Number of recent circuit events and completed groups retained in the summary
+max_recent = 50
+
+# Queues of serialized events for each connected client
+clients = []
+clients_lock = threading.Lock()
+
+# The running server, if started
+server = None
+
+
+##### Event handling
+
+# Update the run summary with an event
+def update_state (event):
+    event_type = event["type"]
+    state["last_event_time"] = event["time"]
+
+    if "active" in event: state["active"] = event["active"]
+    if "batched" in event: state["batched"] = event["batched"]
+
+    if event_type == "app_start":
+        state["groups"] = []
+    elif event_type == "circuit_submitted":
+        state["submitted"] += 1
+    elif event_type == "circuit_completed":
+        state["completed"] += 1
+        state["completion_times"] = [t for t in state["completion_times"] if t > event["time"] - 60] + [event["time"]]
+    elif event_type == "circuit_failed":
+        state["failed"] += 1
+    elif event_type == "group_complete":
+        state["groups"] = (state["groups"] + [event])[-max_recent:]
+
+    if event_type.startswith("circuit_"):
+        state["recent"] = (state["recent"] + [event])[-max_recent:]
+
+# Handle an event from the bus: update the summary and send it to all clients
+def handle_event (event):
+    with clients_lock:
+        update_state(event)
+        data = json.dumps(event, default=str)
+        for client in list(clients):
+            # the client queues have room for one more item than the events, for the end of stream
+            if client.qsize() >= max_client_queue:
+                clients.remove(client)
+                client.put_nowait(end_of_stream)
+            else:
+                client.put_nowait(data)
+
+# Follow an event log file, handling each event appended to it
+def tail_events (filename, poll_interval=0.5, from_start=True):
+    f = None
+    partial = b""
+    while True:
+        if f == None:
+            try:
+                f = open(filename, 'rb')
+                if not from_start: f.seek(0, 2)
+            except FileNotFoundError:
+                time.sleep(poll_interval)
+                continue
+
+        line = f.readline()
+        if not line:
+            time.sleep(poll_interval)
+            continue
+
+        # hold a partial line until the rest of it is written
+        line = partial + line
+        if not line.endswith(b"\n"):
+            partial = line
+            continue
+        partial = b""
+
+        try:
+            handle_event(json.loads(line.decode()))
+        except ValueError:
+            pass
+
+
+##### HTTP server
+
+dashboard_html = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>QED-C Benchmark Progress</title>
+<style>
+ body { font-family: sans-serif; margin: 20px; color: #333; }
+ .stats span { display: inline-block; margin-right: 24px; font-size: 18px; }
+ .stale { color: #c00; }
+ table { border-collapse: collapse; margin-top: 12px; font-size: 13px; }
+ td, th { border: 1px solid #ccc; padding: 2px 8px; text-align: right; }
+</style></head>
+<body>
+<h2>Benchmark Progress</h2>
+<div class="stats">
+ <span>Submitted: <b id="submitted">0</b></span>
+ <span>Completed: <b id="completed">0</b></span>
+ <span>Failed: <b id="failed">0</b></span>
+ <span>Active: <b id="active">0</b></span>
+ <span>Batched: <b id="batched">0</b></span>
+ <span>Throughput: <b id="throughput">0</b> circuits/min</span>
+ <span id="idle_box">Last event: <b id="idle">-</b> secs ago</span>
+</div>
+<h3>Groups</h3>
+<table id="groups"><tr><th>group</th><th>circuits</th><th>avg create</th><th>avg elapsed</th><th>avg exec</th><th>avg fidelity</th></tr></table>
+<h3>Recent Circuits</h3>
+<table id="recent"><tr><th>time</th><th>event</th><th>group</th><th>circuit</th><th>status</th><th>elapsed</th><th>exec</th></tr></table>
+<script>
+var s = {}, completions = [];
+function fmt(v) { return (v === undefined || v === null) ? "" : (typeof v === "number" ? v.toFixed(3) : v); }
+function row(table, cells, max) {
+  var r = table.insertRow(1);
+  cells.forEach(function(c) { r.insertCell().textContent = fmt(c); });
+  while (table.rows.length > max + 1) table.deleteRow(table.rows.length - 1);
+}
+function show() {
+  ["submitted", "completed", "failed", "active", "batched"].forEach(function(k) {
+    document.getElementById(k).textContent = s[k]; });
+}
+function circuit(e) {
+  row(document.getElementById("recent"), [new Date(e.time * 1000).toLocaleTimeString(), e.type.substr(8),
+      e.group, e.circuit, e.status || e.error, e.elapsed_time, e.exec_time], 50);
+}
+function group(e) {
+  var m = e.metrics || {};
+  row(document.getElementById("groups"), [e.group, e.num_circuits, m.avg_create_times, m.avg_elapsed_times,
+      m.avg_exec_times, m.avg_fidelities], 50);
+}
+var source = new EventSource("/events");
+source.addEventListener("state", function(msg) {
+  s = JSON.parse(msg.data);
+  completions = s.completion_times;
+  s.groups.forEach(group); s.recent.forEach(circuit); show();
+});
+source.onmessage = function(msg) {
+  var e = JSON.parse(msg.data);
+  s.last_event_time = e.time;
+  if ("active" in e) s.active = e.active;
+  if ("batched" in e) s.batched = e.batched;
+  if (e.type == "circuit_submitted") s.submitted++;
+  if (e.type == "circuit_completed") { s.completed++; completions.push(e.time); }
+  if (e.type == "circuit_failed") s.failed++;
+  if (e.type.substr(0, 8) == "circuit_") circuit(e);
+  if (e.type == "group_complete") group(e);
+  show();
+};
+setInterval(function() {
+  var now = Date.now() / 1000;
+  completions = completions.filter(function(t) { return t > now - 60; });
+  document.getElementById("throughput").textContent = completions.length;
+  if (s.last_event_time) {
+    var idle = now - s.last_event_time;
+    document.getElementById("idle").textContent = idle.toFixed(0);
+    document.getElementById("idle_box").className = idle > 60 ? "stale" : "";
+  }
+}, 1000);
+</script>
+</body></html>
+'''
+
+class DashboardHandler(BaseHTTPRequestHandler):
+
+    def do_GET (self):
+        if self.path == "/" or self.path == "/index.html":
+            body = dashboard_html.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        elif self.path == "/events":
+            self.stream_events()
+
+        else:
+            self.send_error(404)
+
+    # Send the current summary, then stream events to the client until it disconnects or is dropped
+    def stream_events (self):
+        client = queue.Queue(maxsize=max_client_queue + 1)
+        with clients_lock:
+            snapshot = json.dumps(state, default=str)
+            clients.append(client)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        try:
+            self.wfile.write(f"event: state\ndata: {snapshot}\n\n".encode())
+            self.wfile.flush()
+            while True:
+                try:
+                    data = client.get(timeout=keepalive_interval)
+                    if data == end_of_stream:
+                        break
+                    self.wfile.write(f"data: {data}\n\n".encode())
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+        finally:
+            with clients_lock:
+                if client in clients: clients.remove(client)
+
+    # don't log every request to the console
+    def log_message (self, format, *args):
+        pass
+
+# Start the dashboard server in a background thread, subscribed to the events of this process
+def start_dashboard (port=8050, host="127.0.0.1"):
+    global server
+
+    if server != None:
+        return server
+
+    server = ThreadingHTTPServer((host, port), DashboardHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    metrics_events.subscribe(handle_event)
+    print(f"... metrics dashboard at http://{host}:{server.server_address[1]}/")
+    return server
+
+# Stop the dashboard server, ending the event streams of all clients
+def stop_dashboard ():
+    global server
+
+    metrics_events.unsubscribe(handle_event)
+    with clients_lock:
+        for client in clients:
+            client.put_nowait(end_of_stream)
+        clients.clear()
+    if server != None:
+        server.shutdown()
+        server.server_close()
+        server = None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a live dashboard of benchmark events")
+    parser.add_argument("--tail", default=metrics_events.event_log_file, help="event log file to follow")
+    parser.add_argument("--port", type=int, default=8050, help="port to listen on")
+    parser.add_argument("--host", default="127.0.0.1", help="host address to listen on")
+    args = parser.parse_args()
+
+    start_dashboard(args.port, args.host)
+    try:
+        tail_events(args.tail)
+    except KeyboardInterrupt:
+        stop_dashboard()
@@ -0,0 +1,406 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Metrics Database Module
+#
+# This module maintains a local SQLite database holding the history of all benchmark runs.
+# Unlike the DATA files, which keep only the latest group metrics for each app and device,
+# every run is retained, along with the raw metrics for each circuit when available.
+#
+# The database contains four tables:
+#   apps      - one row per application title, e.g. "Benchmark Results - Hidden Shift - Qiskit"
+#   runs      - one row per execution of an app on a device (backend_id)
+#   groups    - the aggregated metrics for each group (circuit width) of a run
+#   circuits  - the raw metrics for each circuit of a run, one row per metric
+#
+# Existing results may be imported from the DATA files and run logs in the __data directory.
+# Query methods return the selected columns as NumPy arrays, for trend analysis and plotting.
+#
+
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import metrics
+
+# Default location of the database file
+db_path = "__data/metrics.db"
+
+# Mapping from database column name to key in the group_metrics dict
+group_columns = {
+    "avg_create_time": "avg_create_times",
+    "avg_elapsed_time": "avg_elapsed_times",
+    "avg_exec_time": "avg_exec_times",
+    "avg_fidelity": "avg_fidelities",
+    "avg_transpile_time": "avg_transpile_times",
+    "avg_depth": "avg_depths",
+    "avg_xi": "avg_xis",
+    "avg_tr_depth": "avg_tr_depths",
+    "avg_tr_xi": "avg_tr_xis",
+    "avg_tr_size": "avg_tr_sizes",
+    "avg_exec_creating_time": "avg_exec_creating_times",
+    "avg_exec_validating_time": "avg_exec_validating_times",
+    "avg_exec_running_time": "avg_exec_running_times"
+}
+
+schema = f"""
+CREATE TABLE IF NOT EXISTS apps (
+    app_id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL UNIQUE,
+    name TEXT,
+    api TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    app_id INTEGER NOT NULL REFERENCES apps(app_id),
+    backend_id TEXT NOT NULL,
+    start_time REAL,
+    end_time REAL,
+    timestamp REAL NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS groups (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    group_id TEXT NOT NULL,
+    width INTEGER,
+    {", ".join([f"{column} REAL" for column in group_columns])},
+    PRIMARY KEY (run_id, group_id)
+);
+CREATE TABLE IF NOT EXISTS circuits (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    group_id TEXT NOT NULL,
+    width INTEGER,
+    circuit_id TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, group_id, circuit_id, metric)
+);
+CREATE INDEX IF NOT EXISTS runs_backend ON runs(backend_id);
+CREATE INDEX IF NOT EXISTS runs_app ON runs(app_id);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs(timestamp);
+CREATE INDEX IF NOT EXISTS groups_width ON groups(width);
+CREATE INDEX IF NOT EXISTS circuits_width ON circuits(width, metric);
+"""
+
+# A run is identified by its app, device and start and end times. SQLite treats NULLs as distinct in a
+# UNIQUE constraint, so missing times (e.g. in DATA files stored before the run log) are indexed as -1,
+# for runs stored again to be ignored.
+unique_runs_index = """
+CREATE UNIQUE INDEX IF NOT EXISTS runs_unique
+    ON runs(app_id, backend_id, IFNULL(start_time, -1), IFNULL(end_time, -1));
+"""
+
+
+##### Connection methods
+
+# Open the database, creating the tables if needed
+def connect (path=None):
+    if path == None:
+        path = db_path
+
+    dirname = os.path.dirname(path)
+    if dirname: os.makedirs(dirname, exist_ok=True)
+
+    # allow for other processes writing to the database at the same time
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(schema)
+
+    # add the group metric columns introduced after the database was created
+    existing = [ row[1] for row in conn.execute("PRAGMA table_info(groups)") ]
+    with conn:
+        for column in group_columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE groups ADD COLUMN {column} REAL")
+
+    # databases created before the unique index may contain duplicate runs, which are removed first
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'runs_unique'").fetchone() == None:
+        with conn:
+            remove_duplicate_runs(conn)
+            conn.executescript(unique_runs_index)
+
+    return conn
+
+# Remove all but the first of each set of runs with the same app, device and times, with their groups and circuits
+def remove_duplicate_runs (conn):
+    duplicates = """SELECT run_id FROM runs WHERE run_id NOT IN
+        (SELECT MIN(run_id) FROM runs GROUP BY app_id, backend_id, IFNULL(start_time, -1), IFNULL(end_time, -1))"""
+    for table in ("circuits", "groups", "runs"):
+        conn.execute(f"DELETE FROM {table} WHERE run_id IN ({duplicates})")
+
+
+# Extract short app name and api from the app title, e.g. "Benchmark Results - Hidden Shift - Qiskit"
+def parse_app_title (title):
+    name = title
+    api = None
+    if title.startswith('Benchmark Results - '):
+        name = title[len('Benchmark Results - '):]
+    if ' - ' in name:
+        name, api = name.rsplit(' - ', 1)
+    return name, api
+
+# Convert a group id (e.g. "4") to an integer width, if possible
+def group_width (group):
+    try:
+        return int(group)
+    except (TypeError, ValueError):
+        return None
+
+# Return the app_id for the given app title, adding it if not present
+def get_app_id (conn, title):
+    row = conn.execute("SELECT app_id FROM apps WHERE title = ?", (title,)).fetchone()
+    if row != None:
+        return row[0]
+
+    name, api = parse_app_title(title)
+    cur = conn.execute("INSERT INTO apps (title, name, api) VALUES (?, ?, ?)", (title, name, api))
+    return cur.lastrowid
+
+
+##### Storage methods
+
+# Store the metrics of one app run into the database
+# Returns the run_id, or None if this run had already been stored
+def store_run (conn, backend_id, app, group_metrics, circuit_metrics=None,
+        start_time=None, end_time=None, timestamp=None, source=None):
+
+    # don't leave slashes in the backend_id, to match the DATA files
+    backend_id = backend_id.replace("/", "_")
+
+    # use the end of the run as its timestamp, if known
+    if timestamp == None:
+        timestamp = end_time or start_time or time.time()
+
+    with conn:
+        app_id = get_app_id(conn, app)
+
+        cur = conn.execute("""INSERT OR IGNORE INTO runs
+            (app_id, backend_id, start_time, end_time, timestamp, source)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (app_id, backend_id, start_time, end_time, timestamp, source))
+
+        # nothing more to do if this run is already in the database
+        if cur.rowcount < 1:
+            return None
+        run_id = cur.lastrowid
+
+        # store one row for each group; metrics arrays that are not populated for
+        # every group (e.g. depths are omitted if 0) cannot be aligned and are left empty
+        if group_metrics != None:
+            groups = group_metrics.get("groups", [])
+            rows = []
+            for i in range(len(groups)):
+                row = [run_id, str(groups[i]), group_width(groups[i])]
+                for column in group_columns:
+                    values = group_metrics.get(group_columns[column], [])
+                    row.append(values[i] if len(values) == len(groups) else None)
+                rows.append(row)
+
+            conn.executemany(f"""INSERT OR REPLACE INTO groups
+                (run_id, group_id, width, {", ".join(group_columns)})
+                VALUES ({", ".join(["?"] * (len(group_columns) + 3))})""", rows)
+
+        # store the raw metrics for each circuit, skipping anything that is not numeric
+        if circuit_metrics != None:
+            rows = []
+            for group in circuit_metrics:
+                if not isinstance(circuit_metrics[group], dict): continue
+                for circuit in circuit_metrics[group]:
+                    for metric, value in circuit_metrics[group][circuit].items():
+                        if isinstance(value, bool) or not isinstance(value, (int, float, np.number)):
+                            continue
+                        rows.append((run_id, str(group), group_width(group), str(circuit), metric, float(value)))
+
+            conn.executemany("""INSERT OR REPLACE INTO circuits
+                (run_id, group_id, width, circuit_id, metric, value)
+                VALUES (?, ?, ?, ?, ?, ?)""", rows)
+
+    return run_id
+
+
+##### Import methods
+
+# Import all runs for the given device from the run log and the compacted DATA file
+# Runs already in the database are skipped, so this may be called repeatedly
+# Returns the number of runs added
+def import_data_file (conn, backend_id):
+    num_added = 0
+
+    # the run logs hold the runs since the compaction before last, with circuit metrics if they were saved
+    with metrics.data_file_read_lock(backend_id):
+        records = metrics.read_run_log(backend_id, previous=True) + metrics.read_run_log(backend_id)
+        shared_data = metrics.load_compacted_metrics(backend_id)
+
+    for record in records:
+        run_id = store_run(conn, record.get("backend_id", backend_id), record["app"],
+                record.get("group_metrics"), record.get("circuit_metrics"),
+                start_time=record.get("start_time"), end_time=record.get("end_time"),
+                source="run_log")
+        if run_id != None: num_added += 1
+
+    # the compacted DATA file holds the latest results of each app, including those stored
+    # before the run log existed and those in run logs since rotated out
+    for app in shared_data:
+        data = shared_data[app]
+        run_id = store_run(conn, data.get("backend_id", backend_id), app,
+                data.get("group_metrics"), data.get("circuit_metrics"),
+                start_time=data.get("start_time"), end_time=data.get("end_time"),
+                source="data_file")
+        if run_id != None: num_added += 1
+
+    return num_added
+
+# Import the results for all devices found in the given data directory
+# Returns the number of runs added
+def import_all_data_files (conn, data_dir="__data"):
+    backend_ids = set()
+    if os.path.isdir(data_dir):
+        for filename in os.listdir(data_dir):
+            for ext in (".json", ".jsonl"):
+                if filename.startswith("DATA-") and filename.endswith(ext):
+                    backend_ids.add(filename[len("DATA-"):-len(ext)])
+
+    num_added = 0
+    for backend_id in sorted(backend_ids):
+        num_added += import_data_file(conn, backend_id)
+
+    return num_added
+
+
+##### Query methods
+
+# Build the WHERE clause for the common query filters
+def query_filters (backend_id=None, app=None, min_width=None, max_width=None, since=None, until=None, width_column="width"):
+    clauses = []
+    params = []
+
+    if backend_id != None:
+        clauses.append("runs.backend_id = ?"); params.append(backend_id.replace("/", "_"))
+    if app != None:
+        clauses.append("(apps.title = ? OR apps.name = ?)"); params.extend([app, app])
+    if min_width != None:
+        clauses.append(f"{width_column} >= ?"); params.append(min_width)
+    if max_width != None:
+        clauses.append(f"{width_column} <= ?"); params.append(max_width)
+    if since != None:
+        clauses.append("runs.timestamp >= ?"); params.append(since)
+    if until != None:
+        clauses.append("runs.timestamp < ?"); params.append(until)
+
+    where = ("WHERE " + " AND ".join(clauses)) if len(clauses) > 0 else ""
+    return where, params
+
+# Convert a list of result rows to a dict of NumPy arrays, one per column
+def rows_to_arrays (rows, columns):
+    arrays = {}
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows]
+        if column in ("backend_id", "app", "title", "group_id", "circuit_id", "metric"):
+            arrays[column] = np.array(values, dtype=object)
+        elif column == "run_id":
+            arrays[column] = np.array(values, dtype=np.int64)
+        else:
+            arrays[column] = np.array([np.nan if v == None else v for v in values], dtype=float)
+    return arrays
+
+# Query the group metrics of all matching runs, ordered by timestamp and width
+# Returns a dict of NumPy arrays, keyed by column name
+def query_groups (conn, backend_id=None, app=None, min_width=None, max_width=None,
+        since=None, until=None, columns=("avg_fidelity",)):
+
+    base_columns = ["run_id", "timestamp", "backend_id", "app", "width"]
+    for column in columns:
+        if column not in group_columns:
+            raise ValueError(f"unknown group metric column: {column}")
+
+    where, params = query_filters(backend_id, app, min_width, max_width, since, until, "groups.width")
+    rows = conn.execute(f"""SELECT runs.run_id, runs.timestamp, runs.backend_id, apps.name, groups.width
+            {"".join([", groups." + column for column in columns])}
+        FROM groups JOIN runs ON groups.run_id = runs.run_id JOIN apps ON runs.app_id = apps.app_id
+        {where} ORDER BY runs.timestamp, groups.width""", params).fetchall()
+
+    return rows_to_arrays(rows, base_columns + list(columns))
+
+# Query the raw values of one circuit metric for all matching runs, ordered by timestamp and width
+# Returns a dict of NumPy arrays, keyed by column name
+def query_circuits (conn, metric, backend_id=None, app=None, min_width=None, max_width=None,
+        since=None, until=None):
+
+    columns = ["run_id", "timestamp", "backend_id", "app", "width", "circuit_id", "value"]
+
+    where, params = query_filters(backend_id, app, min_width, max_width, since, until, "circuits.width")
+    where = (where + " AND " if where else "WHERE ") + "circuits.metric = ?"
+    params.append(metric)
+
+    rows = conn.execute(f"""SELECT runs.run_id, runs.timestamp, runs.backend_id, apps.name,
+            circuits.width, circuits.circuit_id, circuits.value
+        FROM circuits JOIN runs ON circuits.run_id = runs.run_id JOIN apps ON runs.app_id = apps.app_id
+        {where} ORDER BY runs.timestamp, circuits.width""", params).fetchall()
+
+    return rows_to_arrays(rows, columns)
+
+# Return the list of (backend_id, app name, number of runs, last timestamp) in the database
+def list_runs (conn):
+    return conn.execute("""SELECT runs.backend_id, apps.name, COUNT(*), MAX(runs.timestamp)
+        FROM runs JOIN apps ON runs.app_id = apps.app_id
+        GROUP BY runs.backend_id, apps.name ORDER BY runs.backend_id, apps.name""").fetchall()
+
+
+##### Tests
+
+# Import a run log and a DATA file with a legacy record (no start or end time) twice into an in-memory database,
+# checking that the runs are stored only once
+def test_metrics_db ():
+    import tempfile
+
+    saved_data_dir = metrics.data_dir
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metrics.data_dir = tmpdir
+        try:
+            group_metrics = { "groups": ["2", "3"], "avg_fidelities": [0.9, 0.8], "avg_create_times": [0.1, 0.2] }
+            metrics.write_json_atomic(metrics.data_file_base("test_backend") + ".json",
+                    { "Benchmark Results - Legacy - Qiskit": { "group_metrics": group_metrics, "circuit_metrics": None } })
+            metrics.store_app_metrics("test_backend", None, group_metrics, "Benchmark Results - Test - Qiskit",
+                    start_time=1000.0, end_time=1010.0)
+
+            conn = connect(":memory:")
+            num_added = import_all_data_files(conn, tmpdir)
+            counts = [ conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("runs", "groups") ]
+            assert num_added == 2 and counts == [2, 4], (num_added, counts)
+
+            num_added = import_all_data_files(conn, tmpdir)
+            counts = [ conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("runs", "groups") ]
+            assert num_added == 0 and counts == [2, 4], (num_added, counts)
+
+            fidelities = query_groups(conn, app="Test")["avg_fidelity"]
+            assert list(fidelities) == [0.9, 0.8], fidelities
+            conn.close()
+
+        finally:
+            metrics.data_dir = saved_data_dir
+
+    print("... test_metrics_db passed")
+
+
+# if main, import all data files in the current directory and list the runs in the database
+if __name__ == '__main__':
+    conn = connect()
+    print(f"... imported {import_all_data_files(conn)} runs into {db_path}")
+    for backend_id, name, num_runs, last in list_runs(conn):
+        print(f"{backend_id:24} {name:40} {num_runs:6} runs, last at {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(last))} UTC")
+    conn.close()
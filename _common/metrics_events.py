@@ -0,0 +1,127 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Metrics Events Module
+#
+# This module provides an in-process bus on which the metrics and execute modules publish
+# structured events as a benchmark runs, so that progress can be watched as it happens.
+# Each event is a dict with a "type", the "time" it was published, and fields for that type:
+#
+#   app_start           - metrics collection started for an app
+#   app_end             - metrics collection completed for an app
+#   metric              - group, circuit, metric, value; a circuit metric was stored
+#   group_complete      - group, metrics; all circuits in a group completed, with the group averages
+#   app_metrics         - app, backend_id, groups, group_metrics; the metrics of an app are being plotted or saved
+#   circuit_submitted   - group, circuit, shots, active, batched
+#   circuit_launched    - group, circuit, wait_time, transpile_time, active, batched
+#   circuit_status      - group, circuit, status; the job status of an active circuit changed
+#   circuit_completed   - group, circuit, status, elapsed_time, exec_time, active, batched
+#   circuit_failed      - group, circuit, error, active, batched
+#
+# Publishing costs almost nothing when there are no subscribers.
+# Subscribers include the JSONL event log in this module, the dashboard server in metrics_dashboard.py
+# and the Prometheus textfile exporter in metrics_exporter.py.
+#
+
+import json
+import os
+import threading
+import time
+
+# Functions called with each event published
+subscribers = []
+subscribers_lock = threading.Lock()
+
+
+##### Bus methods
+
+# Add a function to be called with each event published
+def subscribe (handler):
+    with subscribers_lock:
+        if handler not in subscribers:
+            subscribers.append(handler)
+
+# Remove a function added with subscribe
+def unsubscribe (handler):
+    with subscribers_lock:
+        if handler in subscribers:
+            subscribers.remove(handler)
+
+# Publish an event of the given type to all subscribers
+def publish (event_type, **fields):
+    if len(subscribers) == 0:
+        return
+
+    event = { "type": event_type, "time": time.time() }
+    event.update(fields)
+
+    for handler in list(subscribers):
+        try:
+            handler(event)
+        except Exception as e:
+            print(f"ERROR: metrics event handler failed for event {event_type}")
+            print(f"... exception = {e}")
+
+
+##### Event log
+
+# Events may be appended to a JSONL file, one event per line, which can be followed with
+# 'tail -f' or served by metrics_dashboard.py running in another process
+
+# Default event log filename
+event_log_file = "__data/events.jsonl"
+
+# Open event log, and the handler writing to it
+_event_log = None
+_event_log_handler = None
+_event_log_lock = threading.Lock()
+
+# Start appending all events to the event log file
+def start_event_log (filename=None):
+    global _event_log, _event_log_handler
+
+    stop_event_log()
+
+    if filename == None:
+        filename = event_log_file
+    dirname = os.path.dirname(filename)
+    if dirname: os.makedirs(dirname, exist_ok=True)
+
+    _event_log = open(filename, 'a')
+
+    def write_event (event):
+        line = json.dumps(event, default=str)
+        with _event_log_lock:
+            if _event_log != None:
+                _event_log.write(line + "\n")
+                _event_log.flush()
+
+    _event_log_handler = write_event
+    subscribe(write_event)
+
+# Stop writing events to the event log file
+def stop_event_log ():
+    global _event_log, _event_log_handler
+
+    if _event_log_handler != None:
+        unsubscribe(_event_log_handler)
+        _event_log_handler = None
+
+    with _event_log_lock:
+        if _event_log != None:
+            _event_log.close()
+            _event_log = None
@@ -0,0 +1,241 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Metrics Exporter Module
+#
+# This module keeps Prometheus counters, gauges and histograms of benchmark execution up to date
+# from the events published by metrics_events.py, and writes them periodically to a text file
+# in the Prometheus exposition format, for collection by the node exporter textfile collector.
+#
+# Start it in the benchmark process before running apps:
+#   import metrics_exporter
+#   metrics_exporter.start_exporter("/var/lib/node_exporter/textfile/qedc.prom", interval=15)
+#
+# The file is replaced atomically, so the collector never reads a partial file.
+#
+
+import os
+import tempfile
+import threading
+
+import metrics
+import metrics_events
+
+# Default file to write, and the interval in seconds between writes
+export_file = "__data/qedc_benchmarks.prom"
+export_interval = 15
+
+# Upper bounds of the buckets of all histograms, in seconds
+histogram_buckets = [ 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600 ]
+
+# Descriptions of all exported metrics, in order: name -> (type, help)
+metric_info = {
+    "qedc_circuits_submitted_total": ("counter", "Circuits submitted for execution"),
+    "qedc_circuits_completed_total": ("counter", "Circuits whose execution completed"),
+    "qedc_circuits_failed_total": ("counter", "Circuits whose execution failed"),
+    "qedc_active_circuits": ("gauge", "Circuits currently executing"),
+    "qedc_batched_circuits": ("gauge", "Circuits waiting in the batch to be executed"),
+    "qedc_circuit_wait_seconds": ("histogram", "Time circuits waited in the batch before launch"),
+    "qedc_circuit_transpile_seconds": ("histogram", "Time to transpile circuits for metrics"),
+    "qedc_circuit_queue_seconds": ("histogram", "Time circuits were queued by the provider"),
+    "qedc_circuit_run_seconds": ("histogram", "Execution time of circuits"),
+    "qedc_circuit_elapsed_seconds": ("histogram", "Time from launch to completion of circuits"),
+    "qedc_group_fidelity": ("gauge", "Average fidelity of the last completed group at each width"),
+    "qedc_app_fidelity": ("gauge", "Average fidelity of each app at each width, when its metrics are plotted"),
+    "qedc_last_event_timestamp_seconds": ("gauge", "Time of the last benchmark event"),
+}
+
+# Current values, for each metric name a dict of label tuple -> value
+# Histogram values are dicts of bucket counts, sum and count
+values = { name: {} for name in metric_info }
+values_lock = threading.Lock()
+
+# Thread writing the file, and event to stop it
+_export_thread = None
+_stop_event = None
+
+
+##### Update methods
+
+# Return the backend label for the current app
+def current_backend ():
+    subtitle = metrics.circuit_metrics.get("subtitle") or "Device = unknown"
+    return subtitle[9:]
+
+# Add to a counter
+def inc_counter (name, labels, amount=1):
+    series = values[name]
+    series[labels] = series.get(labels, 0) + amount
+
+# Set a gauge
+def set_gauge (name, labels, value):
+    values[name][labels] = value
+
+# Record an observation in a histogram
+def observe (name, labels, value):
+    if value == None:
+        return
+    series = values[name]
+    h = series.get(labels)
+    if h == None:
+        h = series[labels] = { "buckets": [0] * len(histogram_buckets), "sum": 0.0, "count": 0 }
+    for i, bound in enumerate(histogram_buckets):
+        if value <= bound:
+            h["buckets"][i] += 1
+    h["sum"] += value
+    h["count"] += 1
+
+# Update the metrics from one event
+def handle_event (event):
+    event_type = event["type"]
+    backend = (("backend", current_backend()),)
+
+    with values_lock:
+        set_gauge("qedc_last_event_timestamp_seconds", (), event["time"])
+        if "active" in event: set_gauge("qedc_active_circuits", backend, event["active"])
+        if "batched" in event: set_gauge("qedc_batched_circuits", backend, event["batched"])
+
+        if event_type == "circuit_submitted":
+            inc_counter("qedc_circuits_submitted_total", backend)
+
+        elif event_type == "circuit_launched":
+            observe("qedc_circuit_wait_seconds", backend, event.get("wait_time"))
+            observe("qedc_circuit_transpile_seconds", backend, event.get("transpile_time"))
+
+        elif event_type == "circuit_completed":
+            inc_counter("qedc_circuits_completed_total", backend)
+            observe("qedc_circuit_run_seconds", backend, event.get("exec_time"))
+            observe("qedc_circuit_elapsed_seconds", backend, event.get("elapsed_time"))
+
+        elif event_type == "circuit_failed":
+            inc_counter("qedc_circuits_failed_total", backend)
+
+        elif event_type == "metric" and event["metric"] == "exec_queued_time":
+            observe("qedc_circuit_queue_seconds", backend, event["value"])
+
+        elif event_type == "group_complete":
+            fidelity = event["metrics"].get("avg_fidelities")
+            if fidelity != None:
+                set_gauge("qedc_group_fidelity", backend + (("width", str(event["group"])),), fidelity)
+
+        elif event_type == "app_metrics":
+            app = (("app", event["app"]),)
+            fidelities = event["group_metrics"].get("avg_fidelities", [])
+            for group, fidelity in zip(event["groups"], fidelities):
+                labels = (("backend", event["backend_id"]),) + app + (("width", str(group)),)
+                set_gauge("qedc_app_fidelity", labels, fidelity)
+
+    # write promptly at the end of each app, rather than waiting for the interval
+    if event_type == "app_end" and _export_thread != None:
+        write_export_file()
+
+
+##### Export methods
+
+# Format a label set for the exposition format
+def format_labels (labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if len(labels) == 0:
+        return ""
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+# Format a number for the exposition format
+def format_value (value):
+    if isinstance(value, bool): value = int(value)
+    if isinstance(value, int): return str(value)
+    return repr(float(value))
+
+# Return the text of all metrics, in the Prometheus exposition format
+def export_text ():
+    lines = []
+    with values_lock:
+        for name, (metric_type, help_text) in metric_info.items():
+            series = values[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            for labels in sorted(series):
+                value = series[labels]
+                if metric_type != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+
+                for bound, count in zip(histogram_buckets, value["buckets"]):
+                    lines.append(f'{name}_bucket{format_labels(labels, (("le", format_value(bound)),))} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels, (("le", "+Inf"),))} {value["count"]}')
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value['sum'])}")
+                lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+
+    return "\n".join(lines) + "\n"
+
+# Write all metrics to the export file atomically
+def write_export_file (filename=None):
+    if filename == None:
+        filename = export_file
+
+    dirname = os.path.dirname(filename) or '.'
+    os.makedirs(dirname, exist_ok=True)
+
+    # the textfile collector ignores files not ending in .prom, so the temporary file is not read
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".tmp-", suffix=".prom.tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(export_text())
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, filename)
+    except:
+        if os.path.exists(tmpname): os.remove(tmpname)
+        raise
+
+# Start updating metrics from events, and writing them to the file at the given interval
+def start_exporter (filename=None, interval=None):
+    global _export_thread, _stop_event, export_file, export_interval
+
+    stop_exporter()
+
+    if filename != None: export_file = filename
+    if interval != None: export_interval = interval
+
+    metrics_events.subscribe(handle_event)
+
+    _stop_event = threading.Event()
+    def run (stop_event):
+        while not stop_event.wait(export_interval):
+            try:
+                write_export_file()
+            except Exception as e:
+                print(f"ERROR: unable to write metrics export file {export_file}")
+                print(f"... exception = {e}")
+
+    _export_thread = threading.Thread(target=run, args=(_stop_event,), daemon=True)
+    _export_thread.start()
+
+    write_export_file()
+
+# Stop updating metrics, writing the file a final time
+def stop_exporter ():
+    global _export_thread, _stop_event
+
+    metrics_events.unsubscribe(handle_event)
+
+    if _export_thread != None:
+        _stop_event.set()
+        _export_thread.join()
+        _export_thread = None
+        _stop_event = None
+        write_export_file()
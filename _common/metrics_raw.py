@@ -0,0 +1,303 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Raw Data Module
+#
+# This module exports the raw metrics and measured counts of every circuit to compact binary files,
+# so that results from a run may be re-analyzed later (e.g. with a new definition of fidelity)
+# without executing the circuits again.
+#
+# Files are written as each group completes, into one directory per run and one per group:
+#   __data/raw/<backend>/<run>/run.json                 - app title, backend_id and times of the run
+#   __data/raw/<backend>/<run>/group-<group>/*.npy      - columnar arrays for the circuits of the group
+#
+# The group arrays are:
+#   circuit_ids     circuit id of each circuit (string)
+#   metric_names    name of each metric column (string)
+#   metric_values   value of each metric for each circuit, NaN if not present (float64, circuits x metrics)
+#   offsets         start of the outcomes of each circuit, with a final end offset (int64, circuits + 1)
+#   outcomes        measured outcomes, encoded as integers (uint64)
+#   counts          number of times each outcome was measured (uint64)
+#   num_bits        number of bits in the measured outcomes of each circuit (int64)
+# and a file layout.json with the classical register sizes used to rebuild the counts keys.
+#
+# All arrays are saved as .npy files so they may be opened memory-mapped when read back.
+#
+
+import json
+import os
+
+import numpy as np
+
+import metrics
+
+# Root directory for raw data files
+raw_data_dir = "__data/raw"
+
+# Outcomes wider than this are stored as strings instead of integers
+max_int_bits = 64
+
+
+##### Write methods
+
+# Return the directory for the raw data of a run, identified by backend_id and start time
+def run_dir (backend_id, start_time):
+    backend_id = backend_id.replace("/", "_")
+    run_id = time_to_run_id(start_time)
+    return os.path.join(raw_data_dir, backend_id, run_id)
+
+# Create a run identifier from the run start time, unique to this process
+def time_to_run_id (start_time):
+    import time
+    return time.strftime("%Y%m%d-%H%M%S", time.gmtime(start_time)) + f"-{os.getpid()}"
+
+# Encode a counts dict as integer outcomes and counts arrays
+# Bitstring keys may contain spaces separating classical registers; the register sizes are returned
+def encode_counts (counts):
+    keys = list(counts.keys())
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64), 0, []
+
+    register_sizes = [len(reg) for reg in keys[0].split(' ')]
+    num_bits = sum(register_sizes)
+
+    bitstrings = [key.replace(' ', '') for key in keys]
+    if num_bits <= max_int_bits:
+        outcomes = np.array([int(b, 2) for b in bitstrings], dtype=np.uint64)
+    else:
+        outcomes = np.array(bitstrings, dtype=f"U{num_bits}")
+
+    values = np.array([counts[key] for key in keys], dtype=np.uint64)
+
+    # sort by outcome, for efficient lookup and merging
+    order = np.argsort(outcomes, kind="stable")
+    return outcomes[order], values[order], num_bits, register_sizes
+
+# Write the metrics and counts of all circuits in a group to a group directory
+def write_group (backend_id, start_time, group, group_circuit_metrics, group_counts=None):
+    group = str(group)
+    dirname = os.path.join(run_dir(backend_id, start_time), f"group-{group}")
+    os.makedirs(dirname, exist_ok=True)
+
+    if group_counts == None:
+        group_counts = {}
+
+    circuit_ids = sorted(group_circuit_metrics.keys())
+
+    # gather the names of all numeric metrics stored for circuits in this group
+    metric_names = []
+    for circuit in circuit_ids:
+        for metric, value in group_circuit_metrics[circuit].items():
+            if isinstance(value, (int, float, np.number)) and metric not in metric_names:
+                metric_names.append(metric)
+
+    metric_values = np.full((len(circuit_ids), len(metric_names)), np.nan)
+    for i, circuit in enumerate(circuit_ids):
+        for j, metric in enumerate(metric_names):
+            value = group_circuit_metrics[circuit].get(metric)
+            if isinstance(value, (int, float, np.number)):
+                metric_values[i, j] = value
+
+    # concatenate the encoded counts of all circuits, with offsets to each
+    all_outcomes = []
+    all_counts = []
+    offsets = [0]
+    num_bits = []
+    layout = {}
+    use_strings = False
+    for circuit in circuit_ids:
+        outcomes, counts, nbits, register_sizes = encode_counts(group_counts.get(circuit, {}))
+        all_outcomes.append(outcomes)
+        all_counts.append(counts)
+        offsets.append(offsets[-1] + len(outcomes))
+        num_bits.append(nbits)
+        layout[circuit] = register_sizes
+        if outcomes.dtype.kind == 'U': use_strings = True
+
+    # if any circuit is too wide for integer encoding, store all outcomes as strings
+    if use_strings:
+        width = max(num_bits)
+        all_outcomes = [np.array([format(int(o), f"0{n}b") if o.dtype.kind != 'U' else o for o in outcomes],
+                dtype=f"U{width}") for outcomes, n in zip(all_outcomes, num_bits)]
+
+    arrays = {
+        "circuit_ids": np.array(circuit_ids, dtype=str),
+        "metric_names": np.array(metric_names, dtype=str),
+        "metric_values": metric_values,
+        "offsets": np.array(offsets, dtype=np.int64),
+        "outcomes": np.concatenate(all_outcomes) if len(all_outcomes) > 0 else np.zeros(0, dtype=np.uint64),
+        "counts": np.concatenate(all_counts) if len(all_counts) > 0 else np.zeros(0, dtype=np.uint64),
+        "num_bits": np.array(num_bits, dtype=np.int64)
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(dirname, name + ".npy"), array)
+
+    with open(os.path.join(dirname, "layout.json"), 'w') as f:
+        json.dump(layout, f)
+
+    return dirname
+
+# Write the descriptive information for a run, once the app title is known
+def write_run_info (backend_id, app, start_time, end_time=None):
+    dirname = run_dir(backend_id, start_time)
+    if not os.path.exists(dirname):
+        return
+    info = { "app": app, "backend_id": backend_id.replace("/", "_"),
+            "start_time": start_time, "end_time": end_time }
+    metrics.write_json_atomic(os.path.join(dirname, "run.json"), info)
+
+
+##### Read methods
+
+# List the runs with raw data for a backend, optionally for a single app (short name or title)
+# Returns a list of run info dicts, with the run directory in "path", ordered by start time
+def list_runs (backend_id, app=None):
+    backend_id = backend_id.replace("/", "_")
+    dirname = os.path.join(raw_data_dir, backend_id)
+    runs = []
+    if not os.path.isdir(dirname):
+        return runs
+
+    for run_id in os.listdir(dirname):
+        path = os.path.join(dirname, run_id)
+        info_file = os.path.join(path, "run.json")
+        if not os.path.exists(info_file): continue
+
+        with open(info_file, 'r') as f:
+            info = json.load(f)
+        info["path"] = path
+
+        if app != None and app != info["app"] and f" - {app}" not in info["app"]:
+            continue
+        runs.append(info)
+
+    return sorted(runs, key=lambda info: info["start_time"] or 0)
+
+# List the groups stored for a run, ordered by group as integer where possible
+def list_groups (run_path):
+    groups = [name[len("group-"):] for name in os.listdir(run_path) if name.startswith("group-")]
+    return sorted(groups, key=lambda g: (0, int(g), g) if g.isdigit() else (1, 0, g))
+
+# Load the arrays for a group; by default these are memory-mapped rather than read into memory
+def load_group (run_path, group, mmap=True):
+    dirname = os.path.join(run_path, f"group-{group}")
+    data = {}
+    for name in ("circuit_ids", "metric_names", "metric_values", "offsets", "outcomes", "counts", "num_bits"):
+        data[name] = np.load(os.path.join(dirname, name + ".npy"), mmap_mode='r' if mmap else None)
+
+    with open(os.path.join(dirname, "layout.json"), 'r') as f:
+        data["layout"] = json.load(f)
+
+    return data
+
+# Return the metric values for the circuits in a loaded group, as a dict of circuit id to metrics dict
+def group_circuit_metrics (data):
+    names = [str(name) for name in data["metric_names"]]
+    result = {}
+    for i, circuit in enumerate(data["circuit_ids"]):
+        values = data["metric_values"][i]
+        result[str(circuit)] = { names[j]: float(values[j]) for j in range(len(names)) if not np.isnan(values[j]) }
+    return result
+
+# Rebuild the counts dict for one circuit of a loaded group, with bitstring keys as returned by the backend
+def circuit_counts (data, index):
+    start, end = data["offsets"][index], data["offsets"][index + 1]
+    outcomes = data["outcomes"][start:end]
+    counts = data["counts"][start:end]
+    num_bits = int(data["num_bits"][index])
+    register_sizes = data["layout"].get(str(data["circuit_ids"][index]), [num_bits])
+
+    result = {}
+    for outcome, count in zip(outcomes, counts):
+        if outcomes.dtype.kind == 'U':
+            bits = str(outcome)[-num_bits:] if num_bits > 0 else ''
+        else:
+            bits = format(int(outcome), f"0{num_bits}b")
+
+        # restore the spaces between classical registers
+        regs = []
+        pos = 0
+        for size in register_sizes:
+            regs.append(bits[pos:pos + size])
+            pos += size
+        result[' '.join(regs)] = int(count)
+
+    return result
+
+# Return the counts of all circuits in a loaded group, as a dict of circuit id to counts dict
+def group_counts (data):
+    return { str(circuit): circuit_counts(data, i) for i, circuit in enumerate(data["circuit_ids"]) }
+
+
+##### Analysis methods
+
+# Recompute the fidelity of every circuit in the stored runs of an app, using the metrics analysis functions
+# correct_dist_fn(group, circuit_id, counts) must return the expected distribution for the circuit
+# thermal_dist_fn(group, circuit_id, counts), if given, returns the distribution for random guessing
+# Returns a list with one dict per run, of the form { "run": info, "fidelities": { group: { circuit: fidelity } } }
+def recompute_fidelities (backend_id, app, correct_dist_fn, thermal_dist_fn=None):
+    results = []
+    for info in list_runs(backend_id, app):
+        fidelities = {}
+        for group in list_groups(info["path"]):
+            data = load_group(info["path"], group)
+            fidelities[group] = {}
+
+            for circuit, counts in group_counts(data).items():
+                if len(counts) == 0: continue
+                correct_dist = correct_dist_fn(group, circuit, counts)
+                thermal_dist = None
+                if thermal_dist_fn != None:
+                    thermal_dist = thermal_dist_fn(group, circuit, counts)
+                fidelities[group][circuit] = metrics.polarization_fidelity(counts, correct_dist, thermal_dist)
+
+        results.append({ "run": info, "fidelities": fidelities })
+
+    return results
+
+
+##### Tests
+
+# Write a group with a multi-register circuit and a circuit too wide for integer outcomes, and read it back
+def test_metrics_raw ():
+    import tempfile
+    global raw_data_dir
+
+    saved_raw_data_dir = raw_data_dir
+    with tempfile.TemporaryDirectory() as tmpdir:
+        raw_data_dir = tmpdir
+        try:
+            wide = '1' * 40 + '0' * 30
+            counts = { "1": { "01 101": 7, "00 000": 3 }, "2": { wide: 9, '0' * 70: 1 }, "3": {} }
+            circuit_metrics = { "1": { "fidelity": 0.7, "tr_depth": 12 }, "2": { "fidelity": 0.9, "label": "x" }, "3": {} }
+
+            write_group("test/backend", 1000.0, 4, circuit_metrics, counts)
+            write_run_info("test/backend", "Benchmark Results - Test - Qiskit", 1000.0, 1010.0)
+
+            runs = list_runs("test/backend", "Test")
+            assert len(runs) == 1 and list_groups(runs[0]["path"]) == ["4"]
+
+            data = load_group(runs[0]["path"], "4")
+            assert group_counts(data) == counts
+            assert group_circuit_metrics(data) == { "1": { "fidelity": 0.7, "tr_depth": 12.0 }, "2": { "fidelity": 0.9 }, "3": {} }
+
+        finally:
+            raw_data_dir = saved_raw_data_dir
+
+    print("... test_metrics_raw passed")
+
+#test_metrics_raw()
@@ -0,0 +1,289 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Regression Detection Module
+#
+# This module compares the metrics of a run against those of a stored baseline run,
+# in order to detect that creation, transpile, execution or elapsed times became slower, transpiled depth grew,
+# or fidelity dropped, e.g. between nightly runs.
+#
+# Both runs are loaded with 'metrics.load_app_metrics()' from a data directory, which is only read, and aligned by app,
+# backend and circuit width. The change in each metric is tested at every width against a tolerance,
+# and across all widths with a one-sided sign test. The result is returned as a verdict dict which may
+# be saved as json, along with a summary plot.
+#
+# This module may also be run from the command line, e.g.
+#   python _common/metrics_regress.py --baseline baseline/__data --backend qasm_simulator
+# which exits with status 1 if a regression is found, or 2 if no app has metrics in both runs
+# (e.g. a wrong data directory or backend), so that a comparison of nothing does not pass.
+#
+
+import argparse
+import math
+import os
+import sys
+
+import metrics
+
+# Metrics compared, with the direction that is better and the default tolerances
+# A change is beyond tolerance if it exceeds both the relative (rel_tol) and absolute (abs_tol) limits
+metric_checks = {
+    "avg_create_times":  { "higher_is_better": False, "rel_tol": 0.50, "abs_tol": 0.001 },
+    "avg_elapsed_times": { "higher_is_better": False, "rel_tol": 0.50, "abs_tol": 0.01 },
+    "avg_exec_times":    { "higher_is_better": False, "rel_tol": 0.50, "abs_tol": 0.01 },
+    "avg_transpile_times": { "higher_is_better": False, "rel_tol": 0.50, "abs_tol": 0.01 },
+    "avg_tr_depths":     { "higher_is_better": False, "rel_tol": 0.10, "abs_tol": 1.0 },
+    "avg_fidelities":    { "higher_is_better": True,  "rel_tol": 0.0,  "abs_tol": 0.05 },
+}
+
+# Significance level of the sign test across widths
+# With three widths all worse than baseline the p-value is 0.125, so this admits the smallest apps
+alpha = 0.15
+
+# A change at any single width larger than this multiple of the tolerance is a regression by itself
+fail_factor = 3.0
+
+
+##### Comparison methods
+
+# Load the app metrics of a device from the given data directory
+def load_metrics (data_dir, backend_id, api=None):
+    saved_data_dir = metrics.data_dir
+    metrics.data_dir = data_dir
+    try:
+        return metrics.load_app_metrics(api, backend_id)
+    finally:
+        metrics.data_dir = saved_data_dir
+
+# Return a dict of width to value for one metric in the group metrics of an app
+# Metrics not recorded for every group are skipped, as they can't be aligned with widths
+def metric_by_width (group_metrics, metric):
+    groups = group_metrics.get("groups", [])
+    values = group_metrics.get(metric, [])
+    if len(values) != len(groups):
+        return {}
+    return { int(group): float(value) for group, value in zip(groups, values) if value != None }
+
+# Return the change from baseline to current, as a fraction of baseline and as a difference,
+# both signed so that a positive change is worse
+def signed_change (base, current, higher_is_better):
+    diff = base - current if higher_is_better else current - base
+    rel = diff / abs(base) if base != 0 else (math.inf if diff > 0 else 0.0)
+    return rel, diff
+
+# Test if a change (from signed_change) exceeds the tolerance, scaled by the given factor
+def beyond_tolerance (rel, diff, check, factor=1.0):
+    return rel > check["rel_tol"] * factor and diff > check["abs_tol"] * factor
+
+# One-sided sign test: probability of at least 'worse' of 'n' widths being worse, if no change
+def sign_test (worse, n):
+    if n == 0:
+        return 1.0
+    return sum(math.comb(n, k) for k in range(worse, n + 1)) / 2 ** n
+
+# Compare one metric of an app between baseline and current group metrics
+def compare_metric (base_gm, current_gm, metric, check):
+    base = metric_by_width(base_gm, metric)
+    current = metric_by_width(current_gm, metric)
+    widths = sorted(set(base) & set(current))
+
+    rels = []
+    diffs = []
+    flags = []
+    for w in widths:
+        rel, diff = signed_change(base[w], current[w], check["higher_is_better"])
+        rels.append(rel)
+        diffs.append(diff)
+        if beyond_tolerance(rel, diff, check, fail_factor):
+            flags.append("fail")
+        elif beyond_tolerance(rel, diff, check):
+            flags.append("worse")
+        elif beyond_tolerance(-rel if rel != math.inf else 0, -diff, check):
+            flags.append("better")
+        else:
+            flags.append("same")
+
+    worse = sum(1 for d in diffs if d > 0)
+    better = sum(1 for d in diffs if d < 0)
+    p_value = sign_test(worse, worse + better)
+
+    # aggregate change across widths, as the mean change
+    mean_rel = sum(r for r in rels if r != math.inf) / len(rels) if len(rels) > 0 else 0.0
+    mean_diff = sum(diffs) / len(diffs) if len(diffs) > 0 else 0.0
+
+    if len(widths) == 0:
+        status = "missing"
+    elif "fail" in flags:
+        status = "regression"
+    elif beyond_tolerance(mean_rel, mean_diff, check) and p_value <= alpha:
+        status = "regression"
+    elif beyond_tolerance(-mean_rel, -mean_diff, check) and sign_test(better, worse + better) <= alpha:
+        status = "improvement"
+    else:
+        status = "ok"
+
+    return { "status": status, "widths": widths,
+            "baseline": [base[w] for w in widths], "current": [current[w] for w in widths],
+            "rel_change": [r if r != math.inf else None for r in rels], "diff": diffs, "flags": flags,
+            "mean_rel_change": mean_rel, "mean_diff": mean_diff, "p_value": p_value }
+
+# Compare the metrics of all apps found in both the baseline and current data
+# checks may override the tolerances in metric_checks, e.g. { "avg_exec_times": { "rel_tol": 1.0 } }
+# Returns a verdict dict, whose "status" is "regression" if any metric of any app regressed
+def compare_runs (baseline_data, current_data, backend_id, apps=None, checks=None):
+    all_checks = { metric: dict(check) for metric, check in metric_checks.items() }
+    if checks != None:
+        for metric, check in checks.items():
+            all_checks.setdefault(metric, { "higher_is_better": False, "rel_tol": 0.0, "abs_tol": 0.0 })
+            all_checks[metric].update(check)
+
+    verdict = { "backend_id": backend_id, "status": "ok", "regressions": [], "apps": {},
+            "checks": all_checks, "alpha": alpha, "fail_factor": fail_factor }
+
+    for app in sorted(set(baseline_data) & set(current_data)):
+        if apps != None and not any(a == app or f" - {a}" in app for a in apps):
+            continue
+
+        base_gm = baseline_data[app].get("group_metrics")
+        current_gm = current_data[app].get("group_metrics")
+        if base_gm == None or current_gm == None:
+            continue
+
+        verdict["apps"][app] = {}
+        for metric, check in all_checks.items():
+            result = compare_metric(base_gm, current_gm, metric, check)
+            if result["status"] == "missing":
+                continue
+            verdict["apps"][app][metric] = result
+            if result["status"] == "regression":
+                verdict["status"] = "regression"
+                verdict["regressions"].append(f"{app}: {metric}")
+
+    if len(verdict["apps"]) == 0:
+        verdict["status"] = "no_data"
+
+    return verdict
+
+# Compare the runs stored in baseline and current data directories for a device
+def compare_data_dirs (baseline_dir, current_dir, backend_id, apps=None, checks=None, api=None):
+    baseline_data = load_metrics(baseline_dir, backend_id, api)
+    current_data = load_metrics(current_dir, backend_id, api)
+    return compare_runs(baseline_data, current_data, backend_id, apps=apps, checks=checks)
+
+
+##### Report methods
+
+# Print a summary of the verdict
+def report_verdict (verdict):
+    print(f'... regression check for {verdict["backend_id"]}: {verdict["status"]}')
+    for app, results in verdict["apps"].items():
+        print(f"  {app}")
+        for metric, result in results.items():
+            print(f'    {metric:<20} {result["status"]:<12} mean change = {result["mean_rel_change"]*100:.1f}%, p = {result["p_value"]:.3f}')
+
+# Plot the change in each metric against width, for all apps, with the tolerance shaded
+# Positive changes are worse; the chart is saved to the given filename if not None
+def plot_verdict (verdict, filename=None):
+    import matplotlib.pyplot as plt
+
+    metric_names = [m for m in verdict["checks"]
+            if any(m in results for results in verdict["apps"].values())]
+    if len(metric_names) == 0:
+        return
+
+    fig, axs = plt.subplots(len(metric_names), 1, figsize=(8, 2.6 * len(metric_names)), squeeze=False)
+    fig.suptitle(f'Regression Check - {verdict["backend_id"]} - {verdict["status"]}')
+
+    for ax, metric in zip(axs[:, 0], metric_names):
+        check = verdict["checks"][metric]
+        use_diff = check["rel_tol"] == 0
+        tol = check["abs_tol"] if use_diff else check["rel_tol"]
+
+        ax.axhspan(-tol, tol, color='lightgrey', alpha=0.5)
+        ax.axhline(0, color='grey', linewidth=0.5)
+        for app, results in verdict["apps"].items():
+            if metric not in results: continue
+            result = results[metric]
+            values = result["diff"] if use_diff else [r if r != None else math.nan for r in result["rel_change"]]
+            label = app.replace("Benchmark Results - ", "")
+            if result["status"] == "regression": label += " (regression)"
+            ax.plot(result["widths"], values, marker='o', label=label)
+
+        ax.set_ylabel(("change in " if use_diff else "rel. change in ") + metric[4:])
+        ax.grid(True, axis='y', color='silver', zorder=0)
+
+    axs[-1, 0].set_xlabel("Circuit Width (Number of Qubits)")
+    axs[0, 0].legend(fontsize=7, loc='upper left')
+    fig.tight_layout()
+
+    if filename != None:
+        dirname = os.path.dirname(filename)
+        if dirname: os.makedirs(dirname, exist_ok=True)
+        fig.savefig(filename)
+    plt.close(fig)
+
+
+##### Command line
+
+# Parse tolerance overrides of the form metric=rel_tol or metric=rel_tol,abs_tol
+def parse_tolerance (text):
+    metric, _, values = text.partition('=')
+    if not metric.startswith("avg_"):
+        metric = "avg_" + metric
+    values = values.split(',')
+    check = { "rel_tol": float(values[0]) }
+    if len(values) > 1:
+        check["abs_tol"] = float(values[1])
+    return metric, check
+
+def main (argv=None):
+    global alpha, fail_factor
+
+    parser = argparse.ArgumentParser(description="Compare benchmark metrics against a baseline run")
+    parser.add_argument("--baseline", required=True, help="data directory containing the baseline DATA files")
+    parser.add_argument("--current", default="__data", help="data directory containing the current DATA files")
+    parser.add_argument("--backend", default="qasm_simulator", help="backend_id of the runs to compare")
+    parser.add_argument("--app", action="append", help="app to compare, by short name or title (repeatable)")
+    parser.add_argument("--tolerance", action="append", default=[], type=parse_tolerance,
+            help="override tolerance, as metric=rel_tol[,abs_tol], e.g. exec_times=1.0,0.05")
+    parser.add_argument("--alpha", type=float, default=alpha, help="significance level of the sign test")
+    parser.add_argument("--fail-factor", type=float, default=fail_factor,
+            help="multiple of tolerance at a single width that is a regression by itself")
+    parser.add_argument("--json", help="file to save the verdict to")
+    parser.add_argument("--plot", help="file to save the summary plot to")
+    args = parser.parse_args(argv)
+
+    alpha = args.alpha
+    fail_factor = args.fail_factor
+
+    verdict = compare_data_dirs(args.baseline, args.current, args.backend,
+            apps=args.app, checks=dict(args.tolerance))
+    report_verdict(verdict)
+
+    if args.json:
+        metrics.write_json_atomic(args.json, verdict)
+    if args.plot:
+        plot_verdict(verdict, args.plot)
+
+    if verdict["status"] == "regression":
+        return 1
+    if verdict["status"] == "no_data":
+        return 2
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Plot Renderer Module
+#
+# This module renders the plots for apps whose metrics were saved with the option 'metrics.defer_plots'.
+# Rendering is done headless, with the matplotlib Agg backend, in a pool of worker processes,
+# one task per app and one for the merged volumetric plot of each backend.
+# Images are saved to the __images directory in the selected formats, as they are by the benchmarks.
+#
+# Run from the directory containing __data, e.g.
+#   python _common/metrics_render.py --backend qasm_simulator --formats png,pdf
+#
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+# Directory containing the data files; matches the default in the metrics module
+data_dir = "__data"
+
+# Number of worker processes, None to use one per cpu
+num_processes = None
+
+
+##### Worker methods
+
+# Configure the metrics module for rendering, in a worker process
+def init_worker (formats, worker_data_dir):
+    import matplotlib
+    matplotlib.use("Agg")
+
+    import metrics
+    metrics.data_dir = worker_data_dir
+    metrics.save_metrics = False
+    metrics.save_metrics_db = False
+    metrics.defer_plots = False
+    metrics.show_plots = False
+    metrics.save_plot_images = True
+    if formats != None:
+        metrics.plot_image_formats = list(formats)
+
+# Render the plots for one app, or the merged volumetric plot of all apps if app is None
+# Returns a (backend_id, app, error) tuple, with error None on success
+def render_task (task):
+    backend_id, app = task
+    import metrics
+
+    try:
+        if app == None:
+            metrics.plot_all_app_metrics(backend_id)
+        else:
+            shared_data = metrics.load_app_metrics(None, backend_id)
+            metrics.circuit_metrics["subtitle"] = f"device = {backend_id}"
+            metrics.group_metrics = shared_data[app]["group_metrics"]
+            metrics.plot_metrics(app)
+
+    except Exception as e:
+        return backend_id, app, str(e)
+
+    finally:
+        import matplotlib.pyplot as plt
+        plt.close('all')
+
+    return backend_id, app, None
+
+
+##### Render methods
+
+# Return the backend_ids with DATA files in the data directory
+def find_backends ():
+    backend_ids = set()
+    if os.path.isdir(data_dir):
+        for filename in os.listdir(data_dir):
+            for ext in (".json", ".jsonl"):
+                if filename.startswith("DATA-") and filename.endswith(ext):
+                    backend_ids.add(filename[len("DATA-"):-len(ext)])
+    return sorted(backend_ids)
+
+# Return the list of render tasks for the given backends and apps (short names or titles)
+def find_tasks (backend_ids=None, apps=None, include_merged=True):
+    import metrics
+
+    if backend_ids == None:
+        backend_ids = find_backends()
+
+    saved_data_dir = metrics.data_dir
+    metrics.data_dir = data_dir
+    tasks = []
+    try:
+        for backend_id in backend_ids:
+            shared_data = metrics.load_app_metrics(None, backend_id)
+            for app in shared_data:
+                if apps != None and not any(a == app or f" - {a}" in app for a in apps):
+                    continue
+                tasks.append((backend_id, app))
+
+            if include_merged and len(shared_data) > 0:
+                tasks.append((backend_id, None))
+    finally:
+        metrics.data_dir = saved_data_dir
+
+    return tasks
+
+# Render the plots for all saved apps of the given backends, in parallel worker processes
+# Returns the number of tasks that failed
+def render (backend_ids=None, apps=None, formats=None, include_merged=True, processes=None):
+    tasks = find_tasks(backend_ids, apps, include_merged)
+    if len(tasks) == 0:
+        print("... no saved metrics to render")
+        return 0
+
+    if processes == None:
+        processes = num_processes
+
+    # use fresh interpreters, so that no interactive matplotlib state is inherited
+    ctx = multiprocessing.get_context("spawn")
+    num_failed = 0
+    with ctx.Pool(processes, initializer=init_worker, initargs=(formats, data_dir)) as pool:
+        for backend_id, app, error in pool.imap_unordered(render_task, tasks):
+            name = app if app != None else "All Applications (Merged)"
+            if error == None:
+                print(f"... rendered {backend_id}: {name}")
+            else:
+                num_failed += 1
+                print(f"ERROR: failed to render {backend_id}: {name}")
+                print(f"... exception = {error}")
+
+    return num_failed
+
+
+##### Command line
+
+def main (argv=None):
+    global data_dir
+
+    parser = argparse.ArgumentParser(description="Render plots from saved benchmark metrics")
+    parser.add_argument("--backend", action="append", help="backend_id to render (repeatable), default all")
+    parser.add_argument("--app", action="append", help="app to render, by short name or title (repeatable)")
+    parser.add_argument("--formats", default=None, help="comma separated image formats, e.g. png,pdf")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--no-merged", action="store_true", help="don't render the merged volumetric plots")
+    parser.add_argument("--data-dir", default=data_dir, help="directory containing the DATA files")
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir
+    formats = args.formats.split(',') if args.formats else None
+
+    num_failed = render(args.backend, args.app, formats, not args.no_merged, args.processes)
+    return 1 if num_failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
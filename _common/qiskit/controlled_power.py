@@ -0,0 +1,109 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################
+# Controlled Power Module - Qiskit
+#
+# This module provides the controlled powers cU^k of an operator U used by the phase estimation based
+# benchmarks (phase-estimation, amplitude-estimation and monte-carlo), which apply cU^(2^j) for each counting qubit j.
+# Rather than appending cU 2^j times, a power is obtained, in order of preference:
+#   - from a closed form given by the benchmark, e.g. the Grover operator Q^k of amplitude estimation as a rotation
+#   - by scaling the angle of a rotation gate, e.g. CPhaseGate(angle)^k = CPhaseGate(k * angle)
+#   - by repeated squaring, as a gate containing cU^(k/2) twice; each power is built once per memo,
+#     so the powers for all counting qubits share their sub-gates and are expanded once when flattened (see flatten.py)
+#
+
+from qiskit import QuantumCircuit
+from qiskit.circuit.library.standard_gates import (
+    CPhaseGate, CRXGate, CRYGate, CRZGate, CU1Gate, PhaseGate, RXGate, RYGate, RZGate, U1Gate
+)
+
+# Gates with a single angle parameter, for which U(angle)^k = U(k * angle)
+scalable_gates = (CPhaseGate, CRXGate, CRYGate, CRZGate, CU1Gate, PhaseGate, RXGate, RYGate, RZGate, U1Gate)
+
+
+# Return the power cU^power of a controlled operator, as an instruction
+# 'closed_form', if given, is a function returning the instruction for a power, or None if it has no closed form for it.
+# A memo dict may be passed to share the powers built by repeated squaring between calls for the same operator.
+def controlled_power (cU, power, closed_form=None, memo=None):
+    if isinstance(cU, QuantumCircuit):
+        cU = cU.to_instruction()
+    if power == 1:
+        return cU
+
+    if closed_form != None:
+        gate = closed_form(power)
+        if gate != None:
+            return gate
+
+    if isinstance(cU, scalable_gates):
+        return type(cU)(cU.params[0] * power)
+
+    if memo == None:
+        memo = {}
+    return repeated_power(cU, power, memo)
+
+# Return cU^power built by repeated squaring, memoized by operator and power
+def repeated_power (cU, power, memo):
+    if power == 1:
+        return cU
+
+    entry = memo.get((id(cU), power))
+    if entry != None:
+        return entry[1]
+
+    half = repeated_power(cU, power // 2, memo)
+    qc = QuantumCircuit(cU.num_qubits, name=f"{cU.name}^{power}")
+    qc.append(half, qc.qubits)
+    qc.append(half, qc.qubits)
+    if power % 2 == 1:
+        qc.append(cU, qc.qubits)
+    gate = qc.to_instruction()
+
+    # retain the operator with its power, so its id is not reused while memoized
+    memo[(id(cU), power)] = (cU, gate)
+    return gate
+
+
+##### Tests
+
+# Check the powers of a scalable gate and of a composite operator built by repeated squaring against U^k
+def test_controlled_power ():
+    from qiskit.quantum_info import Operator
+
+    gate = controlled_power(CPhaseGate(0.3), 5)
+    assert isinstance(gate, CPhaseGate) and abs(gate.params[0] - 1.5) < 1e-12
+
+    cU = QuantumCircuit(2, name="cU")
+    cU.cry(0.4, 0, 1)
+    cU.cx(0, 1)
+    U = Operator(cU)
+    cU = cU.to_instruction()
+
+    memo = {}
+    for power in (2, 5, 8):
+        assert Operator(controlled_power(cU, power, memo=memo)).equiv(U.power(power))
+
+    # powers 2, 4 and 8 are built once and shared; 5 reuses 2 and adds only itself
+    assert len(memo) == 4
+
+    # a closed form is used for the powers it handles
+    closed = QuantumCircuit(2, name="closed").to_instruction()
+    assert controlled_power(cU, 4, closed_form=lambda power: closed if power == 4 else None) is closed
+
+    print("... test_controlled_power passed")
+
+#test_controlled_power()
@@ -25,17 +25,15 @@
 
 import time
 import copy
+import queue
+import threading
 import metrics
+import metrics_events
 import importlib
 
 from qiskit import execute, Aer, transpile
-from qiskit import IBMQ
 from qiskit.providers.jobstatus import JobStatus
 
-# Noise
-from qiskit.providers.aer.noise import NoiseModel, ReadoutError
-from qiskit.providers.aer.noise import depolarizing_error, reset_error
-
 # Use Aer qasm_simulator by default
 backend = Aer.get_backend("qasm_simulator")  
 
@@ -43,31 +41,52 @@ backend = Aer.get_backend("qasm_simulator")
 backend_exec_options = None
 
 # default noise model, can be overridden using set_noise_model
-noise = NoiseModel()
+# the 'DEFAULT' model is created from the error rates below when first used
+noise = 'DEFAULT'
+
 # Add depolarizing error to all single qubit gates with error rate 0.3%
 #                    and to all two qubit gates with error rate 3.0%
 depol_one_qb_error = 0.003
 depol_two_qb_error = 0.03
-noise.add_all_qubit_quantum_error(depolarizing_error(depol_one_qb_error, 1), ['rx', 'ry', 'rz'])
-noise.add_all_qubit_quantum_error(depolarizing_error(depol_two_qb_error, 2), ['cx'])
 
 # Add amplitude damping error to all single qubit gates with error rate 0.0%
 #                         and to all two qubit gates with error rate 0.0%
 amp_damp_one_qb_error = 0.0
 amp_damp_two_qb_error = 0.0
-noise.add_all_qubit_quantum_error(depolarizing_error(amp_damp_one_qb_error, 1), ['rx', 'ry', 'rz'])
-noise.add_all_qubit_quantum_error(depolarizing_error(amp_damp_two_qb_error, 2), ['cx'])
 
 # Add reset noise to all single qubit resets
 reset_to_zero_error = 0.005
 reset_to_one_error = 0.005
-noise.add_all_qubit_quantum_error(reset_error(reset_to_zero_error, reset_to_one_error),["reset"])
 
 # Add readout error
 p0given1_error = 0.000
 p1given0_error = 0.000
-error_meas = ReadoutError([[1 - p1given0_error, p1given0_error], [p0given1_error, 1 - p0given1_error]])
-noise.add_all_qubit_readout_error(error_meas)
+
+# Create the default noise model, from the error rates above
+def default_noise_model():
+    from qiskit.providers.aer.noise import NoiseModel, ReadoutError
+    from qiskit.providers.aer.noise import depolarizing_error, reset_error
+    
+    noise = NoiseModel()
+    noise.add_all_qubit_quantum_error(depolarizing_error(depol_one_qb_error, 1), ['rx', 'ry', 'rz'])
+    noise.add_all_qubit_quantum_error(depolarizing_error(depol_two_qb_error, 2), ['cx'])
+    
+    noise.add_all_qubit_quantum_error(depolarizing_error(amp_damp_one_qb_error, 1), ['rx', 'ry', 'rz'])
+    noise.add_all_qubit_quantum_error(depolarizing_error(amp_damp_two_qb_error, 2), ['cx'])
+    
+    noise.add_all_qubit_quantum_error(reset_error(reset_to_zero_error, reset_to_one_error),["reset"])
+    
+    error_meas = ReadoutError([[1 - p1given0_error, p1given0_error], [p0given1_error, 1 - p0given1_error]])
+    noise.add_all_qubit_readout_error(error_meas)
+    
+    return noise
+
+# Return the noise model in use, creating the default model on first use
+def get_noise_model():
+    global noise
+    if type(noise) == str and noise == 'DEFAULT':
+        noise = default_noise_model()
+    return noise
 
 # Create array of batched circuits and a dict of active circuits
 batched_circuits = []
@@ -76,6 +95,10 @@ active_circuits = {}
 # maximum number of active jobs
 max_jobs_active = 5;
 
+# maximum number of circuits generated ahead of execution by 'execute_pipelined'
+# set to 0 to generate each group only after the previous group has been launched
+max_lookahead = 8
+
 # Configure a handler for processing circuits on completion
 # user-supplied result handler
 result_handler = None
@@ -151,6 +174,7 @@ def set_execution_target(backend_id='qasm_simulator',
                 print(authentication_error_msg.format(provider_name))
         else:
             # otherwise, assume IBMQ
+            from qiskit import IBMQ
             if IBMQ.stored_account():
                 # load a stored account
                 IBMQ.load_account()
@@ -213,6 +237,9 @@ def submit_circuit(qc, group_id, circuit_id, shots=100):
     if verbose:
         print(f'... submit circuit - group={circuit["group"]} id={circuit["circuit"]} shots={circuit["shots"]}')
     
+    metrics_events.publish("circuit_submitted", group=circuit["group"], circuit=circuit["circuit"],
+            shots=shots, active=len(active_circuits), batched=len(batched_circuits))
+    
     # immediately post the circuit for execution if active jobs < max
     if len(active_circuits) < max_jobs_active:
         execute_circuit(circuit)
@@ -266,9 +293,12 @@ def execute_circuit(circuit):
     qc_tr_xi = 0; 
     #print(f"... before tp: {qc_depth} {qc_size} {qc_count_ops}")
     
+    transpile_time = 0
+    
     try:    
         # transpile the circuit to obtain size metrics
         if do_transpile_metrics:
+            transpile_start = time.time()
         
             #print("*** Before transpile ...")
             #print(circuit["qc"])
@@ -283,6 +313,8 @@ def execute_circuit(circuit):
             #print("*** After transpile ...")
             #print(qc)
                 
+            transpile_time = time.time() - transpile_start
+            
             qc_tr_depth = qc.depth()
             qc_tr_size = qc.size()
             qc_tr_count_ops = qc.count_ops()
@@ -300,9 +332,10 @@ def execute_circuit(circuit):
             #print(f"... qc_tr_xi = {qc_tr_xi} {n1q} {n2q}")
             
         # Initiate execution (with noise if specified and this is a simulator backend)
-        if noise is not None and backend.name().endswith("qasm_simulator"):
+        noise_model = get_noise_model()
+        if noise_model is not None and backend.name().endswith("qasm_simulator"):
             job = execute(circuit["qc"], backend, shots=shots,
-                    noise_model=noise, basis_gates=noise.basis_gates)
+                    noise_model=noise_model, basis_gates=noise_model.basis_gates)
         else: 
             # use execution options if set with backend
             if backend_exec_options != None:
@@ -345,6 +378,8 @@ def execute_circuit(circuit):
     except Exception as e:
         print(f'ERROR: Failed to execute circuit {active_circuit["group"]} {active_circuit["circuit"]}')
         print(f"... exception = {e}")
+        metrics_events.publish("circuit_failed", group=active_circuit["group"], circuit=active_circuit["circuit"],
+                error=str(e), active=len(active_circuits), batched=len(batched_circuits))
         return
     
     # print("Job status is ", job.status() )
@@ -352,6 +387,10 @@ def execute_circuit(circuit):
     # put job into the active circuits with circuit info
     active_circuits[job] = active_circuit
     # print("... active_circuit = ", str(active_circuit))
+    
+    metrics_events.publish("circuit_launched", group=active_circuit["group"], circuit=active_circuit["circuit"],
+            wait_time=active_circuit["launch_time"] - active_circuit["submit_time"],
+            transpile_time=transpile_time, active=len(active_circuits), batched=len(batched_circuits))
 
     # store circuit dimensional metrics
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'depth', qc_depth)
@@ -362,6 +401,9 @@ def execute_circuit(circuit):
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'tr_size', qc_tr_size)
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'tr_xi', qc_tr_xi)
     
+    # store the time to transpile the circuit for the target, 0 if not transpiled here
+    metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'transpile_time', transpile_time)
+    
     # return, so caller can do other things while waiting for jobs to complete
 
     # deprecated code ...
@@ -444,12 +486,25 @@ def job_complete(job):
         
         elif "time_taken" in results_obj:
             exec_time = results_obj["time_taken"]
+        
+        # retain the measured counts for export as raw data, if enabled
+        if metrics.save_raw_data:
+            try:
+                metrics.store_counts(active_circuit["group"], active_circuit["circuit"],
+                        result.get_counts(active_circuit["qc"]))
+            except Exception as e:
+                print(f'WARNING: unable to obtain counts for circuit {active_circuit["group"]} {active_circuit["circuit"]}')
     
     # remove from list of active circuits
     del active_circuits[job]
 
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'elapsed_time', elapsed_time)
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'exec_time', exec_time)
+    
+    metrics_events.publish("circuit_completed" if result != None else "circuit_failed",
+            group=active_circuit["group"], circuit=active_circuit["circuit"],
+            status=str(active_circuit.get("status")), elapsed_time=elapsed_time, exec_time=exec_time,
+            active=len(active_circuits), batched=len(batched_circuits))
 
     # If a result handler has been established, invoke it here with result object
     if result != None and result_handler:
@@ -485,6 +540,10 @@ def job_status_failed(job):
 
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'elapsed_time', elapsed_time)
     metrics.store_metric(active_circuit["group"], active_circuit["circuit"], 'exec_time', exec_time)
+    
+    metrics_events.publish("circuit_failed", group=active_circuit["group"], circuit=active_circuit["circuit"],
+            error="unable to retrieve job status", elapsed_time=elapsed_time,
+            active=len(active_circuits), batched=len(batched_circuits))
 
         
 ######################################################################
@@ -593,6 +652,12 @@ def check_jobs(completion_handler=None):
 
         circuit["pollcount"] += 1
         
+        # publish changes in job status, e.g. from queued to running
+        if status != circuit.get("status"):
+            circuit["status"] = status
+            metrics_events.publish("circuit_status", group=circuit["group"], circuit=circuit["circuit"],
+                    status=str(status))
+        
         # if job not complete, provide comfort ...
         if status == JobStatus.QUEUED:
             if verbose:
@@ -647,6 +712,136 @@ def check_jobs(completion_handler=None):
         execute_circuit(circuit)  
         
 
+# Execute circuits as they are generated, generating circuits for upcoming groups in a background thread
+# while the circuits already generated are executed, so the target is not idle while circuits are built.
+# The generator yields (qc, group_id, circuit_id, shots, create_time) tuples, in order of group;
+# the create_time metric is stored here, so the generator does not access the metrics.
+# It measures create_time as elapsed time (see circuit_cache.get_circuit), like the benchmarks that create circuits in the main loop.
+# The generator may also yield a message string, e.g. announcing a group; it is printed here when the next group
+# is opened for submission, rather than when generated ahead of execution.
+# If the generator fails, no more circuits are submitted and its exception is raised, without finalizing execution.
+# At most 'lookahead' circuits are generated ahead of those launched for execution (backpressure);
+# a group is finalized only after all of its circuits have been submitted.
+
+def execute_pipelined(circuit_generator, completion_handler=metrics.finalize_group, lookahead=None):
+
+    if lookahead == None:
+        lookahead = max_lookahead
+        
+    # without lookahead, generate and execute in turn, as in the benchmark loops
+    if lookahead < 1:
+        last_group = None
+        for item in circuit_generator:
+            if isinstance(item, str):
+                print(item)
+                continue
+            qc, group_id, circuit_id, shots, create_time = item
+            if last_group != None and str(group_id) != last_group:
+                throttle_execution(completion_handler)
+            last_group = str(group_id)
+            metrics.store_metric(group_id, circuit_id, 'create_time', create_time)
+            submit_circuit(qc, group_id, circuit_id, shots)
+            
+        finalize_execution(completion_handler)
+        return
+    
+    # generate circuits in a background thread, blocking when the queue is full
+    circuit_queue = queue.Queue(maxsize=lookahead)
+    done = object()
+    errors = []
+    
+    def generate():
+        try:
+            for item in circuit_generator:
+                circuit_queue.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            circuit_queue.put(done)
+            
+    generator_thread = threading.Thread(target=generate, daemon=True)
+    generator_thread.start()
+    
+    # defer completion of the group still being submitted until all its circuits are submitted
+    open_group = None
+    pending_groups = set()
+    
+    def group_completion_handler(group):
+        if group == open_group:
+            pending_groups.add(group)
+        elif completion_handler != None:
+            completion_handler(group)
+            
+    def close_group(group):
+        if group in pending_groups:
+            pending_groups.discard(group)
+            if completion_handler != None:
+                completion_handler(group)
+    
+    pollcount = 0
+    generator_done = False
+    messages = []
+    while True:
+        
+        # stop submitting circuits as soon as the generator fails
+        if len(errors) > 0:
+            break
+        
+        # don't accept more circuits while the batch is full; wait for active circuits to complete
+        if len(batched_circuits) >= lookahead:
+            check_jobs(group_completion_handler)
+            time.sleep(0.25 if pollcount < 6 else 0.5)
+            pollcount += 1
+            continue
+        
+        try:
+            item = circuit_queue.get(timeout=0.25)
+        except queue.Empty:
+            check_jobs(group_completion_handler)
+            continue
+        
+        if item is done:
+            generator_done = True
+            break
+        
+        # hold messages until the group they announce is opened
+        if isinstance(item, str):
+            messages.append(item)
+            continue
+        
+        qc, group_id, circuit_id, shots, create_time = item
+        
+        if str(group_id) != open_group:
+            last_group, open_group = open_group, str(group_id)
+            close_group(last_group)
+            for message in messages:
+                print(message)
+            messages.clear()
+        
+        metrics.store_metric(group_id, circuit_id, 'create_time', create_time)
+        submit_circuit(qc, group_id, circuit_id, shots)
+        pollcount = 0
+    
+    # on failure, discard the circuits generated but not submitted, so the generator thread can finish
+    if not generator_done:
+        while circuit_queue.get() is not done:
+            pass
+    generator_thread.join()
+    
+    # report a failure to generate circuits without finalizing, so the run is not reported as complete;
+    # circuits not yet launched are discarded
+    if len(errors) > 0:
+        batched_circuits.clear()
+        raise errors[0]
+    
+    last_group, open_group = open_group, None
+    close_group(last_group)
+    for message in messages:
+        print(message)
+    
+    finalize_execution(completion_handler)
+    
+
 # Test circuit execution
 def test_execution():
     pass
@@ -0,0 +1,139 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################
+# Flatten Module - Qiskit
+#
+# This module inlines the composite instructions of a circuit (sub-circuits appended as gates, such as
+# 'Q', 'cQ', 'inv_qft' or 'cMULTamodN') down to a target gate set, in a single pass over the circuit.
+# Unlike repeated calls to QuantumCircuit.decompose(), which copy the circuit and rebuild its DAG at each level
+# and also expand standard gates, it keeps the gates of the target set (by default the standard gates,
+# including 'mcx' and 'crz') and expands each distinct composite instruction only once, however often it is used.
+# It requires Qiskit-Terra 0.22 or later (see _setup/qiskit/README.md).
+#
+
+from qiskit import QuantumCircuit
+from qiskit.circuit.library.standard_gates import get_standard_gate_name_mapping
+
+# Names of the instructions kept as they are, by default
+# the standard gates, and multi-controlled gates that the transpiler and simulators handle natively
+default_keep = set(get_standard_gate_name_mapping().keys()) | {
+    "barrier", "measure", "reset", "delay",
+    "mcx", "mcx_gray", "mcx_recursive", "mcx_vchain", "c3x", "c4x", "mcphase", "mcu1"
+}
+
+
+# Return the expansion of an instruction: a list of (operation, qubit indices, clbit indices)
+# tuples on the qubits and clbits of the instruction, and the global phase of its definition.
+# Expansions are memoized by instruction object, as composite gates are usually appended many times.
+def expand (op, keep, memo):
+    entry = memo.get(id(op))
+    if entry != None:
+        return entry[1], entry[2]
+
+    definition = op.definition
+    qubit_index = { q: i for i, q in enumerate(definition.qubits) }
+    clbit_index = { c: i for i, c in enumerate(definition.clbits) }
+
+    ops = []
+    phase = definition.global_phase
+    for inst in definition.data:
+        sub_op = inst.operation
+        qargs = tuple(qubit_index[q] for q in inst.qubits)
+        cargs = tuple(clbit_index[c] for c in inst.clbits)
+
+        if is_kept(sub_op, keep):
+            ops.append((sub_op, qargs, cargs))
+            continue
+
+        sub_ops, sub_phase = expand(sub_op, keep, memo)
+        phase += sub_phase
+        for o, q, c in sub_ops:
+            ops.append((o, tuple(qargs[i] for i in q), tuple(cargs[i] for i in c)))
+
+    # retain the instruction with its expansion, so its id is not reused while memoized
+    memo[id(op)] = (op, ops, phase)
+    return ops, phase
+
+# Return True if an instruction is kept as it is
+def is_kept (op, keep):
+    return (op.name in keep or op.definition == None
+            or getattr(op, "condition", None) != None)
+
+# Return a copy of the circuit with all composite instructions inlined, down to the gates named in 'keep'
+# A memo dict may be passed to share expansions between circuits that use the same instruction objects.
+def flatten_circuit (qc, keep=None, memo=None):
+    if keep == None:
+        keep = default_keep
+    if memo == None:
+        memo = {}
+
+    flat = qc.copy_empty_like()
+    qubits = flat.qubits
+    clbits = flat.clbits
+    qubit_index = { q: i for i, q in enumerate(qc.qubits) }
+    clbit_index = { c: i for i, c in enumerate(qc.clbits) }
+
+    for inst in qc.data:
+        op = inst.operation
+        qargs = [ qubit_index[q] for q in inst.qubits ]
+        cargs = [ clbit_index[c] for c in inst.clbits ]
+
+        if is_kept(op, keep):
+            flat._append(op, [qubits[i] for i in qargs], [clbits[i] for i in cargs])
+            continue
+
+        ops, phase = expand(op, keep, memo)
+        flat.global_phase += phase
+        for o, q, c in ops:
+            flat._append(o, [qubits[qargs[i]] for i in q], [clbits[cargs[i]] for i in c])
+
+    return flat
+
+
+##### Tests
+
+# Check that a flattened circuit has the same operator and only kept gates, and that an instruction used twice
+# is expanded once
+def test_flatten ():
+    from qiskit.quantum_info import Operator
+
+    inner = QuantumCircuit(2, name="inner")
+    inner.h(0)
+    inner.crz(0.3, 0, 1)
+    inner.global_phase = 0.2
+    inner_inst = inner.to_instruction()
+
+    outer = QuantumCircuit(3, name="outer")
+    outer.append(inner_inst, [0, 1])
+    outer.append(inner_inst, [2, 0])
+    outer.mcx([0, 1], 2)
+
+    qc = QuantumCircuit(3)
+    qc.x(1)
+    qc.append(outer.to_instruction(), [2, 1, 0])
+    qc.append(inner_inst, [1, 2])
+
+    memo = {}
+    flat = flatten_circuit(qc, memo=memo)
+    assert Operator(flat).equiv(Operator(qc)) and Operator(flat) == Operator(qc)
+    assert all(inst.operation.name in default_keep for inst in flat.data)
+    # 'outer', its copy of 'inner' (expanded once for both uses), and 'inner' itself
+    assert len(memo) == 3
+
+    print("... test_flatten passed")
+
+#test_flatten()
@@ -0,0 +1,138 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################
+# MCX Gates Module - Qiskit
+#
+# This module appends multi-controlled X (MCX) gates to the circuits of the benchmarks (grovers, amplitude-estimation
+# and monte-carlo) with a selectable synthesis strategy, trading extra (ancilla) qubits for circuit depth:
+#   "noancilla"     - the Qiskit mcx gate without ancillas; O(n^2) gates for n controls once transpiled
+#   "v-chain"       - a chain of Toffoli gates through n-2 clean ancillas (in state |0>); O(n) gates and depth
+#   "v-chain-dirty" - a chain of Toffoli gates through n-2 ancillas in any state; O(n) gates and depth
+#   "log-depth"     - a tree of Toffoli gates computing the AND of the controls in n-2 clean ancillas; O(log n) depth
+# Ancillas are returned to their initial state. Gates with at most two controls never use ancillas.
+#
+
+from qiskit.circuit.library.standard_gates import RYGate
+
+# Names of the MCX synthesis strategies
+mcx_modes = [ "noancilla", "v-chain", "v-chain-dirty", "log-depth" ]
+
+
+# Return the number of ancilla qubits an MCX strategy uses for a number of controls
+def num_mcx_ancillas (num_controls, mode="noancilla"):
+    if mode not in mcx_modes:
+        raise ValueError(f"unknown mcx mode '{mode}', expected one of {mcx_modes}")
+    if mode == "noancilla":
+        return 0
+    return max(0, num_controls - 2)
+
+# Append an MCX gate to a circuit using a synthesis strategy, with the ancilla qubits it uses (see num_mcx_ancillas)
+def append_mcx (qc, controls, target, ancillas=(), mode="noancilla"):
+    num_ancillas = num_mcx_ancillas(len(controls), mode)
+    if len(ancillas) < num_ancillas:
+        raise ValueError(f"mcx mode '{mode}' with {len(controls)} controls needs {num_ancillas} ancillas, given {len(ancillas)}")
+    ancillas = list(ancillas)[:num_ancillas]
+
+    if num_ancillas == 0:
+        qc.mcx(controls, target)
+    elif mode == "log-depth":
+        append_mcx_log_depth(qc, controls, target, ancillas)
+    else:
+        qc.mcx(controls, target, ancillas, mode=mode)
+
+# Append an MCX gate as a tree of Toffoli gates: pairs of controls are combined into clean ancillas, level by level,
+# the last pair is combined into the target, and the ancillas are then uncomputed in reverse order
+def append_mcx_log_depth (qc, controls, target, ancillas):
+    free = list(ancillas)
+    nodes = list(controls)
+    gates = []
+    while len(nodes) > 2:
+        next_nodes = []
+        for i in range(0, len(nodes) - 1, 2):
+            ancilla = free.pop(0)
+            gates.append((nodes[i], nodes[i+1], ancilla))
+            next_nodes.append(ancilla)
+        if len(nodes) % 2 == 1:
+            next_nodes.append(nodes[-1])
+        nodes = next_nodes
+
+    for gate in gates:
+        qc.ccx(*gate)
+    qc.mcx(nodes, target)
+    for gate in reversed(gates):
+        qc.ccx(*gate)
+
+# Append a multi-controlled RY gate, applying RY(theta) to the target if the controls are in 'ctrl_state'
+# (a bitstring, with the first control as its last bit), using an MCX synthesis strategy;
+# with ancillas, it is built from two MCX gates, as RY(theta/2) MCX RY(-theta/2) MCX
+def append_mcry (qc, theta, controls, target, ctrl_state=None, ancillas=(), mode="noancilla"):
+    if ctrl_state == None:
+        ctrl_state = '1' * len(controls)
+
+    if num_mcx_ancillas(len(controls), mode) == 0:
+        qc.append(RYGate(theta).control(len(controls), ctrl_state=ctrl_state), [*controls, target])
+        return
+
+    flips = [ controls[i] for i, bit in enumerate(reversed(ctrl_state)) if bit == '0' ]
+    for q in flips:
+        qc.x(q)
+    qc.ry(theta/2, target)
+    append_mcx(qc, controls, target, ancillas, mode)
+    qc.ry(-theta/2, target)
+    append_mcx(qc, controls, target, ancillas, mode)
+    for q in flips:
+        qc.x(q)
+
+
+##### Tests
+
+# Check that each strategy flips the target only when all controls are |1>, returning the ancillas to their state,
+# for all basis states of up to 5 controls (with the ancillas in |0>, or in |1> for the dirty strategy)
+def test_mcx_gates ():
+    from qiskit import QuantumCircuit
+    from qiskit.quantum_info import Statevector
+
+    for mode in mcx_modes:
+        for num_controls in range(1, 6):
+            num_ancillas = num_mcx_ancillas(num_controls, mode)
+            ancilla_bit = 1 if mode == "v-chain-dirty" else 0
+            for controls in range(2 ** num_controls):
+                for target in (0, 1):
+                    qc = QuantumCircuit(num_controls + 1 + num_ancillas)
+                    append_mcx(qc, list(range(num_controls)), num_controls, list(range(num_controls + 1, qc.num_qubits)), mode)
+
+                    ancillas = (2 ** num_ancillas - 1) * ancilla_bit
+                    state = controls | target << num_controls | ancillas << (num_controls + 1)
+                    flip = 1 if controls == 2 ** num_controls - 1 else 0
+                    expected = controls | (target ^ flip) << num_controls | ancillas << (num_controls + 1)
+
+                    probs = Statevector.from_int(state, 2 ** qc.num_qubits).evolve(qc).probabilities()
+                    assert abs(probs[expected] - 1) < 1e-9, (mode, num_controls, controls, target)
+
+    # the controlled RY with ancillas matches the one without, ancillas included
+    states = []
+    for mode in mcx_modes:
+        qc = QuantumCircuit(4 + 1 + num_mcx_ancillas(4, "v-chain"))
+        qc.h([0, 1, 2, 3])
+        append_mcry(qc, 0.7, [0, 1, 2, 3], 4, ctrl_state="0101", ancillas=[5, 6], mode=mode)
+        states.append(Statevector(qc))
+    for state in states[1:]:
+        assert state.equiv(states[0])
+
+    print("... test_mcx_gates passed")
+
+#test_mcx_gates()
@@ -0,0 +1,97 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###########################
+# QFT Library Module - Qiskit
+#
+# This module provides the quantum Fourier transform (QFT) and inverse QFT used by the benchmarks
+# (quantum-fourier-transform, phase-estimation, amplitude-estimation, monte-carlo and shors).
+# Each component is built once per (size, inverse, approximation degree, swaps) and cached; 'qft_gate' and
+# 'inv_qft_gate' return the cached instruction itself, shared by all circuits that append it, so that it is
+# expanded only once when the circuits are flattened. The instruction and its definition are read-only:
+# callers must not modify them, and should copy the instruction first if they need a variant.
+#
+# The circuits are those of the QFT benchmark: a Hadamard on each qubit, from the highest order qubit,
+# with controlled RZ rotations of angle pi/2^k from each lower order qubit, and a barrier after each qubit.
+# With an approximation degree d > 0, the d smallest rotations of each qubit (k > size - 1 - d) are omitted;
+# with d = size - 1 - ceil(log2(size)), the gate count is O(n log n) rather than O(n^2).
+#
+
+import math
+from functools import lru_cache
+
+from qiskit import QuantumCircuit, QuantumRegister
+
+
+# Return the QFT (or inverse QFT) instruction on 'size' qubits, built once and cached
+# The instruction returned is shared by all callers and must not be modified.
+# Rotations of angle pi/2^k with k > size - 1 - approximation_degree are omitted.
+# If do_swaps, the order of the qubits is reversed at the end of the QFT (start of the inverse).
+@lru_cache(maxsize=None)
+def qft_component (size, inverse=False, approximation_degree=0, do_swaps=False):
+    max_k = size - 1 - approximation_degree
+
+    qr = QuantumRegister(size)
+    qc = QuantumCircuit(qr, name="inv_qft" if inverse else "qft")
+
+    # the inverse starts by reversing the order of the qubits
+    if inverse and do_swaps:
+        for i in range(size // 2):
+            qc.swap(qr[i], qr[size - i - 1])
+
+    # Generate multiple groups of diminishing angle CRZs and H gate, starting from the highest order qubit (the hidx)
+    # for the QFT, or with the same groups in reverse order and with negated angles for the inverse
+    for i_qubit in (reversed(range(0, size)) if inverse else range(0, size)):
+        hidx = size - i_qubit - 1
+        rotations = [ j for j in range(0, i_qubit) if i_qubit - j <= max_k ]
+
+        if inverse:
+            qc.h(qr[hidx])
+            for j in reversed(rotations):
+                qc.crz(-math.pi / 2 ** (i_qubit - j), qr[hidx], qr[size - j - 1])
+        else:
+            for j in rotations:
+                qc.crz(math.pi / 2 ** (i_qubit - j), qr[hidx], qr[size - j - 1])
+            qc.h(qr[hidx])
+
+        qc.barrier()
+
+    # the QFT ends by reversing the order of the qubits
+    if not inverse and do_swaps:
+        for i in range(size // 2):
+            qc.swap(qr[i], qr[size - i - 1])
+
+    return qc.to_instruction()
+
+# Return the QFT instruction on 'input_size' qubits (shared and read-only)
+def qft_gate (input_size, approximation_degree=0, do_swaps=False):
+    return qft_component(input_size, False, approximation_degree, do_swaps)
+
+# Return the inverse QFT instruction on 'input_size' qubits (shared and read-only)
+def inv_qft_gate (input_size, approximation_degree=0, do_swaps=False):
+    return qft_component(input_size, True, approximation_degree, do_swaps)
+
+# Return the approximation degree giving O(n log n) rotations on 'size' qubits,
+# keeping rotations of angle down to about pi/size
+def log_approximation_degree (size):
+    return max(0, size - 1 - math.ceil(math.log2(size))) if size > 1 else 0
+
+# Return the approximation degree on 'size' qubits for a benchmark's 'approximation_degree' option,
+# a number of rotations to omit or "log" for log_approximation_degree(size)
+def approximation_degree_for (size, approximation_degree):
+    if approximation_degree == "log":
+        return log_approximation_degree(size)
+    return min(int(approximation_degree), max(0, size - 1))
@@ -0,0 +1,69 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Seeding Module
+#
+# This module provides the random number generators used to generate benchmark circuits.
+# Rather than drawing from the global numpy generator in sequence, each benchmark obtains an
+# independent generator for each group (circuit width) and each circuit, derived from a base seed
+# with numpy SeedSequence, as if spawned from it: seed_sequence(app, width, index) has spawn key
+# (app, width, index). The circuits generated for a group or circuit are then the same whether
+# groups are generated in order, out of order, in parallel or loaded from a cache.
+#
+
+import zlib
+
+import numpy as np
+
+# Base seed of all generators; change to generate a different, equally reproducible, set of circuits
+base_seed = 0
+
+
+# Return a non-negative integer for use in a spawn key, stable across runs (unlike hash())
+def key_int (key):
+    if isinstance(key, (int, np.integer)) and key >= 0:
+        return int(key)
+    return zlib.crc32(str(key).encode())
+
+# Return the SeedSequence for an app and keys, e.g. (width) for a group or (width, circuit index) for a circuit
+def seed_sequence (app, *keys):
+    spawn_key = tuple(key_int(key) for key in (app,) + keys)
+    return np.random.SeedSequence(base_seed, spawn_key=spawn_key)
+
+# Return a new random number generator for an app and keys
+def get_rng (app, *keys):
+    return np.random.default_rng(seed_sequence(app, *keys))
+
+
+##### Tests
+
+# Check that the generators depend only on their app and keys, not on the order in which they are created
+def test_seeding ():
+    first = get_rng("test", 3, 1).random(4)
+    get_rng("test", 4)
+    assert np.array_equal(get_rng("test", 3, 1).random(4), first)
+
+    others = [ get_rng("test", 3, 0), get_rng("test", 3), get_rng("other", 3, 1), get_rng("test", 1, 3) ]
+    for rng in others:
+        assert not np.array_equal(rng.random(4), first)
+
+    # string keys are stable across runs, as crc32 of the string
+    assert key_int("test") == zlib.crc32(b"test") and key_int(5) == 5
+
+    print("... test_seeding passed")
+
+#test_seeding()
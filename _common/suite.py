@@ -0,0 +1,230 @@
+###############################################################################
+# (C) Quantum Economic Development Consortium (QED-C) 2021.
+# Technical Advisory Committee on Standards and Benchmarks (TAC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##########################
+# Suite Runner Module
+#
+# This module runs a suite of benchmark apps without a notebook, as configured in a JSON file.
+# Each app is run in its own worker process, with at most a given number running at once,
+# so that local simulation of the suite scales with the number of cores.
+# Each worker saves its results to the DATA file of the backend, as when run from the notebooks,
+# with plotting deferred; the results are compacted and the plots rendered when all apps have run.
+# The output of each app is written to a log file rather than to the console.
+#
+# Run from the top level directory, e.g.
+#   python -m _common.suite suite.json --processes 4
+#
+# The exit status is 0 if all apps ran successfully, and 1 otherwise.
+#
+# Example configuration; settings at the top level apply to all apps, and may be overridden for each app:
+#   {
+#     "api": "qiskit",
+#     "backend_id": "qasm_simulator",
+#     "min_qubits": 2, "max_qubits": 8, "max_circuits": 3, "num_shots": 1000,
+#     "processes": 4,
+#     "cache_circuits": true,
+#     "apps": [
+#       "deutsch-jozsa",
+#       { "app": "bernstein-vazirani", "method": 1 },
+#       { "app": "bernstein-vazirani", "method": 2 },
+#       { "app": "shors", "method": 1, "max_circuits": 1 }
+#     ]
+#   }
+#
+# An app is named by its directory; other keys are passed to its run() function if it accepts them.
+#
+
+import argparse
+import glob
+import inspect
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+# Settings used when not given in the configuration
+default_settings = {
+    "api": "qiskit",
+    "backend_id": "qasm_simulator",
+    "min_qubits": 2,
+    "max_qubits": 8,
+    "max_circuits": 3,
+    "num_shots": 1000,
+}
+
+# Keys of the configuration used by the suite runner itself, not passed to run()
+suite_keys = [ "app", "api", "apps", "processes", "threads_per_worker", "render", "formats", "log_dir",
+        "cache_circuits" ]
+
+# Directory for the output of each app
+log_dir = "__data/suite-logs"
+
+
+##### Worker methods
+
+# Return the path of the benchmark module for the given app directory and API
+def find_benchmark (app, api, top="."):
+    paths = sorted(glob.glob(os.path.join(top, app, api, "*_benchmark.py")))
+    if len(paths) == 0:
+        raise ValueError(f"no {api} benchmark found for app {app}")
+    return paths[0]
+
+# Return a name for the log file of a task
+def task_name (task):
+    name = f'{task["app"]}-{task["api"]}'
+    if "method" in task:
+        name += f'-{task["method"]}'
+    return name
+
+# Run one app in a worker process, with output written to its log file
+# Returns a (name, elapsed time, error) tuple, with error None on success
+def run_task (task):
+    name = task_name(task)
+    start = time.time()
+
+    # limit the threads used by each simulator, so that the workers don't oversubscribe the cores
+    threads = task.get("threads_per_worker")
+    if threads != None:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    os.makedirs(task.get("log_dir", log_dir), exist_ok=True)
+    logname = os.path.join(task.get("log_dir", log_dir), name + ".log")
+
+    with open(logname, 'w') as log:
+        sys.stdout = sys.stderr = log
+        try:
+            path = find_benchmark(task["app"], task["api"])
+            dirname, filename = os.path.split(path)
+
+            # set up the module path as the notebooks do
+            sys.path.insert(1, os.path.join("_common", task["api"]))
+            sys.path.insert(1, "_common")
+            sys.path.insert(1, dirname)
+
+            # save the metrics without drawing plots; they are rendered when all apps have run
+            import metrics
+            metrics.defer_plots = True
+            metrics.show_plots = False
+
+            # load unchanged circuits from the circuit cache, if enabled
+            if task.get("cache_circuits", False):
+                import circuit_cache
+                circuit_cache.enabled = True
+
+            module = __import__(filename[:-3])
+
+            # pass only the settings accepted by this benchmark's run() function
+            params = inspect.signature(module.run).parameters
+            kwargs = { k: v for k, v in task.items() if k not in suite_keys and k in params }
+            module.run(**kwargs)
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return name, time.time() - start, str(e)
+
+        finally:
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
+
+    return name, time.time() - start, None
+
+
+##### Suite methods
+
+# Return the list of tasks for the given configuration, one per app
+def make_tasks (config):
+    settings = dict(default_settings)
+    settings.update({ k: v for k, v in config.items() if k != "apps" })
+
+    tasks = []
+    for app in config.get("apps", []):
+        task = dict(settings)
+        task.update({ "app": app } if isinstance(app, str) else app)
+        tasks.append(task)
+
+    return tasks
+
+# Run all apps of the configuration in parallel worker processes
+# Returns the number of apps that failed
+def run_suite (config, processes=None):
+    tasks = make_tasks(config)
+    if len(tasks) == 0:
+        print("... no apps to run")
+        return 0
+
+    if processes == None:
+        processes = config.get("processes") or os.cpu_count()
+    processes = min(processes, len(tasks))
+
+    # share the cores among the workers, unless configured
+    threads = config.get("threads_per_worker", max(1, (os.cpu_count() or 1) // processes))
+    for task in tasks:
+        task.setdefault("threads_per_worker", threads)
+
+    print(f"... running {len(tasks)} apps in {processes} worker processes, logs in {config.get('log_dir', log_dir)}")
+    start = time.time()
+
+    # each app runs in a fresh interpreter, as the benchmark modules keep state in module globals
+    ctx = multiprocessing.get_context("spawn")
+    num_failed = 0
+    with ctx.Pool(processes, maxtasksperchild=1) as pool:
+        for name, elapsed, error in pool.imap_unordered(run_task, tasks):
+            if error == None:
+                print(f"... completed {name} in {round(elapsed, 3)} secs")
+            else:
+                num_failed += 1
+                print(f"ERROR: failed to run {name} after {round(elapsed, 3)} secs")
+                print(f"... exception = {error}")
+
+    print(f"... ran {len(tasks)} apps in {round(time.time() - start, 3)} secs, {num_failed} failed")
+
+    # fold the results of all workers into the DATA file of each backend
+    sys.path.insert(1, "_common")
+    import metrics
+    for backend_id in sorted(set(task["backend_id"] for task in tasks)):
+        metrics.compact_app_metrics(backend_id)
+
+    # draw the plots for all apps that ran
+    if config.get("render", True):
+        import metrics_render
+        backend_ids = sorted(set(task["backend_id"].replace("/", "_") for task in tasks))
+        if metrics_render.render(backend_ids, None, config.get("formats"), processes=processes) > 0:
+            num_failed += 1
+
+    return num_failed
+
+
+##### Command line
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Run a suite of benchmark apps in parallel worker processes")
+    parser.add_argument("config", help="JSON configuration file")
+    parser.add_argument("--processes", type=int, default=None, help="maximum number of apps run at once")
+    parser.add_argument("--no-render", action="store_true", help="don't render the plots when all apps have run")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    if args.no_render:
+        config["render"] = False
+
+    num_failed = run_suite(config, args.processes)
+    return 1 if num_failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,7 @@ Amplitude Estimation Benchmark Program via Phase Estimation - Cirq
 
 from collections import defaultdict
 import copy
+import functools
 import sys
 import time
 
@@ -169,26 +170,26 @@ def analyze_and_print_result(qc, result, num_counting_qubits, s_int, num_shots):
     correct_dist = {a: 1.0}
 
     # generate thermal_dist with amplitudes instead, to be comparable to correct_dist
-    bit_thermal_dist = metrics.uniform_dist(num_counting_qubits)
-    thermal_dist = bitstring_to_a(bit_thermal_dist, num_counting_qubits)
+    thermal_dist = metrics.uniform_value_dist(a_value_table(num_counting_qubits))
 
     # use our polarization fidelity rescaling
     fidelity = metrics.polarization_fidelity(counts, correct_dist, thermal_dist)
         
     return counts, fidelity
 
+# Return the counts of the amplitudes estimated from the counts of measured bitstrings
 def bitstring_to_a(counts, num_counting_qubits):
-    est_counts = {}
+    return metrics.value_counts(counts, a_value_table(num_counting_qubits))
+
+# Return the amplitude estimated from each integer outcome of the counting qubits, as an array indexed by outcome
+@functools.lru_cache(maxsize=None)
+def a_value_table(num_counting_qubits):
     m = num_counting_qubits
     precision = int(num_counting_qubits / (np.log2(10))) + 2
-    for key in counts.keys():
-        r = counts[key]
-        num = int(key,2) / (2**m)
-        a_est = round((np.sin(np.pi * num) )** 2, precision)
-        if a_est not in est_counts.keys():
-            est_counts[a_est] = 0
-        est_counts[a_est] += r
-    return est_counts
+    num = np.arange(2**m) / (2**m)
+    a_est = np.round(np.sin(np.pi * num) ** 2, precision)
+    a_est.setflags(write=False)
+    return a_est
 
 def a_from_s_int(s_int, num_counting_qubits):
     theta = s_int * np.pi / (2**num_counting_qubits)
@@ -3,19 +3,22 @@ Amplitude Estimation Benchmark Program via Phase Estimation - Qiskit
 """
 
 import copy
+import functools
 import sys
-import time
 
 import numpy as np
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
-sys.path[1:1] = ["_common", "_common/qiskit", "quantum-fourier-transform/qiskit"]
-sys.path[1:1] = ["../../_common", "../../_common/qiskit", "../../quantum-fourier-transform/qiskit"]
+sys.path[1:1] = ["_common", "_common/qiskit"]
+sys.path[1:1] = ["../../_common", "../../_common/qiskit"]
 import execute as ex
 import metrics as metrics
-from qft_benchmark import inv_qft_gate
-
-np.random.seed(0)
+import circuit_cache
+from flatten import flatten_circuit
+import seeding
+from qft_library import inv_qft_gate
+from controlled_power import controlled_power
+import mcx_gates
 
 verbose = False
 
@@ -28,42 +31,53 @@ QFTI_ = None
 
 ############### Circuit Definition
 
-def AmplitudeEstimation(num_state_qubits, num_counting_qubits, a, psi_zero=None, psi_one=None):
+def AmplitudeEstimation(num_state_qubits, num_counting_qubits, a, psi_zero=None, psi_one=None, mcx_mode="noancilla"):
     qr_state = QuantumRegister(num_state_qubits+1)
     qr_counting = QuantumRegister(num_counting_qubits)
     cr = ClassicalRegister(num_counting_qubits)
     qc = QuantumCircuit(qr_counting, qr_state, cr)
     
+    # add the ancillas used by the mcx gates of cQ (if any)
+    num_anc = num_ancillas(num_state_qubits, mcx_mode)
+    qr_anc = []
+    if num_anc > 0:
+        qr_anc = QuantumRegister(num_anc, name="anc")
+        qc.add_register(qr_anc)
+    
     num_qubits = num_state_qubits + 1 + num_counting_qubits
 
     # create the Amplitude Generator circuit
     A = A_gen(num_state_qubits, a, psi_zero, psi_one)
 
     # create the Quantum Operator circuit and a controlled version of it
-    cQ, Q = Ctrl_Q(num_state_qubits, A)
+    cQ, Q = Ctrl_Q(num_state_qubits, A, mcx_mode)
     
     # save small example subcircuits for visualization
     global A_, Q_, cQ_, QFTI_
     if (cQ_ and Q_) == None or num_state_qubits <= 6:
         if num_state_qubits < 9: cQ_ = cQ; Q_ = Q; A_ = A
-    if QFTI_ == None or num_qubits <= 5:
-        if num_qubits < 9: QFTI_ = inv_qft_gate(num_counting_qubits)
 
     # Prepare state from A, and counting qubits with H transform 
     qc.append(A, [qr_state[i] for i in range(num_state_qubits+1)])
     for i in range(num_counting_qubits):
         qc.h(qr_counting[i])
     
+    # apply cQ^repeat for each counting qubit, with Q^repeat in closed form (see Ctrl_Q_power)
+    closed_form = lambda power: Ctrl_Q_power(num_state_qubits, a, psi_zero, psi_one, power, mcx_mode)
+    cQ_gate = cQ.to_instruction()
     repeat = 1
     for j in reversed(range(num_counting_qubits)):
-        for _ in range(repeat):
-            qc.append(cQ, [qr_counting[j]] + [qr_state[l] for l in range(num_state_qubits+1)])
+        qc.append(controlled_power(cQ_gate, repeat, closed_form),
+                [qr_counting[j]] + [qr_state[l] for l in range(num_state_qubits+1)] + qr_anc[:])
         repeat *= 2
     
     qc.barrier()
 
     # inverse quantum Fourier transform only on counting qubits
-    qc.append(inv_qft_gate(num_counting_qubits), qr_counting)
+    iqft = inv_qft_gate(num_counting_qubits)
+    qc.append(iqft, qr_counting)
+    if QFTI_ == None or num_qubits <= 5:
+        if num_qubits < 9: QFTI_ = iqft.definition
 
     qc.barrier()
 
@@ -91,25 +105,42 @@ def A_gen(num_state_qubits, a, psi_zero=None, psi_one=None):
     # takes state to |0>_{n} (sqrt(1-a) |0> + sqrt(a) |1>)
     qc_A.ry(theta, num_state_qubits)
     
-    # takes state to sqrt(1-a) |psi_0>|0> + sqrt(a) |0>_{n}|1>
-    qc_A.x(num_state_qubits)
-    for i in range(num_state_qubits):
-        if psi_zero[i]=='1':
-            qc_A.cnot(num_state_qubits,i)
-    qc_A.x(num_state_qubits)
-    
     # takes state to sqrt(1-a) |psi_0>|0> + sqrt(a) |psi_1>|1>
-    for i in range(num_state_qubits):
-        if psi_one[i]=='1':
-            qc_A.cnot(num_state_qubits,i)
+    psi_gen(qc_A, num_state_qubits, psi_zero, psi_one)
     
     return qc_A
 
-# Construct the grover-like operator and a controlled version of it
-def Ctrl_Q(num_state_qubits, A_circ):
+# Append the operator C taking |0>_{n}|b> to |psi_b>|b>, on state qubits 0 through n-1 and objective qubit n
+# (the qubit indexes are offset by 'start', to place the operator within a larger circuit)
+def psi_gen(qc, num_state_qubits, psi_zero, psi_one, start=0):
+    obj = start + num_state_qubits
 
-    # index n is the objective qubit, and indexes 0 through n-1 are state qubits
-    qc = QuantumCircuit(num_state_qubits+1, name=f"Q")
+    # takes |0>_{n}|0> to |psi_0>|0>
+    qc.x(obj)
+    for i in range(num_state_qubits):
+        if psi_zero[i]=='1':
+            qc.cnot(obj, start + i)
+    qc.x(obj)
+    
+    # takes |0>_{n}|1> to |psi_1>|1>
+    for i in range(num_state_qubits):
+        if psi_one[i]=='1':
+            qc.cnot(obj, start + i)
+
+# Return the number of ancilla qubits used by the mcx gates of Q and of the closed form of its powers (see mcx_gates.py)
+# The multi-controlled RY of the closed form has the most controls, the control qubit and the state qubits.
+def num_ancillas(num_state_qubits, mcx_mode):
+    return mcx_gates.num_mcx_ancillas(num_state_qubits + 1, mcx_mode)
+
+# Construct the grover-like operator and a controlled version of it, using the given mcx synthesis strategy
+# Both have the ancillas used by the mcx gates (if any) as their last qubits.
+# The controlled version is qc.control(1) with every strategy, as before the strategies were added,
+# so the circuits of the strategies differ only in the synthesis of their mcx gates.
+def Ctrl_Q(num_state_qubits, A_circ, mcx_mode="noancilla"):
+
+    # index n is the objective qubit, and indexes 0 through n-1 are state qubits, followed by the ancillas
+    num_anc = num_ancillas(num_state_qubits, mcx_mode)
+    qc = QuantumCircuit(num_state_qubits+1+num_anc, name=f"Q")
     
     temp_A = copy.copy(A_circ)
     A_gate = temp_A.to_gate()
@@ -129,7 +160,8 @@ def Ctrl_Q(num_state_qubits, A_circ):
         qc.x(i)
     qc.h(num_state_qubits)
     
-    qc.mcx([x for x in range(num_state_qubits)], num_state_qubits)
+    mcx_gates.append_mcx(qc, [x for x in range(num_state_qubits)], num_state_qubits,
+            [x for x in range(num_state_qubits+1, qc.num_qubits)], mcx_mode)
     
     qc.h(num_state_qubits)
     for i in range(num_state_qubits+1):
@@ -138,15 +170,44 @@ def Ctrl_Q(num_state_qubits, A_circ):
     # A_circ
     qc.append(A_gate, [i for i in range(num_state_qubits+1)])
     
-    # Create a gate out of the Q operator
-    qc.to_gate(label='Q')
-    
-    # and also a controlled version of it
+    # and also a controlled version of it, with the control qubit at index 0
     Ctrl_Q_ = qc.control(1)
     
     # and return both
     return Ctrl_Q_, qc
 
+# Construct the controlled Q^power operator in closed form, for even powers (or return None)
+# With A = C RY(theta), where C takes |0>_{n}|b> to |psi_b>|b> (see psi_gen), Q = C B C^dagger, where B applies
+# RY(2*theta) to the objective when the state qubits are |0>_{n}, and -XZX otherwise. For even powers,
+# Q^power = C MCRY(2*power*theta) C^dagger, with the RY controlled on the state qubits being |0>_{n}.
+def Ctrl_Q_power(num_state_qubits, a, psi_zero, psi_one, power, mcx_mode="noancilla"):
+    if power % 2 == 1:
+        return None
+
+    if psi_zero==None:
+        psi_zero = '0'*num_state_qubits
+    if psi_one==None:
+        psi_one = '1'*num_state_qubits
+
+    theta = 2 * np.arcsin(np.sqrt(a))
+
+    # index 0 is the control qubit, n+1 is the objective qubit, and indexes 1 through n are state qubits,
+    # followed by the ancillas used by the mcx gates (if any)
+    num_anc = num_ancillas(num_state_qubits, mcx_mode)
+    qc = QuantumCircuit(num_state_qubits+2+num_anc, name=f"cQ^{power}")
+
+    # C^dagger (C is its own inverse, as it only applies X and CNOT gates controlled by the objective)
+    psi_gen(qc, num_state_qubits, psi_zero, psi_one, start=1)
+
+    # RY(2*power*theta) on the objective, if the control qubit is |1> and the state qubits are |0>_{n}
+    mcx_gates.append_mcry(qc, 2*power*theta, [i for i in range(num_state_qubits+1)], num_state_qubits+1,
+            ctrl_state=format(1, f"0{num_state_qubits+1}b"), ancillas=list(range(num_state_qubits+2, qc.num_qubits)), mode=mcx_mode)
+
+    # C
+    psi_gen(qc, num_state_qubits, psi_zero, psi_one, start=1)
+
+    return qc.to_instruction()
+
 # Analyze and print measured results
 # Expected result is always the secret_int, so fidelity calc is simple
 def analyze_and_print_result(qc, result, num_counting_qubits, s_int, num_shots):
@@ -160,26 +221,26 @@ def analyze_and_print_result(qc, result, num_counting_qubits, s_int, num_shots):
     correct_dist = {a: 1.0}
 
     # generate thermal_dist with amplitudes instead, to be comparable to correct_dist
-    bit_thermal_dist = metrics.uniform_dist(num_counting_qubits)
-    thermal_dist = bitstring_to_a(bit_thermal_dist, num_counting_qubits)
+    thermal_dist = metrics.uniform_value_dist(a_value_table(num_counting_qubits))
 
     # use our polarization fidelity rescaling
     fidelity = metrics.polarization_fidelity(counts, correct_dist, thermal_dist)
     
     return counts, fidelity
 
+# Return the counts of the amplitudes estimated from the counts of measured bitstrings
 def bitstring_to_a(counts, num_counting_qubits):
-    est_counts = {}
+    return metrics.value_counts(counts, a_value_table(num_counting_qubits))
+
+# Return the amplitude estimated from each integer outcome of the counting qubits, as an array indexed by outcome
+@functools.lru_cache(maxsize=None)
+def a_value_table(num_counting_qubits):
     m = num_counting_qubits
     precision = int(num_counting_qubits / (np.log2(10))) + 2
-    for key in counts.keys():
-        r = counts[key]
-        num = int(key,2) / (2**m)
-        a_est = round((np.sin(np.pi * num) )** 2, precision)
-        if a_est not in est_counts.keys():
-            est_counts[a_est] = 0
-        est_counts[a_est] += r
-    return est_counts
+    num = np.arange(2**m) / (2**m)
+    a_est = np.round(np.sin(np.pi * num) ** 2, precision)
+    a_est.setflags(write=False)
+    return a_est
 
 def a_from_s_int(s_int, num_counting_qubits):
     theta = s_int * np.pi / (2**num_counting_qubits)
@@ -197,6 +258,7 @@ MAX_QUBITS=8
 # Execute program with default parameters
 def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
         num_state_qubits=1, # default, not exposed to users
+        mcx_mode="noancilla",
         backend_id='qasm_simulator', provider_backend=None,
         hub="ibm-q", group="open", project="main", exec_options=None):
 
@@ -215,6 +277,13 @@ def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
     min_qubits = max(max(3, min_qubits), num_state_qubits + 2)
     #print(f"min, max, state = {min_qubits} {max_qubits} {num_state_qubits}")
 
+    # validate the synthesis strategy of the mcx gates, which may add ancilla qubits
+    if mcx_mode not in mcx_gates.mcx_modes:
+        print(f"ERROR: unknown mcx_mode '{mcx_mode}', expected one of {mcx_gates.mcx_modes}")
+        return
+    if mcx_mode != "noancilla":
+        print(f"... using MCX mode {mcx_mode}")
+
     # Initialize metrics module
     metrics.init_metrics()
 
@@ -231,45 +300,43 @@ def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
     ex.set_execution_target(backend_id, provider_backend=provider_backend,
             hub=hub, group=group, project=project, exec_options=exec_options)
 
-    # Execute Benchmark Program N times for multiple circuit sizes
-    # Accumulate metrics asynchronously as circuits complete
-    for num_qubits in range(min_qubits, max_qubits + 1):
-        
-        # as circuit width grows, the number of counting qubits is increased
-        num_counting_qubits = num_qubits - num_state_qubits - 1
+    # Generate circuits for each circuit size, ahead of their execution
+    # (runs in a background thread; see execute_pipelined)
+    def generate_circuits():
+        for num_qubits in range(min_qubits, max_qubits + 1):
 
-        # determine number of circuits to execute for this group
-        num_circuits = min(2 ** (num_counting_qubits), max_circuits)
-        
-        print(f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}")
-        
-        # determine range of secret strings to loop over
-        if 2**(num_counting_qubits) <= max_circuits:
-            s_range = list(range(num_circuits))
-        else:
-            s_range = np.random.choice(2**(num_counting_qubits), num_circuits, False)
-        
-        # loop over limited # of secret strings for this
-        for s_int in s_range:
-            # create the circuit for given qubit size and secret string, store time metric
-            ts = time.time()
+            # as circuit width grows, the number of counting qubits is increased
+            num_counting_qubits = num_qubits - num_state_qubits - 1
+
+            # determine number of circuits to execute for this group
+            num_circuits = min(2 ** (num_counting_qubits), max_circuits)
 
-            a_ = a_from_s_int(s_int, num_counting_qubits)
+            # announce the group, printed when its circuits are submitted (see execute_pipelined)
+            yield f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}"
 
-            qc = AmplitudeEstimation(num_state_qubits, num_counting_qubits, a_)
-            metrics.store_metric(num_qubits, s_int, 'create_time', time.time() - ts)
+            # determine range of secret strings to loop over
+            if 2**(num_counting_qubits) <= max_circuits:
+                s_range = list(range(num_circuits))
+            else:
+                s_range = seeding.get_rng("amplitude-estimation", num_qubits).choice(2**(num_counting_qubits), num_circuits, False)
 
-            # collapse the 3 sub-circuit levels used in this benchmark (for qiskit)
-            qc2 = qc.decompose().decompose().decompose()
-            
-            # submit circuit for execution on target (simulator, cloud simulator, or hardware)
-            ex.submit_circuit(qc2, num_qubits, s_int, num_shots)
+            # loop over limited # of secret strings for this
+            for s_int in s_range:
+                # create the circuit for given qubit size and secret string, or load it from the circuit cache,
+                # inlining the sub-circuits used in this benchmark (for qiskit)
+                a_ = a_from_s_int(s_int, num_counting_qubits)
 
-        # Wait for some active circuits to complete; report metrics when groups complete
-        ex.throttle_execution(metrics.finalize_group)
+                qc2, create_time = circuit_cache.get_circuit(
+                        lambda: AmplitudeEstimation(num_state_qubits, num_counting_qubits, a_, mcx_mode=mcx_mode),
+                        "amplitude-estimation", None, num_qubits, s_int, prepare=flatten_circuit,
+                        sources=(__file__, inv_qft_gate, controlled_power, mcx_gates), options=[num_state_qubits, mcx_mode])
 
-    # Wait for all active circuits to complete; report metrics when groups complete
-    ex.finalize_execution(metrics.finalize_group)
+                # pass circuit on for execution on target (simulator, cloud simulator, or hardware)
+                yield qc2, num_qubits, s_int, num_shots, create_time
+
+    # Execute Benchmark Program N times for multiple circuit sizes
+    # Accumulate metrics asynchronously as circuits complete; report metrics when groups complete
+    ex.execute_pipelined(generate_circuits(), metrics.finalize_group)
 
     # print a sample circuit
     print("Sample Circuit:"); print(QC_ if QC_ != None else "  ... too large!")
@@ -279,7 +346,30 @@ def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
     print("\nInverse QFT Circuit ="); print(QFTI_ if QC_ != None else "  ... too large!")
 
     # Plot metrics for all circuit sizes
-    metrics.plot_metrics("Benchmark Results - Amplitude Estimation - Qiskit")
+    # (non-default mcx modes are named in the title, so their metrics are kept apart)
+    mode_label = f" ({mcx_mode})" if mcx_mode != "noancilla" else ""
+    metrics.plot_metrics(f"Benchmark Results - Amplitude Estimation{mode_label} - Qiskit")
+
+
+##### Tests
+
+# Check that the closed form of cQ^power is the same operator as cQ applied 'power' times
+# (with the strategies whose ancillas are returned to any initial state, so the whole operators are equal)
+def test_ctrl_q_power ():
+    from qiskit.quantum_info import Operator
+
+    for mcx_mode in ("noancilla", "v-chain-dirty"):
+        for num_state_qubits in (1, 2, 3):
+            A = A_gen(num_state_qubits, 0.3, '0' * (num_state_qubits - 1) + '1', '1' * num_state_qubits)
+            cQ, _ = Ctrl_Q(num_state_qubits, A, mcx_mode)
+            cQ_op = Operator(cQ)
+            for power in (2, 4):
+                closed = Ctrl_Q_power(num_state_qubits, 0.3, '0' * (num_state_qubits - 1) + '1', '1' * num_state_qubits,
+                        power, mcx_mode)
+                assert Operator(closed) == cQ_op.power(power), (mcx_mode, num_state_qubits, power)
+            assert Ctrl_Q_power(num_state_qubits, 0.3, None, None, 3, mcx_mode) == None
+
+    print("... test_ctrl_q_power passed")
 
 
 # if main, execute method
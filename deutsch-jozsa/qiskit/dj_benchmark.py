@@ -5,15 +5,13 @@ Deutsch-Jozsa Benchmark Program - Qiskit
 import sys
 import time
 
-import numpy as np
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
 sys.path[1:1] = [ "_common", "_common/qiskit" ]
 sys.path[1:1] = [ "../../_common", "../../_common/qiskit" ]
 import execute as ex
 import metrics as metrics
-
-np.random.seed(0)
+import seeding
 
 verbose = False
 
@@ -25,11 +23,12 @@ B_ORACLE_ = None
 ############### Circuit Definition
 
 # Create a constant oracle, appending gates to given circuit
-def constant_oracle (input_size, num_qubits):
+# The constant output is drawn from the given random number generator
+def constant_oracle (input_size, num_qubits, rng):
     #Initialize first n qubits and single ancilla qubit
     qc = QuantumCircuit(num_qubits, name=f"Uf")
 
-    output = np.random.randint(2)
+    output = rng.integers(2)
     if output == 1:
         qc.x(input_size)
 
@@ -68,7 +67,7 @@ def balanced_oracle (input_size, num_qubits):
 
     return qc
 # Create benchmark circuit
-def DeutschJozsa (num_qubits, type):
+def DeutschJozsa (num_qubits, type, rng):
     
     # Size of input is one less than available qubits
     input_size = num_qubits - 1
@@ -84,7 +83,7 @@ def DeutschJozsa (num_qubits, type):
     qc.barrier()
     
     # Add a constant or balanced oracle function
-    if type == 0: Uf = constant_oracle(input_size, num_qubits)
+    if type == 0: Uf = constant_oracle(input_size, num_qubits, rng)
     else: Uf = balanced_oracle(input_size, num_qubits)
     qc.append(Uf, qr)
 
@@ -180,7 +179,7 @@ def run (min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
             
             # create the circuit for given qubit size and secret string, store time metric
             ts = time.time()
-            qc = DeutschJozsa(num_qubits, type)
+            qc = DeutschJozsa(num_qubits, type, seeding.get_rng("deutsch-jozsa", num_qubits, type))
             metrics.store_metric(num_qubits, type, 'create_time', time.time()-ts)
 
             # collapse the sub-circuit levels used in this benchmark (for qiskit)
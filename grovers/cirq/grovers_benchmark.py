@@ -108,29 +108,33 @@ def analyze_and_print_result(qc, result, num_qubits, marked_item, num_shots):
         counts["".join([str(x) for x in reversed(row)])] += 1
     if verbose: print(f"For type {marked_item} measured: {counts}")
 
-    # we compare counts to analytical correct distribution
-    correct_dist = grovers_dist(num_qubits, marked_item)
-    if verbose: print(f"Marked item: {marked_item}, Correct dist: {correct_dist}")
+    # we compare counts to analytical correct distribution,
+    # given sparsely as the probability of the marked item and that of each other item
+    p_marked, p_other = grovers_probs(num_qubits)
+    correct_dist = { format(int(marked_item), f"0{num_qubits}b"): p_marked }
+    if verbose: print(f"Marked item: {marked_item}, Correct dist: {correct_dist}, others: {p_other}")
 
     # use our polarization fidelity rescaling
-    fidelity = metrics.polarization_fidelity(counts, correct_dist)
+    fidelity = metrics.polarization_fidelity_sparse(counts, correct_dist, p_other, num_qubits)
 
     return counts, fidelity
 
-def grovers_dist(num_qubits, marked_item):
+# Return the probabilities of measuring the marked item, and each of the other items, after the Grover iterations
+def grovers_probs(num_qubits):
     
     n_iterations = int(np.pi * np.sqrt(2 ** num_qubits) / 4)
+    theta = np.arcsin(1/np.sqrt(2 ** num_qubits))
+
+    p_marked = np.sin((2*n_iterations+1)*theta)**2
+    p_other = (np.cos((2*n_iterations+1)*theta)/(np.sqrt(2 ** num_qubits - 1)))**2
+    return p_marked, p_other
+
+def grovers_dist(num_qubits, marked_item):
     
-    dist = {}
+    p_marked, p_other = grovers_probs(num_qubits)
 
-    for i in range(2**num_qubits):
-        key = bin(i)[2:].zfill(num_qubits)
-        theta = np.arcsin(1/np.sqrt(2 ** num_qubits))
-        
-        if i == int(marked_item):
-            dist[key] = np.sin((2*n_iterations+1)*theta)**2
-        else:
-            dist[key] = (np.cos((2*n_iterations+1)*theta)/(np.sqrt(2 ** num_qubits - 1)))**2
+    dist = { format(i, f"0{num_qubits}b"): p_other for i in range(2**num_qubits) }
+    dist[format(int(marked_item), f"0{num_qubits}b")] = p_marked
     return dist
 
 
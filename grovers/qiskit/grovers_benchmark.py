@@ -2,6 +2,7 @@
 Grover's Search Benchmark Program - Qiskit
 """
 
+import functools
 import sys
 import time
 
@@ -12,8 +13,9 @@ sys.path[1:1] = ["_common", "_common/qiskit"]
 sys.path[1:1] = ["../../_common", "../../_common/qiskit"]
 import execute as ex
 import metrics as metrics
-
-np.random.seed(0)
+import seeding
+import mcx_gates
+from flatten import flatten_circuit
 
 verbose = False
 
@@ -25,33 +27,45 @@ diffusion_operator = None
 # for validating the implementation of an mcx shim  
 _use_mcx_shim = False 
 
+# MCX synthesis strategy used by the oracle and diffuser (see mcx_gates.py)
+_mcx_mode = "noancilla"
+
 ############### Circuit Definition
 
 def GroversSearch(num_qubits, marked_item, n_iterations):
 
-    # allocate qubits
+    # allocate qubits, with the ancillas used by the mcx gates (if any)
     qr = QuantumRegister(num_qubits);
     cr = ClassicalRegister(num_qubits);
     qc = QuantumCircuit(qr, cr, name="main")
+    
+    num_anc = num_ancillas(num_qubits, _use_mcx_shim, _mcx_mode)
+    if num_anc > 0:
+        qr_anc = QuantumRegister(num_anc, name="anc")
+        qc.add_register(qr_anc)
 
     # Start with Hadamard on all qubits
     for i_qubit in range(num_qubits):
         qc.h(qr[i_qubit])
 
+    # create the grover oracle and the diffusion operator (once for each width and marked item)
+    oracle = grover_oracle_instruction(num_qubits, int(marked_item), _use_mcx_shim, _mcx_mode)
+    diffuser = diffusion_operator_instruction(num_qubits, _use_mcx_shim, _mcx_mode)
+
     # loop over the estimated number of iterations
     for _ in range(n_iterations):
 
         qc.barrier()
     
         # add the grover oracle
-        qc.append(add_grover_oracle(num_qubits, marked_item).to_instruction(), qr)
+        qc.append(oracle, qc.qubits)
         
         # add the diffusion operator
-        qc.append(add_diffusion_operator(num_qubits).to_instruction(), qr)
+        qc.append(diffuser, qc.qubits)
 
     qc.barrier()
         
-    # measure all qubits
+    # measure all data qubits
     qc.measure(qr, cr)
 
     # save smaller circuit example for display
@@ -64,12 +78,20 @@ def GroversSearch(num_qubits, marked_item, n_iterations):
 
 ############## Grover Oracle
 
-def add_grover_oracle(num_qubits, marked_item):
+# Return the grover oracle as an instruction, built once for each width and marked item and shared by all iterations
+# (use_mcx_shim and mcx_mode are part of the cache key, as they change the circuit)
+@functools.lru_cache(maxsize=None)
+def grover_oracle_instruction(num_qubits, marked_item, use_mcx_shim, mcx_mode):
+    return add_grover_oracle(num_qubits, marked_item, use_mcx_shim, mcx_mode).to_instruction()
+
+# Build the grover oracle, using the mcx shim or else the given mcx synthesis strategy
+def add_grover_oracle(num_qubits, marked_item, use_mcx_shim=False, mcx_mode="noancilla"):
     global grover_oracle
     
     marked_item_bits = format(marked_item, f"0{num_qubits}b")[::-1]
 
     qr = QuantumRegister(num_qubits); qc = QuantumCircuit(qr, name="oracle")
+    qr_anc = add_ancilla_register(qc, use_mcx_shim, mcx_mode)
 
     for (q, bit) in enumerate(marked_item_bits):
         if not int(bit):
@@ -77,10 +99,10 @@ def add_grover_oracle(num_qubits, marked_item):
 
     qc.h(num_qubits - 1)
     
-    if _use_mcx_shim:
+    if use_mcx_shim:
         add_mcx(qc, [x for x in range(num_qubits - 1)], num_qubits - 1)
     else:
-        qc.mcx([x for x in range(num_qubits - 1)], num_qubits - 1)
+        mcx_gates.append_mcx(qc, [x for x in range(num_qubits - 1)], num_qubits - 1, qr_anc, mcx_mode)
         
     qc.h(num_qubits - 1)
 
@@ -97,10 +119,17 @@ def add_grover_oracle(num_qubits, marked_item):
 
 ############## Grover Diffusion Operator
 
-def add_diffusion_operator(num_qubits):
+# Return the diffusion operator as an instruction, built once for each width and shared by all iterations and circuits
+@functools.lru_cache(maxsize=None)
+def diffusion_operator_instruction(num_qubits, use_mcx_shim, mcx_mode):
+    return add_diffusion_operator(num_qubits, use_mcx_shim, mcx_mode).to_instruction()
+
+# Build the diffusion operator, using the mcx shim or else the given mcx synthesis strategy
+def add_diffusion_operator(num_qubits, use_mcx_shim=False, mcx_mode="noancilla"):
     global diffusion_operator
 
     qr = QuantumRegister(num_qubits); qc = QuantumCircuit(qr, name="diffuser")
+    qr_anc = add_ancilla_register(qc, use_mcx_shim, mcx_mode)
 
     for i_qubit in range(num_qubits):
         qc.h(qr[i_qubit])
@@ -108,10 +137,10 @@ def add_diffusion_operator(num_qubits):
         qc.x(qr[i_qubit])
     qc.h(num_qubits - 1)
     
-    if _use_mcx_shim:
+    if use_mcx_shim:
         add_mcx(qc, [x for x in range(num_qubits - 1)], num_qubits - 1)
     else:
-        qc.mcx([x for x in range(num_qubits - 1)], num_qubits - 1)
+        mcx_gates.append_mcx(qc, [x for x in range(num_qubits - 1)], num_qubits - 1, qr_anc, mcx_mode)
         
     qc.h(num_qubits - 1)
 
@@ -127,6 +156,23 @@ def add_diffusion_operator(num_qubits):
         
     return qc
 
+############### MCX ancillas
+
+# Return the number of ancilla qubits used by the mcx gates of the oracle and diffuser (none with the mcx shim)
+def num_ancillas(num_qubits, use_mcx_shim=False, mcx_mode="noancilla"):
+    if use_mcx_shim:
+        return 0
+    return mcx_gates.num_mcx_ancillas(num_qubits - 1, mcx_mode)
+
+# Add the ancilla register used by the mcx gates to an oracle or diffuser circuit, returning its qubits
+def add_ancilla_register(qc, use_mcx_shim=False, mcx_mode="noancilla"):
+    num_anc = num_ancillas(qc.num_qubits, use_mcx_shim, mcx_mode)
+    if num_anc == 0:
+        return []
+    qr_anc = QuantumRegister(num_anc, name="anc")
+    qc.add_register(qr_anc)
+    return qr_anc[:]
+
 ############### MCX shim
 
 # single cx / cu1 unit for mcx implementation
@@ -186,50 +232,45 @@ def analyze_and_print_result(qc, result, num_qubits, marked_item, num_shots):
     counts = result.get_counts(qc)
     if verbose: print(f"For type {marked_item} measured: {counts}")
 
-    # we compare counts to analytical correct distribution
-    correct_dist = grovers_dist(num_qubits, marked_item)
-    if verbose: print(f"Marked item: {marked_item}, Correct dist: {correct_dist}")
+    # we compare counts to analytical correct distribution,
+    # given sparsely as the probability of the marked item and that of each other item
+    p_marked, p_other = grovers_probs(num_qubits)
+    correct_dist = { format(int(marked_item), f"0{num_qubits}b"): p_marked }
+    if verbose: print(f"Marked item: {marked_item}, Correct dist: {correct_dist}, others: {p_other}")
 
     # use our polarization fidelity rescaling
-    fidelity = metrics.polarization_fidelity(counts, correct_dist)
+    fidelity = metrics.polarization_fidelity_sparse(counts, correct_dist, p_other, num_qubits)
 
     return counts, fidelity
 
-def grovers_dist(num_qubits, marked_item):
+# Return the probabilities of measuring the marked item, and each of the other items, after the Grover iterations
+def grovers_probs(num_qubits):
     
     n_iterations = int(np.pi * np.sqrt(2 ** num_qubits) / 4)
+    theta = np.arcsin(1/np.sqrt(2 ** num_qubits))
+
+    p_marked = np.sin((2*n_iterations+1)*theta)**2
+    p_other = (np.cos((2*n_iterations+1)*theta)/(np.sqrt(2 ** num_qubits - 1)))**2
+    return p_marked, p_other
+
+def grovers_dist(num_qubits, marked_item):
     
-    dist = {}
+    p_marked, p_other = grovers_probs(num_qubits)
 
-    for i in range(2**num_qubits):
-        key = bin(i)[2:].zfill(num_qubits)
-        theta = np.arcsin(1/np.sqrt(2 ** num_qubits))
-        
-        if i == int(marked_item):
-            dist[key] = np.sin((2*n_iterations+1)*theta)**2
-        else:
-            dist[key] = (np.cos((2*n_iterations+1)*theta)/(np.sqrt(2 ** num_qubits - 1)))**2
+    dist = { format(i, f"0{num_qubits}b"): p_other for i in range(2**num_qubits) }
+    dist[format(int(marked_item), f"0{num_qubits}b")] = p_marked
     return dist
 
 ################ Benchmark Loop
 
-# Because this circuit size grows significantly with num_qubits (due to the mcx gate)
-# limit the max_qubits here ...
-MAX_QUBITS=8
-
 # Execute program with default parameters
 def run(min_qubits=2, max_qubits=6, max_circuits=3, num_shots=100,
-        use_mcx_shim=False,
+        use_mcx_shim=False, mcx_mode="noancilla",
         backend_id='qasm_simulator', provider_backend=None,
         hub="ibm-q", group="open", project="main", exec_options=None):
 
     print("Grover's Search Benchmark Program - Qiskit")
 
-    # Clamp the maximum number of qubits
-    if max_qubits > MAX_QUBITS:
-        print(f"INFO: Grover's Search benchmark is limited to a maximum of {MAX_QUBITS} qubits.")
-        max_qubits = MAX_QUBITS
-        
     # validate parameters (smallest circuit is 2 qubits)
     max_qubits = max(2, max_qubits)
     min_qubits = min(max(2, min_qubits), max_qubits)
@@ -240,6 +281,15 @@ def run(min_qubits=2, max_qubits=6, max_circuits=3, num_shots=100,
     _use_mcx_shim = use_mcx_shim
     if _use_mcx_shim:
         print("... using MCX shim")
+    
+    # set the synthesis strategy of the mcx gates, which may add ancilla qubits
+    global _mcx_mode
+    if mcx_mode not in mcx_gates.mcx_modes:
+        print(f"ERROR: unknown mcx_mode '{mcx_mode}', expected one of {mcx_gates.mcx_modes}")
+        return
+    _mcx_mode = mcx_mode
+    if _mcx_mode != "noancilla" and not _use_mcx_shim:
+        print(f"... using MCX mode {_mcx_mode}")
         
     # Initialize metrics module
     metrics.init_metrics()
@@ -270,7 +320,7 @@ def run(min_qubits=2, max_qubits=6, max_circuits=3, num_shots=100,
         if 2**(num_qubits) <= max_circuits:
             s_range = list(range(num_circuits))
         else:
-            s_range = np.random.choice(2**(num_qubits), num_circuits, False)
+            s_range = seeding.get_rng("grovers", num_qubits).choice(2**(num_qubits), num_circuits, False)
         
         # loop over limited # of secret strings for this
         for s_int in s_range:
@@ -283,7 +333,7 @@ def run(min_qubits=2, max_qubits=6, max_circuits=3, num_shots=100,
             metrics.store_metric(num_qubits, s_int, 'create_time', time.time() - ts)
 
             # collapse the sub-circuits used in this benchmark (for qiskit)
-            qc2 = qc.decompose()
+            qc2 = flatten_circuit(qc)
             
             # submit circuit for execution on target (simulator, cloud simulator, or hardware)
             ex.submit_circuit(qc2, num_qubits, s_int, num_shots)
@@ -300,7 +350,9 @@ def run(min_qubits=2, max_qubits=6, max_circuits=3, num_shots=100,
     print("\nDiffuser ="); print(diffusion_operator )
 
     # Plot metrics for all circuit sizes
-    metrics.plot_metrics("Benchmark Results - Grover's Search - Qiskit")
+    # (non-default mcx modes are named in the title, so their metrics are kept apart)
+    mode_label = f" ({_mcx_mode})" if _mcx_mode != "noancilla" and not _use_mcx_shim else ""
+    metrics.plot_metrics(f"Benchmark Results - Grover's Search{mode_label} - Qiskit")
 
 
 # if main, execute method
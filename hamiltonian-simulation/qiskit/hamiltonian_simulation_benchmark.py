@@ -6,7 +6,6 @@ import json
 import sys
 import time
 
-import numpy as np
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
 sys.path[1:1] = ["_common", "_common/qiskit"]
@@ -14,8 +13,6 @@ sys.path[1:1] = ["../../_common", "../../_common/qiskit"]
 import execute as ex
 import metrics as metrics
 
-np.random.seed(0)
-
 verbose = False
 
 # saved circuits and subcircuits for display
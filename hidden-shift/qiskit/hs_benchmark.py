@@ -5,15 +5,13 @@ Hidden Shift Benchmark Program - Qiskit
 import sys
 import time
 
-import numpy as np
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
 sys.path[1:1] = [ "_common", "_common/qiskit" ]
 sys.path[1:1] = [ "../../_common", "../../_common/qiskit" ]
 import execute as ex
 import metrics as metrics
-
-np.random.seed(0)
+import seeding
 
 verbose = False
 
@@ -172,7 +170,7 @@ def run (min_qubits=2, max_qubits=6, max_circuits=3, num_shots=100,
         if 2**(num_qubits) <= max_circuits:
             s_range = list(range(num_circuits))
         else:
-            s_range = np.random.choice(2**(num_qubits), num_circuits, False)
+            s_range = seeding.get_rng("hidden-shift", num_qubits).choice(2**(num_qubits), num_circuits, False)
         
         # loop over limited # of secret strings for this
         for s_int in s_range:
@@ -1,15 +1,27 @@
 from numpy.polynomial.polynomial import Polynomial
 from numpy.polynomial.polynomial import polyfit
-from collections.abc import Iterable
 import functools
+import itertools
 import math
 import random
 import numpy as np
-import copy
+
+# use the vectorized erf of scipy if it is installed, else compute it for each element with math.erf
+try:
+    from scipy.special import erf as _erf
+except ImportError:
+    _erf = None
 
 ########## Classical math functions
 
 def gaussian_dist(num_state_qubits, mu, sigma=0.3):
+    return probs_to_dist(gaussian_probs(num_state_qubits, mu, sigma), num_state_qubits)
+
+
+def gaussian_probs(num_state_qubits, mu, sigma=0.3):
+    """
+    Probabilities of the gaussian distribution over [0, 1] within each of the 2^n intervals, as an array indexed by state.
+    """
     if mu > 1:
         mu = 1
     if mu < 0:
@@ -17,41 +29,66 @@ def gaussian_dist(num_state_qubits, mu, sigma=0.3):
     if sigma < 1e-3:
         sigma = 1e-3
     
-    dist = {}
     normalization = 0.5 * (math.erf((1-mu)/(np.sqrt(2)*sigma)) - math.erf((0-mu)/(np.sqrt(2)*sigma)))
 
-    for i in range(2**num_state_qubits):
-        key = bin(i)[2:].zfill(num_state_qubits)
-        a = (i)/(2**num_state_qubits)
-        b = (i+1)/(2**num_state_qubits)
-        dist[key] = 0.5/normalization * (math.erf((b-mu)/(np.sqrt(2)*sigma)) - math.erf((a-mu)/(np.sqrt(2)*sigma)))
-    return dist
+    # erf at the 2^n + 1 interval edges, differenced
+    edges = np.arange(2**num_state_qubits + 1) / (2**num_state_qubits)
+    if _erf != None:
+        erfs = _erf((edges-mu)/(np.sqrt(2)*sigma))
+    else:
+        erfs = np.array([math.erf(x) for x in ((edges-mu)/(np.sqrt(2)*sigma)).tolist()])
+    return 0.5/normalization * np.diff(erfs)
 
 
 def linear_dist(num_state_qubits):
-    dist = {}
-    for i in range(2**num_state_qubits):
-        key = bin(i)[2:].zfill(num_state_qubits)
-        dist[key] = (2*i+1)/(2**(2*num_state_qubits))
-    return dist
+    return probs_to_dist(linear_probs(num_state_qubits), num_state_qubits)
+
+
+def linear_probs(num_state_qubits):
+    return (2*np.arange(2**num_state_qubits)+1)/(2**(2*num_state_qubits))
+
+
+def probs_to_dist(probs, num_state_qubits):
+    """
+    Convert an array of probabilities indexed by state to a dict keyed by bitstring.
+    """
+    return { format(i, f"0{num_state_qubits}b"): p for i, p in enumerate(probs.tolist()) }
+
+
+def dist_to_probs(dist, num_state_qubits):
+    """
+    Convert a dict of probabilities keyed by bitstring to an array indexed by state (an array is returned as it is).
+    """
+    if not isinstance(dist, dict):
+        return np.asarray(dist)
+    probs = np.zeros(2**num_state_qubits)
+    for key, p in dist.items():
+        probs[int(key, 2)] += p
+    return probs
 
 
 def power_f(i, num_state_qubits, power):
-    if isinstance(i, Iterable):
-        out = []
-        for val in i:
-            out.append((val / ((2**num_state_qubits) - 1))**power)
-        return np.array(out)
-    else:
-        return (i / ((2**num_state_qubits) - 1))**power
+    return (np.asarray(i) / ((2**num_state_qubits) - 1))**power
     
     
 def estimated_value(target_dist, f):
-    avg = 0
-    for key in target_dist.keys():
-        x = int(key,2)
-        avg += target_dist[key]*f(x)
-    return avg
+    """
+    Expected value of f over a distribution, given as a dict keyed by bitstring or an array indexed by state;
+    f is evaluated on an array of states, or on each state if it only accepts a single integer.
+    """
+    if isinstance(target_dist, dict):
+        x = np.array([int(key, 2) for key in target_dist.keys()])
+        p = np.array(list(target_dist.values()))
+    else:
+        p = np.asarray(target_dist)
+        x = np.arange(len(p))
+    try:
+        values = f(x)
+    except (TypeError, ValueError):
+        values = None
+    if np.shape(values) != x.shape:
+        values = np.vectorize(f, otypes=[float])(x)
+    return np.dot(p, values)
     
     
     
@@ -68,20 +105,21 @@ def simplex(n, k):
     """
     Get all ordered combinations of n integers (zero inclusive) which add up to k; the n-dimensional k simplex.
     """
-    if k == 0:
-        z = [0]*n
-        return [z]
-    l = [] 
-    
-    for p in simplex(n,k-1):
-        
-        for i in range(n):
-            a = p[i]+1
-            ns = copy.copy(p)
-            ns[i] = a
-            if ns not in l:
-                l.append(ns)
-    return l
+    return simplex_array(n, k).tolist()
+
+
+@functools.lru_cache(maxsize=None)
+def simplex_array(n, k):
+    """
+    The n-dimensional k simplex as a read-only array with one combination per row, enumerated by stars and bars:
+    each choice of n-1 bar positions among k+n-1 slots separates k stars into n groups.
+    """
+    combinations = list(itertools.combinations(range(k+n-1), n-1))
+    bars = np.array(combinations, dtype=int).reshape(len(combinations), n-1)
+    ends = np.full((len(bars), 1), k+n-1)
+    points = np.diff(np.hstack([-np.ones_like(ends), bars, ends]), axis=1) - 1
+    points.setflags(write=False)
+    return points
 
 
 
@@ -92,26 +130,43 @@ def binary_expansion(num_state_qubits, poly):
     Simplify using (x_i)^p = x_i for all integer p > 0 and collect coefficients of equivalent expression
     
     """
-    n = num_state_qubits
     if isinstance(poly, Polynomial):
         poly_c = poly.coef
     else:
         poly_c = poly
-        
+
+    return dict(binary_expansion_terms(num_state_qubits, tuple(float(c) for c in poly_c)))
+
+
+@functools.lru_cache(maxsize=None)
+def binary_expansion_terms(n, poly_c):
+    """
+    Coefficients of the binary expansion of the polynomial with coefficients poly_c, keyed by the tuple of qubits
+    in each term, memoized. Each combination of powers (p_0, ..., p_n-1) adding up to k contributes
+    k! / (p_0! ... p_n-1!) 2^(0 p_0 + 1 p_1 + ... ) times the coefficient of x^k to the term of its non-zero powers.
+    """
+    factorials = np.array([math.factorial(i) for i in range(max(len(poly_c), 1))], dtype=float)
+    bits = np.arange(n)
+
+    masks, coefs = [], []
+    for k in range(1, len(poly_c)):
+        pows = simplex_array(n, k)
+        coefs.append(poly_c[k] * (factorials[k] / np.prod(factorials[pows], axis=1)) * 2.0**(pows @ bits))
+        masks.append((pows > 0) @ (1 << bits))
+
     out_front = {}
     out_front[()] = poly_c[0]
-    for k in range(1,len(poly_c)):
-        for pow_list in simplex(n,k):
-            two_exp, denom, t = 0, 1, 0
-            for power in pow_list:
-                two_exp += t*power
-                denom *= np.math.factorial(power)
-                t+=1
-            nz = np.nonzero(pow_list)[0]
-            key = tuple(nz)
-            if key not in out_front.keys():
-                out_front[key] = 0
-            out_front[key] += poly_c[k]*((np.math.factorial(k) / denom) * (2**(two_exp)))
+    if len(masks) == 0:
+        return out_front
+
+    # sum the contributions to each term, identified by the bit mask of its qubits
+    unique_masks, inverse = np.unique(np.concatenate(masks), return_inverse=True)
+    sums = np.bincount(inverse, weights=np.concatenate(coefs))
+
+    # order the terms by number of qubits, then by qubits
+    terms = sorted((tuple(int(i) for i in bits[(m >> bits) & 1 == 1]), c) for m, c in zip(unique_masks, sums))
+    for key, c in sorted(terms, key=lambda t: len(t[0])):
+        out_front[key] = c
     return out_front
 
 
@@ -136,32 +191,49 @@ def region_probs(target_dist, num_state_qubits):
     """
     Fetch bisected region probabilities for the desired probability distribution {[p1], [p01, p11], [p001, p011, p101, p111], ...}.
     """
-    
-    regions = starting_regions(num_state_qubits)
+    levels = region_prob_levels(dist_to_probs(target_dist, num_state_qubits), num_state_qubits)
+
+    # region key d+1 bits long is the prefix of the states it contains, with the last bit 1
     probs = {}
-    n = len(regions)
-    for k in range(n):
-        for string in regions[k]:
-            p = 0
-            b = n-k-1
-            for i in range(2**b):
-                subkey = bin(i)[2:].zfill(b)
-                if b == 0:
-                    subkey = ''
-                try:
-                    p += target_dist[string+subkey]
-                except KeyError:
-                    pass
-            probs[string] = p
+    for d in range(num_state_qubits):
+        level = levels[d+1].tolist()
+        for i in range(2**d):
+            key = bin(i)[2:].zfill(d) + '1' if d > 0 else '1'
+            probs[key] = level[2*i+1]
     return probs
 
 
+def region_prob_levels(probs, num_state_qubits):
+    """
+    Tree of region probabilities: level d is an array of the probability of each d-bit prefix of the states,
+    obtained by summing pairs of level d+1; level n is the array of state probabilities.
+    """
+    levels = [None] * (num_state_qubits+1)
+    levels[num_state_qubits] = np.asarray(probs, dtype=float)
+    for d in reversed(range(num_state_qubits)):
+        levels[d] = levels[d+1].reshape(2**d, 2).sum(axis=1)
+    return levels
+
+
 def mc_dist(num_counting_qubits, exact, c_star, method):
     """
     Creates the probabilities of measurements we should get from the phase estimation routine
     
     Taken from Eq. (5.25) in Nielsen and Chuang
     """
+    values, probs = mc_probs(num_counting_qubits, exact, c_star, method)
+
+    # sum the probabilities of equal values, in order of first occurrence
+    unique_values, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse, weights=probs, minlength=len(unique_values))
+    order = np.argsort(first)
+    return dict(zip(unique_values[order].tolist(), sums[order].tolist()))
+
+
+def mc_probs(num_counting_qubits, exact, c_star, method):
+    """
+    Probability of measuring each integer b in the counting qubits, and the expectation value it gives, as arrays indexed by b.
+    """
     # shift exact value into phase phi which the phase estimation approximates
     if method == 1:
         unshifted_exact = ((exact - 0.5)*c_star) + 0.5
@@ -169,31 +241,34 @@ def mc_dist(num_counting_qubits, exact, c_star, method):
         unshifted_exact = exact
     phi = np.arcsin(np.sqrt(unshifted_exact))/np.pi 
 
-    dist = {}
+    # Eq. (5.25), gives probability for measuring an integer (b) after phase estimation routine
+    # if phi is too close to b, results in 0/0, but acutally should be 1
+    b = np.arange(2**num_counting_qubits)
+    delta = phi - b/(2**num_counting_qubits)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probs = np.abs(((1/2)**num_counting_qubits) * (1-np.exp(2j*np.pi*(2**num_counting_qubits*phi-b))) / (1-np.exp(2j*np.pi*delta)))**2
+    probs[np.abs(delta) <= 1e-6] = 1.0
+
+    return expectation_values(num_counting_qubits, c_star, method), probs
+
+
+@functools.lru_cache(maxsize=None)
+def expectation_values(num_counting_qubits, c_star, method):
+    """
+    The expectation value estimated when measuring each integer b in the counting qubits, as a read-only array indexed by b,
+    rounded to the precision the counting qubits resolve.
+    """
+    b = np.arange(2**num_counting_qubits)
+    a_meas = np.sin(np.pi*b/(2**num_counting_qubits))**2
+    if method == 1:
+        a = ((a_meas - 0.5)/c_star) + 0.5
+    elif method == 2:
+        a = a_meas
+
     precision = int(num_counting_qubits / (np.log2(10))) + 2
-    for b in range(2**num_counting_qubits):
-        
-        # Eq. (5.25), gives probability for measuring an integer (b) after phase estimation routine
-        # if phi is too close to b, results in 0/0, but acutally should be 1
-        if abs(phi-b/(2**num_counting_qubits)) > 1e-6:
-            prob = np.abs(((1/2)**num_counting_qubits) * (1-np.exp(2j*np.pi*(2**num_counting_qubits*phi-b))) / (1-np.exp(2j*np.pi*(phi-b/(2**num_counting_qubits)))))**2
-        else:
-            prob = 1.0
-        
-        # calculates the predicted expectation value if measure b in the counting qubits
-        a_meas = pow(np.sin(np.pi*b/pow(2,num_counting_qubits)),2)
-        if method == 1:
-            a = ((a_meas - 0.5)/c_star) + 0.5
-        elif method == 2:
-            a = a_meas
-        a = round(a, precision)
-
-        # generates distribution of expectation values and their relative probabilities
-        if a not in dist.keys():
-            dist[a] = 0
-        dist[a] += prob
-    
-    return dist
+    a = np.round(a, precision)
+    a.setflags(write=False)
+    return a
 
 
 def value_and_max_prob_from_dist(dist):
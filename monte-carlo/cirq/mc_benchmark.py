@@ -26,8 +26,8 @@ np.random.seed(0)
 # default function is f(x) = x^2
 f_of_X = functools.partial(mc_utils.power_f, power=2)
 
-# default distribution is gaussian distribution
-p_distribution = mc_utils.gaussian_dist
+# default distribution is gaussian distribution (probabilities indexed by state)
+p_distribution = mc_utils.gaussian_probs
 
 verbose = False
 
@@ -258,8 +258,7 @@ def analyze_and_print_result(qc, result, num_counting_qubits, mu, num_shots, met
     correct_dist = mc_utils.mc_dist(num_counting_qubits, exact, c_star, method)
 
     # generate thermal_dist with amplitudes instead, to be comparable to correct_dist
-    bit_thermal_dist = metrics.uniform_dist(num_counting_qubits)
-    thermal_dist = expectation_from_bits(bit_thermal_dist, num_counting_qubits, num_shots, method)
+    thermal_dist = metrics.uniform_value_dist(mc_utils.expectation_values(num_counting_qubits, c_star, method))
 
     # use our polarization fidelity rescaling
     fidelity = metrics.polarization_fidelity(counts, correct_dist, thermal_dist)
@@ -280,24 +279,9 @@ def analyze_and_print_result(qc, result, num_counting_qubits, mu, num_shots, met
         
     return counts, fidelity
 
+# Return the counts of the expectation values estimated from the counts of measured bitstrings
 def expectation_from_bits(bits, num_qubits, num_shots, method):
-    amplitudes = {}
-    for b in bits.keys():
-        precision = int(num_qubits / (np.log2(10))) + 2
-
-        r = bits[b]
-        a_meas = pow(np.sin(np.pi*int(b,2)/pow(2,num_qubits)),2)
-        if method == 1:
-            a = ((a_meas - 0.5)/c_star) + 0.5
-        if method == 2:
-            a = a_meas
-        a = round(a, precision)
-        
-        if a not in amplitudes.keys():
-            amplitudes[a] = 0
-        amplitudes[a] += r
-    
-    return amplitudes
+    return metrics.value_counts(bits, mc_utils.expectation_values(num_qubits, c_star, method))
 
 
 ################ Benchmark Loop
@@ -5,7 +5,6 @@ Monte Carlo Sampling Benchmark Program via Amplitude Estimation- Qiskit
 import copy
 import functools
 import sys
-import time
 
 import numpy as np
 from numpy.polynomial.polynomial import Polynomial
@@ -13,20 +12,23 @@ from numpy.polynomial.polynomial import polyfit
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 from qiskit.circuit.library.standard_gates.ry import RYGate
 
-sys.path[1:1] = ["_common", "_common/qiskit", "monte-carlo/_common", "quantum-fourier-transform/qiskit"]
-sys.path[1:1] = ["../../_common", "../../_common/qiskit", "../../monte-carlo/_common", "../../quantum-fourier-transform/qiskit"]
+sys.path[1:1] = ["_common", "_common/qiskit", "monte-carlo/_common"]
+sys.path[1:1] = ["../../_common", "../../_common/qiskit", "../../monte-carlo/_common"]
 import execute as ex
 import mc_utils as mc_utils
 import metrics as metrics
-from qft_benchmark import inv_qft_gate
-
-np.random.seed(0)
+import circuit_cache
+from flatten import flatten_circuit
+import seeding
+from qft_library import inv_qft_gate
+from controlled_power import controlled_power
+import mcx_gates
 
 # default function is f(x) = x^2
 f_of_X = functools.partial(mc_utils.power_f, power=2)
 
-# default distribution is gaussian distribution
-p_distribution = mc_utils.gaussian_dist
+# default distribution is gaussian distribution (probabilities indexed by state)
+p_distribution = mc_utils.gaussian_probs
 
 verbose = False
 
@@ -41,7 +43,7 @@ QFTI_ = None
 
 ############### Circuit Definition
 
-def MonteCarloSampling(target_dist, f, num_state_qubits, num_counting_qubits, epsilon=0.05, degree=2, method=2):
+def MonteCarloSampling(target_dist, f, num_state_qubits, num_counting_qubits, epsilon=0.05, degree=2, method=2, mcx_mode="noancilla"):
     
     A_qr = QuantumRegister(num_state_qubits+1)
     A = QuantumCircuit(A_qr, name=f"A")
@@ -68,7 +70,7 @@ def MonteCarloSampling(target_dist, f, num_state_qubits, num_counting_qubits, ep
     A.append(F.to_gate(), A_qr)
 
     # run AE subroutine given our A composed of R and F
-    qc = AE_Subroutine(num_state_qubits, num_counting_qubits, A)
+    qc = AE_Subroutine(num_state_qubits, num_counting_qubits, A, mcx_mode)
 
     # save smaller circuit example for display
     global QC_, R_, F_
@@ -164,14 +166,21 @@ def uniform_prep(qc, qr, num_state_qubits):
     for i in range(num_state_qubits):
         qc.h(i)
             
-def AE_Subroutine(num_state_qubits, num_counting_qubits, A_circuit):
+def AE_Subroutine(num_state_qubits, num_counting_qubits, A_circuit, mcx_mode="noancilla"):
     qr_state = QuantumRegister(num_state_qubits+1)
     qr_counting = QuantumRegister(num_counting_qubits)
     cr = ClassicalRegister(num_counting_qubits)
     qc = QuantumCircuit(qr_state, qr_counting, cr)
 
+    # add the ancillas used by the mcx gates of cQ (if any)
+    num_anc = num_ancillas(num_state_qubits, mcx_mode)
+    qr_anc = []
+    if num_anc > 0:
+        qr_anc = QuantumRegister(num_anc, name="anc")
+        qc.add_register(qr_anc)
+
     A = A_circuit
-    cQ, Q = Ctrl_Q(num_state_qubits, A)
+    cQ, Q = Ctrl_Q(num_state_qubits, A, mcx_mode)
 
     # save small example subcircuits for visualization
     global A_, Q_, cQ_, QFTI_
@@ -179,24 +188,28 @@ def AE_Subroutine(num_state_qubits, num_counting_qubits, A_circuit):
         if num_state_qubits < 9: cQ_ = cQ; Q_ = Q
     if A_ == None or num_state_qubits <= 3:
         if num_state_qubits < 5: A_ = A
-    if QFTI_ == None or num_counting_qubits <= 3:
-        if num_counting_qubits < 4: QFTI_ = inv_qft_gate(num_counting_qubits)
 
     # Prepare state from A, and counting qubits with H transform 
     qc.append(A, qr_state)
     for i in range(num_counting_qubits):
         qc.h(qr_counting[i])
     
+    # apply cQ^repeat for each counting qubit, each power built from the previous one (see controlled_power)
+    cQ_gate = cQ.to_instruction()
+    memo = {}
     repeat = 1
     for j in reversed(range(num_counting_qubits)):
-        for _ in range(repeat):
-            qc.append(cQ, [qr_counting[j]] + [qr_state[l] for l in range(num_state_qubits+1)])
+        qc.append(controlled_power(cQ_gate, repeat, memo=memo),
+                [qr_counting[j]] + [qr_state[l] for l in range(num_state_qubits+1)] + qr_anc[:])
         repeat *= 2
     
     qc.barrier()
     
     # inverse quantum Fourier transform only on counting qubits
-    qc.append(inv_qft_gate(num_counting_qubits), qr_counting)
+    iqft = inv_qft_gate(num_counting_qubits)
+    qc.append(iqft, qr_counting)
+    if QFTI_ == None or num_counting_qubits <= 3:
+        if num_counting_qubits < 4: QFTI_ = iqft.definition
     
     qc.barrier()
     
@@ -207,11 +220,19 @@ def AE_Subroutine(num_state_qubits, num_counting_qubits, A_circuit):
             
 ###############################
    
-# Construct the grover-like operator and a controlled version of it
-def Ctrl_Q(num_state_qubits, A_circ):
-
-    # index n is the objective qubit, and indexes 0 through n-1 are state qubits
-    qc = QuantumCircuit(num_state_qubits+1, name=f"Q")
+# Return the number of ancilla qubits used by the mcx gate of Q, controlled by the state qubits (see mcx_gates.py)
+def num_ancillas(num_state_qubits, mcx_mode):
+    return mcx_gates.num_mcx_ancillas(num_state_qubits, mcx_mode)
+
+# Construct the grover-like operator and a controlled version of it, using the given mcx synthesis strategy
+# Both have the ancillas used by the mcx gates (if any) as their last qubits.
+# The controlled version is qc.control(1) with every strategy, as before the strategies were added,
+# so the circuits of the strategies differ only in the synthesis of their mcx gates.
+def Ctrl_Q(num_state_qubits, A_circ, mcx_mode="noancilla"):
+
+    # index n is the objective qubit, and indexes 0 through n-1 are state qubits, followed by the ancillas
+    num_anc = num_ancillas(num_state_qubits, mcx_mode)
+    qc = QuantumCircuit(num_state_qubits+1+num_anc, name=f"Q")
     
     temp_A = copy.copy(A_circ)
     A_gate = temp_A.to_gate()
@@ -231,7 +252,8 @@ def Ctrl_Q(num_state_qubits, A_circ):
         qc.x(i)
     qc.h(num_state_qubits)
     
-    qc.mcx([x for x in range(num_state_qubits)], num_state_qubits)
+    mcx_gates.append_mcx(qc, [x for x in range(num_state_qubits)], num_state_qubits,
+            [x for x in range(num_state_qubits+1, qc.num_qubits)], mcx_mode)
     
     qc.h(num_state_qubits)
     for i in range(num_state_qubits+1):
@@ -240,10 +262,7 @@ def Ctrl_Q(num_state_qubits, A_circ):
     # A_circ
     qc.append(A_gate, [i for i in range(num_state_qubits+1)])
     
-    # Create a gate out of the Q operator
-    qc.to_gate(label='Q')
-    
-    # and also a controlled version of it
+    # and also a controlled version of it, with the control qubit at index 0
     Ctrl_Q_ = qc.control(1)
     
     # and return both
@@ -273,8 +292,7 @@ def analyze_and_print_result(qc, result, num_counting_qubits, mu, num_shots, met
     correct_dist = mc_utils.mc_dist(num_counting_qubits, exact, c_star, method)
 
     # generate thermal_dist with amplitudes instead, to be comparable to correct_dist
-    bit_thermal_dist = metrics.uniform_dist(num_counting_qubits)
-    thermal_dist = expectation_from_bits(bit_thermal_dist, num_counting_qubits, num_shots, method)
+    thermal_dist = metrics.uniform_value_dist(mc_utils.expectation_values(num_counting_qubits, c_star, method))
 
     # use our polarization fidelity rescaling
     fidelity = metrics.polarization_fidelity(counts, correct_dist, thermal_dist)
@@ -295,24 +313,9 @@ def analyze_and_print_result(qc, result, num_counting_qubits, mu, num_shots, met
         
     return counts, fidelity
 
+# Return the counts of the expectation values estimated from the counts of measured bitstrings
 def expectation_from_bits(bits, num_qubits, num_shots, method):
-    amplitudes = {}
-    for b in bits.keys():
-        precision = int(num_qubits / (np.log2(10))) + 2
-
-        r = bits[b]
-        a_meas = pow(np.sin(np.pi*int(b,2)/pow(2,num_qubits)),2)
-        if method == 1:
-            a = ((a_meas - 0.5)/c_star) + 0.5
-        if method == 2:
-            a = a_meas
-        a = round(a, precision)
-        
-        if a not in amplitudes.keys():
-            amplitudes[a] = 0
-        amplitudes[a] += r
-    
-    return amplitudes
+    return metrics.value_counts(bits, mc_utils.expectation_values(num_qubits, c_star, method))
 
 ################ Benchmark Loop
 
@@ -330,6 +333,7 @@ MAX_QUBITS=10
 # Execute program with default parameters
 def run(min_qubits=MIN_QUBITS, max_qubits=10, max_circuits=1, num_shots=100,
         epsilon=0.05, degree=2, num_state_qubits=MIN_STATE_QUBITS, method = 2, # default, not exposed to users
+        mcx_mode="noancilla",
         backend_id='qasm_simulator', provider_backend=None,
         hub="ibm-q", group="open", project="main", exec_options=None):
 
@@ -360,6 +364,13 @@ def run(min_qubits=MIN_QUBITS, max_qubits=10, max_circuits=1, num_shots=100,
         
     ### TODO: need to do more validation of arguments, e.g. min_state_qubits and min_qubits
 
+    # validate the synthesis strategy of the mcx gates, which may add ancilla qubits
+    if mcx_mode not in mcx_gates.mcx_modes:
+        print(f"ERROR: unknown mcx_mode '{mcx_mode}', expected one of {mcx_gates.mcx_modes}")
+        return
+    if mcx_mode != "noancilla":
+        print(f"... using MCX mode {mcx_mode}")
+
     # Initialize metrics module
     metrics.init_metrics()
     
@@ -378,52 +389,53 @@ def run(min_qubits=MIN_QUBITS, max_qubits=10, max_circuits=1, num_shots=100,
     ex.set_execution_target(backend_id, provider_backend=provider_backend,
             hub=hub, group=group, project=project, exec_options=exec_options)
 
-    # Execute Benchmark Program N times for multiple circuit sizes
-    # Accumulate metrics asynchronously as circuits complete
-    for num_qubits in range(min_qubits, max_qubits + 1):
+    # Generate circuits for each circuit size, ahead of their execution
+    # (runs in a background thread; see execute_pipelined)
+    def generate_circuits():
+        for num_qubits in range(min_qubits, max_qubits + 1):
 
-        input_size = num_qubits - 1 # TODO: keep using inputsize? only used in num_circuits
-        
-        # as circuit width grows, the number of counting qubits is increased
-        num_counting_qubits = num_qubits - num_state_qubits - 1
-        
-        # determine number of circuits to execute for this group
-        num_circuits = min(2 ** (input_size), max_circuits)
+            input_size = num_qubits - 1 # TODO: keep using inputsize? only used in num_circuits
 
-        print(f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}")
+            # as circuit width grows, the number of counting qubits is increased
+            num_counting_qubits = num_qubits - num_state_qubits - 1
 
-        # determine range of circuits to loop over for method 1
-        if 2**(input_size) <= max_circuits:
-            mu_range = [i/2**(input_size) for i in range(num_circuits)]
-        else:
-            mu_range = [i/2**(input_size) for i in np.random.choice(2**(input_size), num_circuits, False)]
+            # determine number of circuits to execute for this group
+            num_circuits = min(2 ** (input_size), max_circuits)
 
-        # loop over limited # of mu values for this
-        for mu in mu_range:
-            target_dist = p_distribution(num_state_qubits, mu)
-            f_to_estimate = functools.partial(f_of_X, num_state_qubits=num_state_qubits)
-            
-            # create the circuit for given qubit size and secret string, store time metric
-            ts = time.time()
+            # announce the group, printed when its circuits are submitted (see execute_pipelined)
+            yield f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}"
 
-            qc = MonteCarloSampling(target_dist, f_to_estimate, num_state_qubits, num_counting_qubits, epsilon, degree, method=method)
-            metrics.store_metric(num_qubits, mu, 'create_time', time.time() - ts)
-            
-            # collapse the 4 sub-circuit levels used in this benchmark (for qiskit)
-            qc2 = qc.decompose().decompose().decompose().decompose()
-                
-            # submit circuit for execution on target (simulator, cloud simulator, or hardware)
-            ex.submit_circuit(qc2, num_qubits, mu, num_shots)
+            # determine range of circuits to loop over for method 1
+            if 2**(input_size) <= max_circuits:
+                mu_range = [i/2**(input_size) for i in range(num_circuits)]
+            else:
+                mu_range = [i/2**(input_size) for i in seeding.get_rng("monte-carlo", num_qubits).choice(2**(input_size), num_circuits, False)]
 
-            # if method is 2, we only have one type of circuit, so break out of loop
-            if method == 2:
-                break
-        
-        # Wait for some active circuits to complete; report metrics when groups complete
-        ex.throttle_execution(metrics.finalize_group)
+            # loop over limited # of mu values for this
+            for mu in mu_range:
+                target_dist = p_distribution(num_state_qubits, mu)
+                f_to_estimate = functools.partial(f_of_X, num_state_qubits=num_state_qubits)
+
+                # create the circuit for given qubit size and secret string, or load it from the circuit cache,
+                # inlining the sub-circuits used in this benchmark (for qiskit);
+                # the function and distribution are in the key, as they may be replaced by the caller
+                qc2, create_time = circuit_cache.get_circuit(
+                        lambda: MonteCarloSampling(target_dist, f_to_estimate, num_state_qubits, num_counting_qubits, epsilon, degree, method=method, mcx_mode=mcx_mode),
+                        "monte-carlo", method, num_qubits, mu, prepare=flatten_circuit,
+                        sources=(__file__, mc_utils, inv_qft_gate, controlled_power, mcx_gates),
+                        options=[epsilon, degree, num_state_qubits, mcx_mode, c_star,
+                                circuit_cache.function_key(f_of_X), circuit_cache.function_key(p_distribution)])
+
+                # pass circuit on for execution on target (simulator, cloud simulator, or hardware)
+                yield qc2, num_qubits, mu, num_shots, create_time
 
-    # Wait for all active circuits to complete; report metrics when groups complete
-    ex.finalize_execution(metrics.finalize_group)
+                # if method is 2, we only have one type of circuit, so break out of loop
+                if method == 2:
+                    break
+
+    # Execute Benchmark Program N times for multiple circuit sizes
+    # Accumulate metrics asynchronously as circuits complete; report metrics when groups complete
+    ex.execute_pipelined(generate_circuits(), metrics.finalize_group)
 
     # print a sample circuit
     print("Sample Circuit:"); print(QC_ if QC_ != None else "  ... too large!")
@@ -435,7 +447,9 @@ def run(min_qubits=MIN_QUBITS, max_qubits=10, max_circuits=1, num_shots=100,
     print("\nInverse QFT Circuit ="); print(QFTI_ if QFTI_ != None else "  ... too large!")
 
     # Plot metrics for all circuit sizes
-    metrics.plot_metrics(f"Benchmark Results - Monte Carlo Sampling ({method}) - Qiskit")
+    # (non-default mcx modes are named in the title, so their metrics are kept apart)
+    mode_label = f", {mcx_mode}" if mcx_mode != "noancilla" else ""
+    metrics.plot_metrics(f"Benchmark Results - Monte Carlo Sampling ({method}{mode_label}) - Qiskit")
     
     
         
@@ -3,6 +3,7 @@ Phase Estimation Benchmark Program - Braket
 """
 
 import time
+import functools
 import sys
 
 from braket.circuits import Circuit     # AWS imports: Import Braket SDK modules
@@ -98,23 +99,23 @@ def analyze_and_print_result (qc, result, num_counting_qubits, theta):
     correct_dist = {theta: 1.0}
 
     # generate thermal_dist with amplitudes instead, to be comparable to correct_dist
-    bit_thermal_dist = metrics.uniform_dist(num_counting_qubits)
-    thermal_dist = bitstring_to_theta(bit_thermal_dist, num_counting_qubits)
+    thermal_dist = metrics.uniform_value_dist(theta_value_table(num_counting_qubits))
 
     # use our polarization fidelity rescaling
     fidelity = metrics.polarization_fidelity(counts, correct_dist, thermal_dist)
     
     return counts, fidelity
 
+# Return the counts of the phases estimated from the counts of measured bitstrings
 def bitstring_to_theta(counts, num_counting_qubits):
-    theta_counts = {}
-    for key in counts.keys():
-        r = counts[key]
-        theta = int(key,2) / (2**num_counting_qubits)
-        if theta not in theta_counts.keys():
-            theta_counts[theta] = 0
-        theta_counts[theta] += r
-    return theta_counts
+    return metrics.value_counts(counts, theta_value_table(num_counting_qubits))
+
+# Return the phase estimated from each integer outcome of the counting qubits, as an array indexed by outcome
+@functools.lru_cache(maxsize=None)
+def theta_value_table(num_counting_qubits):
+    theta = np.arange(2**num_counting_qubits) / (2**num_counting_qubits)
+    theta.setflags(write=False)
+    return theta
 
 ################ Benchmark Loop
         
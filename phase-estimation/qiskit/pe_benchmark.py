@@ -2,19 +2,22 @@
 Phase Estimation Benchmark Program - Qiskit
 """
 
+import functools
 import sys
-import time
 
 import numpy as np
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+from qiskit.circuit.library.standard_gates import CPhaseGate
 
-sys.path[1:1] = ["_common", "_common/qiskit", "quantum-fourier-transform/qiskit"]
-sys.path[1:1] = ["../../_common", "../../_common/qiskit", "../../quantum-fourier-transform/qiskit"]
+sys.path[1:1] = ["_common", "_common/qiskit"]
+sys.path[1:1] = ["../../_common", "../../_common/qiskit"]
 import execute as ex
 import metrics as metrics
-from qft_benchmark import inv_qft_gate
-
-np.random.seed(0)
+import circuit_cache
+from flatten import flatten_circuit
+import seeding
+from qft_library import approximation_degree_for, inv_qft_gate
+from controlled_power import controlled_power
 
 verbose = False
 
@@ -25,7 +28,7 @@ U_ = None
 
 ############### Circuit Definition
 
-def PhaseEstimation(num_qubits, theta):
+def PhaseEstimation(num_qubits, theta, approximation_degree=0):
     
     qr = QuantumRegister(num_qubits)
     
@@ -56,8 +59,10 @@ def PhaseEstimation(num_qubits, theta):
 
     qc.barrier()
     
-    # inverse quantum Fourier transform only on counting qubits
-    qc.append(inv_qft_gate(num_counting_qubits), qr[:num_counting_qubits])
+    # inverse quantum Fourier transform only on counting qubits,
+    # omitting the smallest rotations if approximation_degree > 0
+    iqft = inv_qft_gate(num_counting_qubits, approximation_degree)
+    qc.append(iqft, qr[:num_counting_qubits])
     
     qc.barrier()
     
@@ -71,7 +76,7 @@ def PhaseEstimation(num_qubits, theta):
     if U_ == None or num_qubits <= 5:
         if num_qubits < 9: U_ = U
     if QFTI_ == None or num_qubits <= 5:
-        if num_qubits < 9: QFTI_ = inv_qft_gate(num_counting_qubits)
+        if num_qubits < 9: QFTI_ = iqft.definition
     return qc
 
 #Construct the phase gates and include matching gate representation as readme circuit
@@ -79,7 +84,9 @@ def CPhase(angle, exponent):
 
     qc = QuantumCircuit(1, name=f"U^{exponent}")
     qc.p(angle*exponent, 0)
-    phase_gate = qc.to_gate().control(1)
+
+    # the controlled power of a phase gate is a controlled phase gate with the angle scaled
+    phase_gate = controlled_power(CPhaseGate(angle), exponent)
 
     return phase_gate, qc
 
@@ -95,28 +102,29 @@ def analyze_and_print_result(qc, result, num_counting_qubits, theta, num_shots):
     correct_dist = {theta: 1.0}
 
     # generate thermal_dist with amplitudes instead, to be comparable to correct_dist
-    bit_thermal_dist = metrics.uniform_dist(num_counting_qubits)
-    thermal_dist = bitstring_to_theta(bit_thermal_dist, num_counting_qubits)
+    thermal_dist = metrics.uniform_value_dist(theta_value_table(num_counting_qubits))
 
     # use our polarization fidelity rescaling
     fidelity = metrics.polarization_fidelity(counts, correct_dist, thermal_dist)
 
     return counts, fidelity
 
+# Return the counts of the phases estimated from the counts of measured bitstrings
 def bitstring_to_theta(counts, num_counting_qubits):
-    theta_counts = {}
-    for key in counts.keys():
-        r = counts[key]
-        theta = int(key,2) / (2**num_counting_qubits)
-        if theta not in theta_counts.keys():
-            theta_counts[theta] = 0
-        theta_counts[theta] += r
-    return theta_counts
+    return metrics.value_counts(counts, theta_value_table(num_counting_qubits))
+
+# Return the phase estimated from each integer outcome of the counting qubits, as an array indexed by outcome
+@functools.lru_cache(maxsize=None)
+def theta_value_table(num_counting_qubits):
+    theta = np.arange(2**num_counting_qubits) / (2**num_counting_qubits)
+    theta.setflags(write=False)
+    return theta
 
 ################ Benchmark Loop
 
 # Execute program with default parameters
 def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
+        approximation_degree=0,
         backend_id='qasm_simulator', provider_backend=None,
         hub="ibm-q", group="open", project="main", exec_options=None):
 
@@ -132,6 +140,9 @@ def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
     min_qubits = max(max(3, min_qubits), num_state_qubits + 2)
     #print(f"min, max, state = {min_qubits} {max_qubits} {num_state_qubits}")
 
+    if approximation_degree != 0:
+        print(f"... using QFT approximation degree {approximation_degree}")
+
     # Initialize metrics module
     metrics.init_metrics()
 
@@ -148,43 +159,44 @@ def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
     ex.set_execution_target(backend_id, provider_backend=provider_backend,
             hub=hub, group=group, project=project, exec_options=exec_options)
 
+    # Generate circuits for each circuit size, ahead of their execution
+    # (runs in a background thread; see execute_pipelined)
+    def generate_circuits():
+        for num_qubits in range(min_qubits, max_qubits + 1):
+
+            # as circuit width grows, the number of counting qubits is increased
+            num_counting_qubits = num_qubits - num_state_qubits - 1
+
+            # determine number of circuits to execute for this group
+            num_circuits = min(2 ** (num_counting_qubits), max_circuits)
+
+            # announce the group, printed when its circuits are submitted (see execute_pipelined)
+            yield f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}"
+
+            # determine range of secret strings to loop over
+            if 2**(num_counting_qubits) <= max_circuits:
+                theta_range = [i/(2**(num_counting_qubits)) for i in list(range(num_circuits))]
+            else:
+                theta_range = [i/(2**(num_counting_qubits)) for i in seeding.get_rng("phase-estimation", num_qubits).choice(2**(num_counting_qubits), num_circuits, False)]
+
+            # the approximation degree of the inverse QFT on the counting qubits
+            approx = approximation_degree_for(num_counting_qubits, approximation_degree)
+
+            # loop over limited # of random theta choices
+            for theta in theta_range:
+                # create the circuit for given qubit size and theta, or load it from the circuit cache,
+                # inlining the sub-circuits used in this benchmark (for qiskit)
+                qc2, create_time = circuit_cache.get_circuit(
+                        lambda: PhaseEstimation(num_qubits, theta, approx),
+                        "phase-estimation", None, num_qubits, theta, prepare=flatten_circuit,
+                        sources=(__file__, inv_qft_gate, controlled_power), options=[approx])
+
+                # pass circuit on for execution on target (simulator, cloud simulator, or hardware)
+                yield qc2, num_qubits, theta, num_shots, create_time
+
     # Execute Benchmark Program N times for multiple circuit sizes
-    # Accumulate metrics asynchronously as circuits complete
-    for num_qubits in range(min_qubits, max_qubits + 1):
-        
-        # as circuit width grows, the number of counting qubits is increased
-        num_counting_qubits = num_qubits - num_state_qubits - 1
-
-        # determine number of circuits to execute for this group
-        num_circuits = min(2 ** (num_counting_qubits), max_circuits)
-        
-        print(f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}")
-        
-        # determine range of secret strings to loop over
-        if 2**(num_counting_qubits) <= max_circuits:
-            theta_range = [i/(2**(num_counting_qubits)) for i in list(range(num_circuits))]
-        else:
-            theta_range = [i/(2**(num_counting_qubits)) for i in np.random.choice(2**(num_counting_qubits), num_circuits, False)]
-
-        # loop over limited # of random theta choices
-        for theta in theta_range:
-            # create the circuit for given qubit size and theta, store time metric
-            ts = time.time()
-
-            qc = PhaseEstimation(num_qubits, theta)
-            metrics.store_metric(num_qubits, theta, 'create_time', time.time() - ts)
-
-            # collapse the 3 sub-circuit levels used in this benchmark (for qiskit)
-            qc2 = qc.decompose().decompose().decompose()
-            
-            # submit circuit for execution on target (simulator, cloud simulator, or hardware)
-            ex.submit_circuit(qc2, num_qubits, theta, num_shots)
-
-        # Wait for some active circuits to complete; report metrics when groups complete
-        ex.throttle_execution(metrics.finalize_group)
-
-    # Wait for all active circuits to complete; report metrics when groups complete
-    ex.finalize_execution(metrics.finalize_group)
+    # Accumulate metrics asynchronously as circuits complete; report metrics when groups complete
+    ex.execute_pipelined(generate_circuits(), metrics.finalize_group)
 
     # print a sample circuit
     print("Sample Circuit:"); print(QC_ if QC_ != None else "  ... too large!")
@@ -192,7 +204,8 @@ def run(min_qubits=3, max_qubits=8, max_circuits=3, num_shots=100,
     print("\nInverse QFT Circuit ="); print(QFTI_ if QFTI_ != None else "  ... too large!")
 
     # Plot metrics for all circuit sizes
-    metrics.plot_metrics("Benchmark Results - Phase Estimation - Qiskit")
+    approx_label = f" (approx {approximation_degree})" if approximation_degree != 0 else ""
+    metrics.plot_metrics(f"Benchmark Results - Phase Estimation{approx_label} - Qiskit")
 
 
 # if main, execute method
@@ -6,34 +6,32 @@ import math
 import sys
 import time
 
-import numpy as np
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
 sys.path[1:1] = [ "_common", "_common/qiskit" ]
 sys.path[1:1] = [ "../../_common", "../../_common/qiskit" ]
 import execute as ex
 import metrics as metrics
-
-np.random.seed(0)
+import seeding
+from qft_library import approximation_degree_for, inv_qft_gate, qft_gate
 
 verbose = False
 
 # saved circuits for display
-num_gates = 0
-depth = 0
 QC_ = None
 QFT_ = None
 QFTI_ = None
 
 ############### Circuit Definition
 
-def QuantumFourierTransform (num_qubits, secret_int, method=1):
-    global num_gates, depth
+def QuantumFourierTransform (num_qubits, secret_int, method=1, approximation_degree=0):
     # Size of input is one less than available qubits
     input_size = num_qubits
-    num_gates = 0
-    depth = 0
-    
+
+    # the QFT and inverse QFT components, omitting the smallest rotations if approximation_degree > 0
+    qft = qft_gate(input_size, approximation_degree)
+    iqft = inv_qft_gate(input_size, approximation_degree)
+
     # allocate qubits
     qr = QuantumRegister(num_qubits); cr = ClassicalRegister(num_qubits); qc = QuantumCircuit(qr, cr, name="main")
 
@@ -44,14 +42,11 @@ def QuantumFourierTransform (num_qubits, secret_int, method=1):
         for i_qubit in range(input_size):
             if s[input_size-1-i_qubit]=='1':
                 qc.x(qr[i_qubit])
-                num_gates += 1
-
-        depth += 1
 
         qc.barrier()
 
         # perform QFT on the input
-        qc.append(qft_gate(input_size).to_instruction(), qr)
+        qc.append(qft, qr)
 
         # End with Hadamard on all qubits (to measure the z rotations)
         ''' don't do this unless NOT doing the inverse afterwards
@@ -68,12 +63,11 @@ def QuantumFourierTransform (num_qubits, secret_int, method=1):
         for i_q in range(0, num_qubits):
             divisor = 2 ** (i_q)
             qc.rz( 1 * math.pi / divisor , qr[i_q])
-            num_gates+=1
         
         qc.barrier()
 
         # to revert back to initial state, apply inverse QFT
-        qc.append(inv_qft_gate(input_size).to_instruction(), qr)
+        qc.append(iqft, qr)
 
         qc.barrier()
 
@@ -81,114 +75,41 @@ def QuantumFourierTransform (num_qubits, secret_int, method=1):
 
         for i_q in range(0, num_qubits):
             qc.h(qr[i_q])
-            num_gates += 1
 
         for i_q in range(0, num_qubits):
             divisor = 2 ** (i_q)
             qc.rz(secret_int * math.pi / divisor, qr[i_q])
-            num_gates += 1
-
-        depth += 1
 
-        qc.append(inv_qft_gate(input_size).to_instruction(), qr)
+        qc.append(iqft, qr)
 
     # This method is a work in progress
     elif method==3:
 
         for i_q in range(0, secret_int):
             qc.h(qr[i_q])
-            num_gates+=1
 
         for i_q in range(secret_int, num_qubits):
             qc.x(qr[i_q])
-            num_gates+=1
-            
-        depth += 1
-        
-        qc.append(inv_qft_gate(input_size).to_instruction(), qr)
+
+        qc.append(iqft, qr)
         
     else:
         exit("Invalid QFT method")
 
     # measure all qubits
     qc.measure(qr, cr)
-    num_gates += num_qubits
-    depth += 1
 
-    # save smaller circuit example for display
-    global QC_    
+    # save smaller circuit examples for display
+    global QC_, QFT_, QFTI_
     if QC_ == None or num_qubits <= 5:
-        if num_qubits < 9: QC_ = qc
+        if num_qubits < 9:
+            QC_ = qc
+            QFT_ = qft.definition
+            QFTI_ = iqft.definition
         
     # return a handle on the circuit
     return qc
 
-############### QFT Circuit
-
-def qft_gate(input_size):
-    global QFT_, num_gates, depth
-    qr = QuantumRegister(input_size); qc = QuantumCircuit(qr, name="qft")
-    
-    # Generate multiple groups of diminishing angle CRZs and H gate
-    for i_qubit in range(0, input_size):
-    
-        # start laying out gates from highest order qubit (the hidx)
-        hidx = input_size - i_qubit - 1
-        
-        # if not the highest order qubit, add multiple controlled RZs of decreasing angle
-        if hidx < input_size - 1:   
-            num_crzs = i_qubit
-            for j in range(0, num_crzs):
-                divisor = 2 ** (num_crzs - j)
-                qc.crz( math.pi / divisor , qr[hidx], qr[input_size - j - 1])
-                num_gates += 1
-                depth += 1
-            
-        # followed by an H gate (applied to all qubits)
-        qc.h(qr[hidx])
-        num_gates += 1
-        depth += 1
-        
-        qc.barrier()
-    
-    if QFT_ == None or input_size <= 5:
-        if input_size < 9: QFT_ = qc
-        
-    return qc
-
-############### Inverse QFT Circuit
-
-def inv_qft_gate(input_size):
-    global QFTI_, num_gates, depth
-    qr = QuantumRegister(input_size); qc = QuantumCircuit(qr, name="inv_qft")
-    
-    # Generate multiple groups of diminishing angle CRZs and H gate
-    for i_qubit in reversed(range(0, input_size)):
-    
-        # start laying out gates from highest order qubit (the hidx)
-        hidx = input_size - i_qubit - 1
-        
-        # precede with an H gate (applied to all qubits)
-        qc.h(qr[hidx])
-        num_gates += 1
-        depth += 1
-        
-        # if not the highest order qubit, add multiple controlled RZs of decreasing angle
-        if hidx < input_size - 1:   
-            num_crzs = i_qubit
-            for j in reversed(range(0, num_crzs)):
-                divisor = 2 ** (num_crzs - j)
-                qc.crz( -math.pi / divisor , qr[hidx], qr[input_size - j - 1])
-                num_gates += 1
-                depth += 1
-            
-        qc.barrier()  
-    
-    if QFTI_ == None or input_size <= 5:
-        if input_size < 9: QFTI_= qc
-        
-    return qc
-    
 # Define expected distribution calculated from applying the iqft to the prepared secret_int state
 def expected_dist(num_qubits, secret_int, counts):
     dist = {}
@@ -244,12 +165,14 @@ def analyze_and_print_result (qc, result, num_qubits, secret_int, num_shots, met
 
 # Execute program with default parameters
 def run (min_qubits = 2, max_qubits = 8, max_circuits = 3, num_shots = 100,
-        method=1, 
+        method=1, approximation_degree=0,
         backend_id='qasm_simulator', provider_backend=None,
         hub="ibm-q", group="open", project="main", exec_options=None):
 
     print("Quantum Fourier Transform Benchmark Program - Qiskit")
     print(f"... using circuit method {method}")
+    if approximation_degree != 0:
+        print(f"... using QFT approximation degree {approximation_degree}")
 
     # validate parameters (smallest circuit is 2 qubits)
     max_qubits = max(2, max_qubits)
@@ -286,7 +209,7 @@ def run (min_qubits = 2, max_qubits = 8, max_circuits = 3, num_shots = 100,
             if 2**(input_size) <= max_circuits:
                 s_range = list(range(num_circuits))
             else:
-                s_range = np.random.choice(2**(input_size), num_circuits, False)
+                s_range = seeding.get_rng("quantum-fourier-transform", num_qubits).choice(2**(input_size), num_circuits, False)
          
         elif method == 3:
             num_circuits = min(input_size, max_circuits)
@@ -294,7 +217,7 @@ def run (min_qubits = 2, max_qubits = 8, max_circuits = 3, num_shots = 100,
             if input_size <= max_circuits:
                 s_range = list(range(num_circuits))
             else:
-                s_range = np.random.choice(range(input_size), num_circuits, False)
+                s_range = seeding.get_rng("quantum-fourier-transform", num_qubits).choice(range(input_size), num_circuits, False)
         
         else:
             sys.exit("Invalid QFT method")
@@ -306,7 +229,8 @@ def run (min_qubits = 2, max_qubits = 8, max_circuits = 3, num_shots = 100,
 
             # create the circuit for given qubit size and secret string, store time metric
             ts = time.time()
-            qc = QuantumFourierTransform(num_qubits, s_int, method=method)
+            qc = QuantumFourierTransform(num_qubits, s_int, method=method,
+                    approximation_degree=approximation_degree_for(input_size, approximation_degree))
             metrics.store_metric(input_size, s_int, 'create_time', time.time()-ts)
 
             # collapse the sub-circuits used in this benchmark (for qiskit)
@@ -316,7 +240,7 @@ def run (min_qubits = 2, max_qubits = 8, max_circuits = 3, num_shots = 100,
 
             ex.submit_circuit(qc2, input_size, s_int, num_shots)
         
-        print(f"... number of gates, depth = {num_gates}, {depth}")
+        print(f"... number of gates, depth = {qc2.size()}, {qc2.depth()}")
         
         # Wait for some active circuits to complete; report metrics when groups complete
         ex.throttle_execution(metrics.finalize_group)
@@ -331,7 +255,8 @@ def run (min_qubits = 2, max_qubits = 8, max_circuits = 3, num_shots = 100,
     print("\nInverse QFT Circuit ="); print(QFTI_)
      
     # Plot metrics for all circuit sizes
-    metrics.plot_metrics(f"Benchmark Results - Quantum Fourier Transform ({method}) - Qiskit")
+    approx_label = f", approx {approximation_degree}" if approximation_degree != 0 else ""
+    metrics.plot_metrics(f"Benchmark Results - Quantum Fourier Transform ({method}{approx_label}) - Qiskit")
 
 # if main, execute method 1
 if __name__ == '__main__': run()
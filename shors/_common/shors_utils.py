@@ -2,6 +2,7 @@
 This file contains various helper functions for the various Shor's algorithm benchmarks,
 including order finding and factoring.
 """
+import functools
 import math
 from math import gcd
 import numpy as np
@@ -40,7 +41,7 @@ def generate_numbers():
 
 # Verifies base**order mod number = 1
 def verify_order(base, number, order):
-    return base ** order % number == 1
+    return pow(base, order, number) == 1
 
 # Generates the base for base**order mod number = 1
 def generate_base(number, order):
@@ -108,6 +109,7 @@ def modinv(a, m):
 # TODO: Merge the following Angle functions or change the names
 # Function that calculates the angle of a phase shift in the sequential QFT based on the binary digits of a.
 # a represents a possible value of the classical register
+# (the Qiskit benchmark applies these phases with one rotation per measured bit; the Cirq and Braket benchmarks use this)
 def getAngle(a, n):
     #convert the number a to a binary string with length n
     s=bin(int(a))[2:].zfill(n)
@@ -120,13 +122,17 @@ def getAngle(a, n):
     return angle
 
 # Function that calculates the array of angles to be used in the addition in Fourier Space
+# The angles are computed once for each (a, n), as a read-only array shared by all callers
+@functools.lru_cache(maxsize=None)
 def getAngles(a,n):
-    #convert the number a to a binary string with length n
+    #convert the number a to a binary string with length n, and take its first n digits
     s=bin(int(a))[2:].zfill(n)
-    angles=np.zeros([n])
-    for i in range(0, n):
-        for j in range(i,n):
-            if s[j]=='1':
-                angles[n-i-1]+=math.pow(2, -(j-i))
-        angles[n-i-1]*=np.pi
+    digits = np.frombuffer(s[:n].encode(), dtype=np.uint8) - ord('0')
+
+    # the angle for digit i is pi times the sum of the digits j >= i weighted by 2^-(j-i), in reverse order
+    # (the sums of distinct powers of 2 are exact, so the angles are the same as summed one digit at a time)
+    i, j = np.indices((n, n))
+    weights = np.where(j >= i, 2.0 ** (i - j), 0.0)
+    angles = (weights @ digits)[::-1] * np.pi
+    angles.setflags(write=False)
     return angles
\ No newline at end of file
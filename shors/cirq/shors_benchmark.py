@@ -3,6 +3,7 @@ Shor's Order Finding Algorithm Benchmark - Cirq
 """
 
 from collections import defaultdict
+import functools
 import math
 import sys
 import time
@@ -67,6 +68,8 @@ def ccphiADD(num_qubits, a):
 
 
 # Circuit that implements doubly controlled modular addition by a (num qubits should be bit count for number N)
+# The gate is built once for each (num_qubits, a, N) and shared by all the multipliers using it
+@functools.lru_cache(maxsize=None)
 def ccphiADDmodN(num_qubits, a, N):
     qr_ctl = cirq.GridQubit.rect(1,2,0)
     qr_main = cirq.GridQubit.rect(1,num_qubits + 1, 1)
@@ -115,6 +118,8 @@ def ccphiADDmodN_inv(num_qubits, a, N):
 
 
 # Creates circuit that implements single controlled modular multiplication by a. n represents the number of bits needed to represent the integer number N
+# The gate is built once for each (n, a, N)
+@functools.lru_cache(maxsize=None)
 def cMULTamodN(n, a, N):
     qr_ctl = cirq.GridQubit.rect(1,1,0)
     qr_x = cirq.GridQubit.rect(1,n,1)
@@ -148,9 +153,12 @@ def controlled_Ua(n, a, exponent, N):
     qr_ancilla = cirq.GridQubit.rect(1, 2,3)
     qc = cirq.Circuit()
 
+    # the gate multiplies by a^exponent mod N, computed without forming a^exponent (exponent is up to 2^(2n-1))
+    a_exp = pow(a, exponent, N)
+
     # Generate Gates
-    a_inv = modinv(a ** exponent, N)
-    cMULTamodN_gate = cMULTamodN(n, a ** exponent, N)
+    a_inv = modinv(a_exp, N)
+    cMULTamodN_gate = cMULTamodN(n, a_exp, N)
     cMULTamodN_inv_gate = cirq.inverse(cMULTamodN(n, a_inv, N))
 
     qc.append(cMULTamodN_gate.on(*qr_ctl,*qr_x,*qr_main,*qr_ancilla))
@@ -164,7 +172,7 @@ def controlled_Ua(n, a, exponent, N):
     if CUA_ == None or n <= 2:
         if n < 3: CUA_ = qc
 
-    return cirq_utils.to_gate(num_qubits=2*n+3, circ=qc, name=f"C-U^{a ** exponent}")
+    return cirq_utils.to_gate(num_qubits=2*n+3, circ=qc, name=f"C-U^{a_exp}")
 
 
 # Execute Shor's Order Finding Algorithm given a 'number' to factor,
@@ -2,24 +2,24 @@
 Shor's Order Finding Algorithm Benchmark - Qiskit
 """
 
+import functools
 import math
 import sys
-import time
 
 import numpy as np
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
-sys.path[1:1] = ["_common", "_common/qiskit", "shors/_common", "quantum-fourier-transform/qiskit"]
-sys.path[1:1] = ["../../_common", "../../_common/qiskit", "../../shors/_common", "../../quantum-fourier-transform/qiskit"]
+sys.path[1:1] = ["_common", "_common/qiskit", "shors/_common"]
+sys.path[1:1] = ["../../_common", "../../_common/qiskit", "../../shors/_common"]
 import execute as ex
 import metrics as metrics
-from shors_utils import getAngles, getAngle, modinv, generate_base, verify_order
-from qft_benchmark import inv_qft_gate
-from qft_benchmark import qft_gate
+import circuit_cache
+from flatten import flatten_circuit
+import seeding
+from shors_utils import getAngles, modinv, generate_base, verify_order
+from qft_library import inv_qft_gate, qft_gate
 
 
-np.random.seed(0)
-
 verbose = False
 
 QC_ = None
@@ -111,6 +111,12 @@ def ccphiADDmodN_inv(num_qubits, a, N):
     cchpiAddmodN_inv_circ.name = "inv_cchpiAddmodN"
     return  cchpiAddmodN_inv_circ
 
+# Return the doubly controlled modular adder as an instruction, built once for each (num_qubits, a mod N, N)
+# and shared by all the multipliers using it
+@functools.lru_cache(maxsize=None)
+def ccphiADDmodN_instruction(num_qubits, a, N):
+    return ccphiADDmodN(num_qubits, a % N, N).to_instruction()
+
 # Creates circuit that implements single controlled modular multiplication by a. n represents the number of bits
 # needed to represent the integer number N
 def cMULTamodN(n, a, N):
@@ -124,7 +130,7 @@ def cMULTamodN(n, a, N):
     qc.append(qft_gate(n+1), qr_main)
 
     for i in range(n):
-        ccphiADDmodN_gate = ccphiADDmodN(n, (2**i)*a % N, N)
+        ccphiADDmodN_gate = ccphiADDmodN_instruction(n, (2**i)*a % N, N)
 
         # Create relevant temporary qubit list
         qubits = [qr_ctl[0]]; qubits.extend([qr_x[i]])
@@ -141,6 +147,18 @@ def cMULTamodN(n, a, N):
 
     return qc
 
+# Return the controlled multiplier as an instruction, built once for each (n, a mod N, N)
+@functools.lru_cache(maxsize=None)
+def cMULTamodN_instruction(n, a, N):
+    return cMULTamodN(n, a % N, N).to_instruction()
+
+# Return the inverse of the controlled multiplier as an instruction, built once for each (n, a mod N, N)
+@functools.lru_cache(maxsize=None)
+def cMULTamodN_inv_instruction(n, a, N):
+    cMULTamodN_inv_gate = cMULTamodN_instruction(n, a, N).inverse()
+    cMULTamodN_inv_gate.name = "inv_cMULTamodN"
+    return cMULTamodN_inv_gate
+
 # Creates circuit that implements single controlled Ua gate. n represents the number of bits
 # needed to represent the integer number N
 def controlled_Ua(n,a,exponent,N):
@@ -148,12 +166,14 @@ def controlled_Ua(n,a,exponent,N):
     qr_x = QuantumRegister(n)
     qr_main = QuantumRegister(n)
     qr_ancilla = QuantumRegister(2)
-    qc = QuantumCircuit(qr_ctl, qr_x, qr_main,qr_ancilla, name = f"C-U^{a**exponent}")
+    # the gate multiplies by a^exponent mod N, computed without forming a^exponent (exponent is up to 2^(2n-1))
+    a_exp = pow(a, exponent, N)
+    qc = QuantumCircuit(qr_ctl, qr_x, qr_main,qr_ancilla, name = f"C-U^{a_exp}")
 
     # Generate Gates
-    a_inv = modinv(a**exponent,N)
-    cMULTamodN_gate = cMULTamodN(n, a**exponent, N)
-    cMULTamodN_inv_gate = cMULTamodN(n, a_inv, N).inverse(); cMULTamodN_inv_gate.name = "inv_cMULTamodN"
+    a_inv = modinv(a_exp,N)
+    cMULTamodN_gate = cMULTamodN_instruction(n, a_exp, N)
+    cMULTamodN_inv_gate = cMULTamodN_inv_instruction(n, a_inv, N)
 
     # Create relevant temporary qubit list
     qubits = [i for i in qr_ctl]; qubits.extend([i for i in qr_x]); qubits.extend([i for i in qr_main])
@@ -172,6 +192,15 @@ def controlled_Ua(n,a,exponent,N):
 
     return qc
 
+# Return the controlled Ua gate as an instruction; it depends only on a^exponent mod N,
+# so it is built once for each (n, a^exponent mod N, N) and shared by the counting qubits with the same multiplier
+def controlled_Ua_gate(n,a,exponent,N):
+    return controlled_Ua_instruction(n, pow(a, exponent, N), N)
+
+@functools.lru_cache(maxsize=None)
+def controlled_Ua_instruction(n,a_exp,N):
+    return controlled_Ua(n, a_exp, 1, N).to_instruction()
+
 # Execute Shor's Order Finding Algorithm given a 'number' to factor,
 # the 'base' of exponentiation, and the number of qubits required 'input_size'
 
@@ -203,7 +232,7 @@ def ShorsAlgorithm(number, base, method, verbose=verbose):
 
         # Apply Multiplication Gates for exponentiation
         for i in reversed(range(2*n)):
-            cUa_gate = controlled_Ua(n,int(base),2**(2*n-1-i),number)
+            cUa_gate = controlled_Ua_gate(n,int(base),2**(2*n-1-i),number)
 
             # Create relevant temporary qubit list
             qubits = [qr_counting[i]]; qubits.extend([i for i in qr_mult]);qubits.extend([i for i in qr_aux])
@@ -243,16 +272,17 @@ def ShorsAlgorithm(number, base, method, verbose=verbose):
             qc.x(qr_counting).c_if(cr_aux,1)
             qc.h(qr_counting)
 
-            cUa_gate = controlled_Ua(n, base,2**(2*n-1-k), number)
+            cUa_gate = controlled_Ua_gate(n, base,2**(2*n-1-k), number)
 
             # Create relevant temporary qubit list
             qubits = [qr_counting[0]]; qubits.extend([i for i in qr_mult]);qubits.extend([i for i in qr_aux])
 
             qc.append(cUa_gate, qubits)
 
-            # perform inverse QFT --> Rotations conditioned on previous outcomes
-            for i in range(2**k):
-                qc.p(getAngle(i, k), qr_counting[0]).c_if(cr_data, i)
+            # perform inverse QFT --> Rotations conditioned on previous outcomes, one for each measured bit
+            # (the phase for the outcome i of bits 0 to k-1, getAngle(i, k), is the sum of pi/2^(k-j) for each 1 bit j)
+            for j in range(k):
+                qc.p(np.pi / 2**(k-j), qr_counting[0]).c_if(cr_data[j], 1)
 
             qc.h(qr_counting)
             qc.measure(qr_counting[0], cr_data[k])
@@ -262,7 +292,7 @@ def ShorsAlgorithm(number, base, method, verbose=verbose):
     if QC_ == None or n <= 2:
         if n < 3: QC_ = qc
     if QFT_ == None or n <= 2:
-        if n < 3: QFT_ = qft_gate(n+1)
+        if n < 3: QFT_ = qft_gate(n+1).definition
 
     return qc
 
@@ -376,54 +406,57 @@ def run (min_qubits=3, max_circuits=1, max_qubits=18, num_shots=100, method = 1,
     ex.set_execution_target(backend_id, provider_backend=provider_backend,
             hub=hub, group=group, project=project, exec_options=exec_options)
  
-    # Execute Benchmark Program N times for multiple circuit sizes
-    # Accumulate metrics asynchronously as circuits complete
-    for num_qubits in range(min_qubits, max_qubits + 1, qubit_multiple):
+    # Generate circuits for each circuit size, ahead of their execution
+    # (runs in a background thread; see execute_pipelined)
+    def generate_circuits():
+        for num_qubits in range(min_qubits, max_qubits + 1, qubit_multiple):
 
-        input_size = num_qubits - 1
+            input_size = num_qubits - 1
 
-        if method == 1: num_bits = int((num_qubits -2)/4)
-        elif method == 2: num_bits = int((num_qubits -3)/2)
-        elif method == 3: num_bits = int((num_qubits -2)/2)
+            if method == 1: num_bits = int((num_qubits -2)/4)
+            elif method == 2: num_bits = int((num_qubits -3)/2)
+            elif method == 3: num_bits = int((num_qubits -2)/2)
 
-        # determine number of circuits to execute for this group
-        num_circuits = min(2 ** (input_size), max_circuits)
-        
-        print(f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}")
+            # determine number of circuits to execute for this group
+            num_circuits = min(2 ** (input_size), max_circuits)
 
-        for _ in range(num_circuits):
+            # announce the group, printed when its circuits are submitted (see execute_pipelined)
+            yield f"************\nExecuting [{num_circuits}] circuits with num_qubits = {num_qubits}"
 
-            base = 1
-            while base == 1:
-                # Ensure N is a number using the greatest bit
-                number = np.random.randint(2 ** (num_bits - 1) + 1, 2 ** num_bits)
-                order = np.random.randint(2, number)
-                base = generate_base(number, order)
+            for circuit_index in range(num_circuits):
 
-            # Checking if generated order can be reduced. Can also run through prime list in shors utils
-            if order % 2 == 0: order = 2
-            if order % 3 == 0: order = 3
+                # draw the number and order from a generator seeded for this circuit
+                rng = seeding.get_rng("shors", num_qubits, circuit_index)
 
-            number_order = (number, order)
+                base = 1
+                while base == 1:
+                    # Ensure N is a number using the greatest bit
+                    number = int(rng.integers(2 ** (num_bits - 1) + 1, 2 ** num_bits))
+                    order = int(rng.integers(2, number))
+                    base = generate_base(number, order)
 
-            if verbose: print(f"Generated {number=}, {base=}, {order=}")
+                # Checking if generated order can be reduced. Can also run through prime list in shors utils
+                if order % 2 == 0: order = 2
+                if order % 3 == 0: order = 3
 
-            # create the circuit for given qubit size and order, store time metric
-            ts = time.time()
-            qc = ShorsAlgorithm(number, base, method=method, verbose=verbose)
-            metrics.store_metric(num_qubits, number_order, 'create_time', time.time()-ts)
+                number_order = (number, order)
 
-            # collapse the 4 sub-circuit levels used in this benchmark (for qiskit)
-            qc = qc.decompose().decompose().decompose().decompose()
+                if verbose: print(f"Generated {number=}, {base=}, {order=}")
 
-            # submit circuit for execution on target (simulator, cloud simulator, or hardware)
-            ex.submit_circuit(qc, num_qubits, number_order, num_shots)
+                # create the circuit for given qubit size and order, or load it from the circuit cache,
+                # inlining the sub-circuits used in this benchmark (for qiskit)
+                # (the base is in the key, as it comes from the order before reduction, so the circuit id does not decide it)
+                qc, create_time = circuit_cache.get_circuit(
+                        lambda: ShorsAlgorithm(number, base, method=method, verbose=verbose),
+                        "shors", method, num_qubits, number_order, prepare=flatten_circuit,
+                        sources=(__file__, qft_gate, getAngles), options=[base])
 
-        # Wait for some active circuits to complete; report metrics when groups complete
-        ex.throttle_execution(metrics.finalize_group)
+                # pass circuit on for execution on target (simulator, cloud simulator, or hardware)
+                yield qc, num_qubits, number_order, num_shots, create_time
 
-    # Wait for all active circuits to complete; report metrics when groups complete
-    ex.finalize_execution(metrics.finalize_group)
+    # Execute Benchmark Program N times for multiple circuit sizes
+    # Accumulate metrics asynchronously as circuits complete; report metrics when groups complete
+    ex.execute_pipelined(generate_circuits(), metrics.finalize_group)
 
     # print the last circuit created
     print("Sample Circuit:"); print(QC_ if QC_ != None else "  ... too large!")